@@ -0,0 +1,102 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+# aiobotocore is optional: without it, calls run on the sync boto3 client in
+# worker threads, which keeps the same async code paths working
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session as get_aio_session
+except ImportError:
+    get_aio_session = None
+
+
+class AsyncClient:
+    """
+    Awaitable view of a boto3 client: `await client.list_objects_v2(...)`.
+    Calls go through aiobotocore when an aio client is given, otherwise
+    through the sync client on a worker thread. Either way at most
+    `concurrency` calls are in flight.
+    """
+
+    def __init__(self, sync_client, concurrency, aio_client=None):
+        self.sync_client = sync_client
+        self.aio_client = aio_client
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.exceptions = sync_client.exceptions
+
+    def __getattr__(self, name):
+        target = getattr(self.aio_client or self.sync_client, name)
+
+        async def call(*args, **kwargs):
+            async with self.semaphore:
+                if self.aio_client is not None:
+                    return await target(*args, **kwargs)
+                return await asyncio.to_thread(target, *args, **kwargs)
+
+        return call
+
+
+@asynccontextmanager
+async def async_client(sync_client, concurrency):
+    """
+    AsyncClient for the same service, region and endpoint as sync_client.
+    """
+    if get_aio_session is None:
+        yield AsyncClient(sync_client, concurrency)
+        return
+
+    meta = sync_client.meta
+    config = AioConfig(max_pool_connections=concurrency, retries={"max_attempts": 10, "mode": "standard"})
+    async with get_aio_session().create_client(
+        meta.service_model.service_name,
+        region_name=meta.region_name,
+        endpoint_url=meta.endpoint_url,
+        config=config,
+    ) as aio_client:
+        yield AsyncClient(sync_client, concurrency, aio_client)
+
+
+def run(main, concurrency):
+    """
+    asyncio.run() with a default executor big enough for `concurrency`
+    blocking calls made through asyncio.to_thread.
+    """
+    async def with_executor():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+        return await main
+
+    return asyncio.run(with_executor())
+
+
+def deadline(context, margin_ms):
+    """
+    Monotonic time margin_ms before the Lambda times out, or None without a
+    context (no budget).
+    """
+    if context is None:
+        return None
+    return time.monotonic() + (context.get_remaining_time_in_millis() - margin_ms) / 1000
+
+
+def expired(at):
+    return at is not None and time.monotonic() >= at
+
+
+async def wait_all(tasks, at):
+    """
+    Wait for the tasks until the deadline, then cancel the rest and let them
+    run their cleanup. Returns the number of tasks cancelled. A call already
+    running on a worker thread still completes; only the work after it is
+    abandoned.
+    """
+    if not tasks:
+        return 0
+    timeout = None if at is None else max(0.0, at - time.monotonic())
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    return len(pending)
@@ -0,0 +1,226 @@
+import functools
+import json
+import os
+import threading
+import time
+import weakref
+
+import boto3
+from botocore.config import Config
+
+# Default HTTP pool per client. botocore's default of 10 makes thread pools
+# larger than that queue for a connection.
+MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "50"))
+
+# Points DynamoDB at a local stand-in when testing offline
+DYNAMODB_ENDPOINT_URL = os.environ.get("DYNAMODB_ENDPOINT_URL")
+
+_lock = threading.Lock()
+_clients = {}
+_resources = {}
+_tables = {}
+_hooked_sessions = set()
+
+
+class RequestStats:
+    """
+    Per-operation request counters ("service.Operation" -> count, errors,
+    total and max latency), fed by botocore event hooks. Latency covers the
+    whole call including retries.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {}
+
+    def _record(self, operation, elapsed_ms, error):
+        with self.lock:
+            stats = self.operations.setdefault(
+                operation, {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+            )
+            stats["count"] += 1
+            stats["errors"] += int(error)
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    def before_call(self, context=None, **kwargs):
+        if context is not None:
+            context["stats_started"] = time.perf_counter()
+
+    def after_call(self, event_name, context=None, http_response=None, **kwargs):
+        self._finish(event_name, context, http_response is None or http_response.status_code >= 300)
+
+    def after_call_error(self, event_name, context=None, **kwargs):
+        self._finish(event_name, context, True)
+
+    def _finish(self, event_name, context, error):
+        started = (context or {}).get("stats_started")
+        if started is None:
+            return
+        _, service, operation = event_name.split(".", 2)
+        self._record(f"{service}.{operation}", (time.perf_counter() - started) * 1000, error)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                operation: dict(stats, mean_ms=round(stats["total_ms"] / stats["count"], 1))
+                for operation, stats in self.operations.items()
+            }
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+
+
+stats = RequestStats()
+
+
+def log_request_stats(handler):
+    """
+    Decorator for Lambda handlers: counts the AWS requests of each
+    invocation and prints them as one JSON line when it returns or raises.
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        stats.reset()
+        try:
+            return handler(event, context)
+        finally:
+            operations = stats.snapshot()
+            if operations:
+                print(json.dumps({"aws_requests": operations}))
+    return wrapper
+
+
+class _Holder:
+    __slots__ = ("obj", "__weakref__")
+
+    def __init__(self, obj):
+        self.obj = obj
+
+
+class PerThread:
+    """
+    Stands in for a boto3 object that must not be shared between threads
+    (resources and their Tables). Each thread that uses it gets its own,
+    built by factory() on first use; when the thread exits the object goes
+    back to an idle list for the next new thread, so per-invocation thread
+    pools don't rebuild them every time.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._local = threading.local()
+        self._idle = []
+        self._idle_lock = threading.Lock()
+
+    def get(self):
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            with self._idle_lock:
+                obj = self._idle.pop() if self._idle else None
+            if obj is None:
+                obj = self._factory()
+            holder = self._local.holder = _Holder(obj)
+            # Runs when the thread's locals are dropped at exit
+            weakref.finalize(holder, self._release, obj)
+        return holder.obj
+
+    def _release(self, obj):
+        with self._idle_lock:
+            self._idle.append(obj)
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def client_config(max_pool_connections=None):
+    """
+    Pool sized for the handler's concurrency, adaptive (client-side rate
+    limited) retries and TCP keepalive on pooled connections.
+    """
+    return Config(
+        max_pool_connections=max_pool_connections or MAX_POOL_CONNECTIONS,
+        retries={"max_attempts": 10, "mode": "adaptive"},
+        tcp_keepalive=True,
+    )
+
+
+def get_session():
+    """
+    boto3's default session, with the request counters hooked in once.
+    """
+    with _lock:
+        if boto3.DEFAULT_SESSION is None:
+            boto3.setup_default_session()
+        session = boto3.DEFAULT_SESSION
+        if id(session) not in _hooked_sessions:
+            session.events.register("before-call", stats.before_call)
+            session.events.register("after-call", stats.after_call)
+            session.events.register("after-call-error", stats.after_call_error)
+            _hooked_sessions.add(id(session))
+        return session
+
+
+def default_endpoint(service, endpoint_url):
+    if endpoint_url is None and service == "dynamodb":
+        return DYNAMODB_ENDPOINT_URL
+    return endpoint_url
+
+
+def client(service, region=None, endpoint_url=None, max_pool_connections=None):
+    """
+    Shared low-level client, created once per container for each service,
+    region, endpoint and pool size.
+    """
+    endpoint_url = default_endpoint(service, endpoint_url)
+    key = (service, region, endpoint_url, max_pool_connections)
+    if key not in _clients:
+        session = get_session()
+        with _lock:
+            if key not in _clients:
+                _clients[key] = session.client(
+                    service, region_name=region, endpoint_url=endpoint_url,
+                    config=client_config(max_pool_connections)
+                )
+    return _clients[key]
+
+
+def new_resource(service, region=None, endpoint_url=None, max_pool_connections=None):
+    session = get_session()
+    # Sessions aren't thread-safe either, so build one resource at a time
+    with _lock:
+        return session.resource(
+            service, region_name=region, endpoint_url=endpoint_url,
+            config=client_config(max_pool_connections)
+        )
+
+
+def resource(service, region=None, endpoint_url=None, max_pool_connections=None):
+    """
+    Resource that can be shared across threads: boto3 resources aren't
+    thread-safe, so calls go to a PerThread copy. Cached like client().
+    """
+    endpoint_url = default_endpoint(service, endpoint_url)
+    key = (service, region, endpoint_url, max_pool_connections)
+    with _lock:
+        if key not in _resources:
+            _resources[key] = PerThread(
+                functools.partial(new_resource, service, region, endpoint_url, max_pool_connections)
+            )
+    return _resources[key]
+
+
+def table(name, region=None, endpoint_url=None):
+    """
+    DynamoDB Table that can be shared across threads, so handlers don't
+    rebuild it per invocation. Each thread's Table has a resource of its own.
+    """
+    endpoint_url = default_endpoint("dynamodb", endpoint_url)
+    key = (name, region, endpoint_url)
+    with _lock:
+        if key not in _tables:
+            _tables[key] = PerThread(
+                lambda: new_resource("dynamodb", region, endpoint_url).Table(name)
+            )
+    return _tables[key]
@@ -0,0 +1,142 @@
+import json
+import math
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+
+class Budget:
+    """
+    Time left in one invocation. exhausted() turns true once less than
+    margin_ms is left, so long jobs can stop, checkpoint and hand over to
+    the next invocation instead of being killed at the timeout. Without a
+    context the budget never runs out.
+    """
+
+    def __init__(self, context, margin_ms=5000):
+        self.context = context
+        self.margin_ms = margin_ms
+
+    def remaining_ms(self):
+        if self.context is None:
+            return float("inf")
+        return self.context.get_remaining_time_in_millis()
+
+    def exhausted(self):
+        return self.remaining_ms() <= self.margin_ms
+
+
+class CheckpointBusy(Exception):
+    """
+    Another run of the job holds its checkpoint.
+    """
+
+
+def run_id(context):
+    """
+    Owner id for a run's checkpoint lease: the Lambda request id, or a
+    random one outside Lambda.
+    """
+    return getattr(context, "aws_request_id", None) or uuid.uuid4().hex
+
+
+def lease_seconds(context, default=900):
+    """
+    How long a run may hold its job's checkpoint: until it times out, so the
+    lease of a run that dies runs out when it would have ended anyway.
+    """
+    if context is None:
+        return default
+    return math.ceil(context.get_remaining_time_in_millis() / 1000)
+
+
+class Checkpoints:
+    """
+    Progress of resumable jobs, one item per job_id. State is stored as a
+    DynamoDB map, so it must not contain floats.
+
+    A run takes a lease on its job's item before reading the state, so a
+    scheduled run and a resumed one never work from the same checkpoint at
+    once; save() and clear() only succeed for the run holding the lease.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def load(self, job_id):
+        item = self.table.get_item(Key={"job_id": job_id}, ConsistentRead=True).get("Item")
+        return item.get("state") if item else None
+
+    def acquire(self, job_id, owner, lease_seconds):
+        """
+        Take the job's lease and return its saved state (None if there is
+        none), in one conditional write. Raises CheckpointBusy while another
+        run's lease is live.
+        """
+        now = int(time.time())
+        try:
+            response = self.table.update_item(
+                Key={"job_id": job_id},
+                UpdateExpression="SET #owner = :o, lease_until = :until",
+                ConditionExpression="attribute_not_exists(lease_until) OR lease_until < :now OR #owner = :o",
+                ExpressionAttributeNames={"#owner": "owner"},
+                ExpressionAttributeValues={":o": owner, ":until": now + lease_seconds, ":now": now},
+                ReturnValues="ALL_NEW",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                raise CheckpointBusy(job_id)
+            raise
+        return response["Attributes"].get("state")
+
+    def save(self, job_id, owner, state):
+        """
+        Store the state and give up the lease, so the run that picks the job
+        up next can take it. Raises CheckpointBusy if the lease was lost.
+        """
+        try:
+            self.table.put_item(
+                Item={"job_id": job_id, "state": state, "saved_at": int(time.time()),
+                      "owner": owner, "lease_until": 0},
+                ConditionExpression="#owner = :o",
+                ExpressionAttributeNames={"#owner": "owner"},
+                ExpressionAttributeValues={":o": owner},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                raise CheckpointBusy(job_id)
+            raise
+
+    def clear(self, job_id, owner):
+        """
+        Drop the checkpoint and the lease once the job is done. Returns False
+        if another run had taken the lease over.
+        """
+        try:
+            self.table.delete_item(
+                Key={"job_id": job_id},
+                ConditionExpression="#owner = :o",
+                ExpressionAttributeNames={"#owner": "owner"},
+                ExpressionAttributeValues={":o": owner},
+            )
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+
+
+def resume_later(lambda_client, context, payload=None):
+    """
+    Invoke this function again asynchronously to pick up from the checkpoint
+    right away rather than at the next scheduled run. Does nothing outside
+    Lambda (no context).
+    """
+    if context is None:
+        return
+    lambda_client.invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType="Event",
+        Payload=json.dumps(payload or {}),
+    )
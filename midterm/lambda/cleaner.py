@@ -1,32 +1,320 @@
 import os
-import boto3
 import time
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 
-s3 = boto3.client("s3")
-dynamodb = boto3.resource("dynamodb")
-lambda_client = boto3.client("lambda")
+import aio
+import aws_clients
+from budget import Budget, CheckpointBusy, Checkpoints, lease_seconds, run_id
+
+s3 = aws_clients.client("s3")
+dynamodb = aws_clients.resource("dynamodb")
+lambda_client = aws_clients.client("lambda")
 
 DST_BUCKET = os.getenv("DST_BUCKET")
 TABLE_NAME = os.getenv("TABLE_NAME")
+# Where a run that ran out of time left off in the index; the next scheduled
+# run resumes there instead of re-reading pages from the start
+CHECKPOINT_TABLE_NAME = os.getenv("CHECKPOINT_TABLE_NAME")
 SELF_INVOKE_ARN = os.getenv("SELF_INVOKE_ARN")
 
-table = dynamodb.Table(TABLE_NAME)
+# Threads running delete batches
+REAPER_WORKERS = int(os.getenv("REAPER_WORKERS", "8"))
+# Stop starting new batches when less than this is left before the timeout
+SAFETY_MARGIN_MS = int(os.getenv("SAFETY_MARGIN_MS", "5000"))
+# "threads" reaps batches on a thread pool, "async" on an event loop
+# (aiobotocore when installed) with REAPER_WORKERS calls in flight
+IO_MODE = os.getenv("IO_MODE", "threads")
+
+# DeleteObjects takes at most 1,000 keys, BatchWriteItem at most 25 requests
+S3_DELETE_BATCH = 1000
+DDB_DELETE_BATCH = 25
+# Give up on UnprocessedItems after this many retries of one BatchWriteItem
+DDB_MAX_RETRIES = 5
+
+table = aws_clients.table(TABLE_NAME)
+checkpoints = Checkpoints(aws_clients.table(CHECKPOINT_TABLE_NAME)) if CHECKPOINT_TABLE_NAME else None
+CHECKPOINT_JOB_ID = "midterm-cleaner"
+
+
+def disowned_pages(cutoff, start_key=None):
+    """
+    Yield (items, start_key) for every page of disowned copies older than
+    cutoff from the GSI, starting after start_key. A page's start_key is
+    where a later run has to resume to see that page again.
+    """
+    kwargs = {
+        "IndexName": "DisownedIndex",
+        "KeyConditionExpression": "IsDisowned = :d AND DeleteTime <= :t",
+        "ExpressionAttributeValues": {":d": "true", ":t": cutoff},
+    }
+    while True:
+        if start_key:
+            kwargs["ExclusiveStartKey"] = start_key
+        response = table.query(**kwargs)
+        yield response.get("Items", []), start_key
+        if "LastEvaluatedKey" not in response:
+            return
+        start_key = response["LastEvaluatedKey"]
+
+
+def load_start_key(owner, lease_seconds):
+    """
+    Take the checkpoint's lease and return where the last run stopped.
+    Raises CheckpointBusy while another run holds it, so a slow run and the
+    next scheduled one never reap the same pages.
+    """
+    if not checkpoints:
+        return None
+    state = checkpoints.acquire(CHECKPOINT_JOB_ID, owner, lease_seconds)
+    return state["start_key"] if state else None
+
+
+def save_progress(resume_key, owner):
+    """
+    Checkpoint where the next run has to resume, or clear the checkpoint
+    once every batch up to the end of the index was done (or failed, to be
+    retried when the next run starts over). Either way the lease is let go.
+    """
+    if not checkpoints:
+        return
+    if resume_key:
+        try:
+            checkpoints.save(CHECKPOINT_JOB_ID, owner, {"start_key": resume_key})
+        except CheckpointBusy:
+            print("Checkpoint lease was taken over by another run; not saving progress")
+    else:
+        checkpoints.clear(CHECKPOINT_JOB_ID, owner)
+
+
+class Progress:
+    """
+    Which pages of the index still have batches this run didn't finish:
+    not started before the time budget ran out, skipped or cancelled at it.
+    The next run resumes at the first of them, so nothing is skipped over.
+    """
+
+    def __init__(self, owner=None):
+        # Holder of the checkpoint lease
+        self.owner = owner
+        # Start key of every page read, by page number
+        self.page_keys = []
+        self.unfinished = set()
+        self.reaped = 0
+        self.batches = 0
+
+    def add_page(self, page_key):
+        self.page_keys.append(page_key)
+        return len(self.page_keys) - 1
+
+    def stop_at(self, page_number):
+        self.unfinished.add(page_number)
+
+    def finish(self, page_number, result=None, error=None):
+        """
+        Record a batch's outcome: a reaped count, None if it was left
+        unfinished, or the error it failed with.
+        """
+        if error is not None:
+            print(f"Delete batch failed, will retry next run: {error}")
+        elif result is None:
+            self.unfinished.add(page_number)
+        else:
+            self.reaped += result
+
+    def resume_key(self):
+        """
+        Start key of the first page with unfinished batches ({} for the
+        first page of the index), or None if there are none.
+        """
+        if not self.unfinished:
+            return None
+        return self.page_keys[min(self.unfinished)] or {}
+
+    def report(self):
+        resume_key = self.resume_key()
+        save_progress(resume_key, self.owner)
+        stopped_early = resume_key is not None
+        print(f"Reaped {self.reaped} disowned copies in {self.batches} batches"
+              + (" (stopped early to stay within the time budget)" if stopped_early else ""))
+        return {"reaped": self.reaped, "batches": self.batches, "stopped_early": stopped_early}
+
+
+def delete_table_items(keys, budget=None, max_retries=DDB_MAX_RETRIES):
+    """
+    Delete table items with BatchWriteItem, 25 per call, retrying unprocessed
+    ones up to max_retries times per call (then RuntimeError). With a budget,
+    stops between calls once it is exhausted and returns False; the items
+    left behind point at copies already gone from S3 and are cleared by the
+    next run.
+    """
+    for start in range(0, len(keys), DDB_DELETE_BATCH):
+        if budget and budget.exhausted():
+            return False
+        requests = [{"DeleteRequest": {"Key": key}} for key in keys[start:start + DDB_DELETE_BATCH]]
+        attempt = 0
+        while requests:
+            response = dynamodb.batch_write_item(RequestItems={TABLE_NAME: requests})
+            requests = response.get("UnprocessedItems", {}).get(TABLE_NAME, [])
+            if not requests:
+                break
+            attempt += 1
+            if attempt > max_retries:
+                raise RuntimeError(
+                    f"{len(requests)} items still unprocessed for {TABLE_NAME} after {max_retries} retries"
+                )
+            time.sleep(min(0.05 * (2 ** (attempt - 1)), 1))
+    return True
+
 
+def deleted_keys(items, response):
+    """
+    Table keys of the copies DeleteObjects reported no error for.
+    """
+    failed = {error["Key"] for error in response.get("Errors", [])}
+    for error in response.get("Errors", []):
+        print(f"Failed to delete {error['Key']}: {error.get('Code')}")
+    return [
+        {"OriginalObj": item["OriginalObj"], "CopyTimestamp": item["CopyTimestamp"]}
+        for item in items if item["CopyObj"] not in failed
+    ]
 
+
+def reap_batch(items, budget=None, hard_budget=None):
+    """
+    Delete up to 1,000 copies from S3 with one DeleteObjects call, then drop
+    the table items of the copies that were actually deleted. Copies that
+    failed stay in the table and are retried on the next run.
+
+    Returns the number reaped, or None if the batch was left unfinished:
+    budget was already exhausted when it got a thread, or hard_budget (a
+    smaller margin) stopped the table deletes partway.
+    """
+    if budget and budget.exhausted():
+        return None
+    response = s3.delete_objects(
+        Bucket=DST_BUCKET,
+        Delete={"Objects": [{"Key": item["CopyObj"]} for item in items], "Quiet": True},
+    )
+    keys = deleted_keys(items, response)
+    return len(keys) if delete_table_items(keys, hard_budget) else None
+
+
+async def reap_batch_async(s3_async, items, budget=None, hard_budget=None):
+    """
+    reap_batch() with the S3 delete on the async client. Cancelling it
+    doesn't stop a table delete already running on a worker thread (and the
+    event loop waits for those threads before it closes), so the thread
+    stops itself at hard_budget instead.
+    """
+    if budget and budget.exhausted():
+        return None
+    response = await s3_async.delete_objects(
+        Bucket=DST_BUCKET,
+        Delete={"Objects": [{"Key": item["CopyObj"]} for item in items], "Quiet": True},
+    )
+    keys = deleted_keys(items, response)
+    return len(keys) if await asyncio.to_thread(delete_table_items, keys, hard_budget) else None
+
+
+async def handler_async(event, context, start_key=None, owner=None):
+    now = int(datetime.utcnow().timestamp())
+    # Stop starting batches at the safety margin; at a fifth of it, stop
+    # table deletes and cancel whatever is left
+    budget = Budget(context, SAFETY_MARGIN_MS)
+    hard_budget = Budget(context, SAFETY_MARGIN_MS // 5)
+    cancel_at = aio.deadline(context, SAFETY_MARGIN_MS // 5)
+
+    progress = Progress(owner)
+    in_flight = {}
+
+    def collect(done):
+        for task in done:
+            page_number = in_flight.pop(task)
+            if task.cancelled():
+                progress.finish(page_number, None)
+            else:
+                progress.finish(page_number, None if task.exception() else task.result(), task.exception())
+
+    # At most REAPER_WORKERS batches in flight, like the threads mode
+    async with aio.async_client(s3, REAPER_WORKERS) as s3_async:
+        pages = disowned_pages(now - 10, start_key)
+        stopped = False
+        while not stopped:
+            page = await asyncio.to_thread(next, pages, None)
+            if page is None:
+                break
+            page, page_key = page
+            page_number = progress.add_page(page_key)
+            for start in range(0, len(page), S3_DELETE_BATCH):
+                while len(in_flight) >= REAPER_WORKERS:
+                    done, _ = await asyncio.wait(list(in_flight), return_when=asyncio.FIRST_COMPLETED)
+                    collect(done)
+                if budget.exhausted():
+                    progress.stop_at(page_number)
+                    stopped = True
+                    break
+                batch = page[start:start + S3_DELETE_BATCH]
+                in_flight[asyncio.ensure_future(reap_batch_async(s3_async, batch, budget, hard_budget))] = page_number
+                progress.batches += 1
+        await aio.wait_all(list(in_flight), cancel_at)
+        collect(list(in_flight))
+
+    return await asyncio.to_thread(progress.report)
+
+
+@aws_clients.log_request_stats
 def handler(event, context):
+    owner = run_id(context)
+    try:
+        start_key = load_start_key(owner, lease_seconds(context))
+    except CheckpointBusy:
+        print("Another run is still reaping; skipping this one")
+        return {"reaped": 0, "batches": 0, "stopped_early": False, "skipped": True}
+
+    if IO_MODE == "async":
+        return aio.run(handler_async(event, context, start_key, owner), REAPER_WORKERS)
+
     now = int(datetime.utcnow().timestamp())
+    # Stop starting batches at the safety margin, stop table deletes
+    # partway at a fifth of it
+    budget = Budget(context, SAFETY_MARGIN_MS)
+    hard_budget = Budget(context, SAFETY_MARGIN_MS // 5)
 
-    # Query DynamoDB for disowned copies older than 10 seconds
-    response = table.query(
-        IndexName="DisownedIndex",
-        KeyConditionExpression="IsDisowned = :d AND DeleteTime <= :t",
-        ExpressionAttributeValues={":d": "true", ":t": now - 10}
-    )
+    progress = Progress(owner)
+    in_flight = {}
+
+    def collect(done):
+        for future in done:
+            page_number = in_flight.pop(future)
+            try:
+                progress.finish(page_number, future.result())
+            except Exception as e:
+                progress.finish(page_number, error=e)
 
-    for item in response.get("Items", []):
-        s3.delete_object(Bucket=DST_BUCKET, Key=item["CopyObj"])
-        table.delete_item(
-            Key={"OriginalObj": item["OriginalObj"], "CopyTimestamp": item["CopyTimestamp"]}
-        )
+    # Query DynamoDB for disowned copies older than 10 seconds, one page at a
+    # time from where the last run stopped, and fan the delete batches out
+    # to a thread pool. At most REAPER_WORKERS batches are in flight, so the
+    # next page is only read once there is a thread free for it.
+    with ThreadPoolExecutor(max_workers=REAPER_WORKERS) as pool:
+        stopped = False
+        for page, page_key in disowned_pages(now - 10, start_key):
+            page_number = progress.add_page(page_key)
+            for start in range(0, len(page), S3_DELETE_BATCH):
+                while len(in_flight) >= REAPER_WORKERS:
+                    done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                    collect(done)
+                if budget.exhausted():
+                    progress.stop_at(page_number)
+                    stopped = True
+                    break
+                batch = page[start:start + S3_DELETE_BATCH]
+                in_flight[pool.submit(reap_batch, batch, budget, hard_budget)] = page_number
+                progress.batches += 1
+            if stopped:
+                break
+        collect(wait(list(in_flight)).done)
 
+    # Anything not reaped is still in the index and is picked up next minute
+    return progress.report()
@@ -0,0 +1,139 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+MB = 1024 * 1024
+
+# Objects above this are copied with parallel UploadPartCopy ranges instead
+# of a single CopyObject (which is slow for multi-GB objects and fails above 5 GB)
+MULTIPART_THRESHOLD = int(os.getenv("COPY_MULTIPART_THRESHOLD", str(256 * MB)))
+PART_SIZE = int(os.getenv("COPY_PART_SIZE", str(64 * MB)))
+CONCURRENCY = int(os.getenv("COPY_CONCURRENCY", "10"))
+
+# S3 multipart limits
+MIN_PART_SIZE = 5 * MB
+MAX_PARTS = 10000
+
+
+def part_ranges(size, part_size):
+    """
+    Split [0, size) into inclusive byte ranges for UploadPartCopy, growing the
+    part size if needed to stay within S3's 10,000 part limit.
+    """
+    part_size = max(part_size, MIN_PART_SIZE, -(-size // MAX_PARTS))
+    return [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+
+def copy_source(bucket, key):
+    return {"Bucket": bucket, "Key": key}
+
+
+def part_copy_requests(head, src_bucket, src_key, dst_bucket, dst_key, upload_id, part_size):
+    """
+    UploadPartCopy arguments for every part, pinned to the source ETag so a
+    concurrent overwrite can't mix parts of two versions.
+    """
+    return [
+        {
+            "Bucket": dst_bucket,
+            "Key": dst_key,
+            "UploadId": upload_id,
+            "PartNumber": part_number,
+            "CopySource": copy_source(src_bucket, src_key),
+            "CopySourceIfMatch": head["ETag"],
+            "CopySourceRange": f"bytes={first}-{last}",
+        }
+        for part_number, (first, last) in enumerate(part_ranges(head["ContentLength"], part_size), start=1)
+    ]
+
+
+def upload_args(head, dst_bucket, dst_key):
+    # Multipart copy doesn't carry metadata over, so set it on the upload
+    return {
+        "Bucket": dst_bucket,
+        "Key": dst_key,
+        "ContentType": head.get("ContentType", "binary/octet-stream"),
+        "Metadata": head.get("Metadata", {}),
+    }
+
+
+def copy(s3, src_bucket, src_key, dst_bucket, dst_key, size=None,
+         threshold=MULTIPART_THRESHOLD, part_size=PART_SIZE, concurrency=CONCURRENCY):
+    """
+    Server-side copy of one object. Small objects use a single CopyObject;
+    large ones use a multipart upload whose parts are copied in parallel.
+    size can be passed from the S3 event to skip the HeadObject call for
+    small objects.
+    """
+    if size is not None and size <= threshold:
+        s3.copy_object(Bucket=dst_bucket, Key=dst_key, CopySource=copy_source(src_bucket, src_key))
+        return "single"
+
+    head = s3.head_object(Bucket=src_bucket, Key=src_key)
+    if head["ContentLength"] <= threshold:
+        s3.copy_object(Bucket=dst_bucket, Key=dst_key, CopySource=copy_source(src_bucket, src_key))
+        return "single"
+
+    upload_id = s3.create_multipart_upload(**upload_args(head, dst_bucket, dst_key))["UploadId"]
+
+    def copy_part(request):
+        response = s3.upload_part_copy(**request)
+        return {"PartNumber": request["PartNumber"], "ETag": response["CopyPartResult"]["ETag"]}
+
+    try:
+        requests = part_copy_requests(head, src_bucket, src_key, dst_bucket, dst_key, upload_id, part_size)
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(requests))) as pool:
+            parts = list(pool.map(copy_part, requests))
+
+        s3.complete_multipart_upload(
+            Bucket=dst_bucket,
+            Key=dst_key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except Exception:
+        # Don't leave billable orphaned parts behind
+        s3.abort_multipart_upload(Bucket=dst_bucket, Key=dst_key, UploadId=upload_id)
+        raise
+    return "multipart"
+
+
+async def copy_async(s3, src_bucket, src_key, dst_bucket, dst_key, size=None,
+                     threshold=MULTIPART_THRESHOLD, part_size=PART_SIZE):
+    """
+    copy() on an aio.AsyncClient. Parts are copied concurrently, bounded by
+    the client's semaphore; a cancelled copy aborts its multipart upload.
+    """
+    if size is not None and size <= threshold:
+        await s3.copy_object(Bucket=dst_bucket, Key=dst_key, CopySource=copy_source(src_bucket, src_key))
+        return "single"
+
+    head = await s3.head_object(Bucket=src_bucket, Key=src_key)
+    if head["ContentLength"] <= threshold:
+        await s3.copy_object(Bucket=dst_bucket, Key=dst_key, CopySource=copy_source(src_bucket, src_key))
+        return "single"
+
+    upload_id = (await s3.create_multipart_upload(**upload_args(head, dst_bucket, dst_key)))["UploadId"]
+
+    async def copy_part(request):
+        response = await s3.upload_part_copy(**request)
+        return {"PartNumber": request["PartNumber"], "ETag": response["CopyPartResult"]["ETag"]}
+
+    tasks = []
+    try:
+        requests = part_copy_requests(head, src_bucket, src_key, dst_bucket, dst_key, upload_id, part_size)
+        tasks = [asyncio.ensure_future(copy_part(request)) for request in requests]
+        parts = await asyncio.gather(*tasks)
+        await s3.complete_multipart_upload(
+            Bucket=dst_bucket,
+            Key=dst_key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": list(parts)},
+        )
+    except BaseException:
+        # Includes cancellation at the time budget; stop the other parts first
+        for task in tasks:
+            task.cancel()
+        await asyncio.shield(s3.abort_multipart_upload(Bucket=dst_bucket, Key=dst_key, UploadId=upload_id))
+        raise
+    return "multipart"
@@ -1,77 +1,466 @@
 import os
 import json
-import boto3
+import asyncio
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-s3 = boto3.client("s3")
-dynamodb = boto3.resource("dynamodb")
+import aio
+import aws_clients
+import copy_engine
+from event_ordering import EventOrderer, StaleEvent, sequencer_of
 
 SRC_BUCKET = os.getenv("SRC_BUCKET")
 DST_BUCKET = os.getenv("DST_BUCKET")
 TABLE_NAME = os.getenv("TABLE_NAME")
+SEQUENCER_TABLE_NAME = os.getenv("SEQUENCER_TABLE_NAME")
+MAX_COPIES = int(os.getenv("MAX_COPIES", "3"))
+# Keys replicated concurrently within one notification
+REPLICATOR_WORKERS = int(os.getenv("REPLICATOR_WORKERS", "8"))
+# "threads" replicates keys on a thread pool, "async" on an event loop
+# (aiobotocore when installed), bounded by the S3 pool size
+IO_MODE = os.getenv("IO_MODE", "threads")
+# Async mode abandons keys still in flight this close to the timeout
+SAFETY_MARGIN_MS = int(os.getenv("SAFETY_MARGIN_MS", "5000"))
 
-table = dynamodb.Table(TABLE_NAME)
+# Every key being replicated can run a full set of part copies at once
+s3 = aws_clients.client("s3", max_pool_connections=REPLICATOR_WORKERS * copy_engine.CONCURRENCY)
 
+# Each original has one item at this sort key holding its live copies, oldest
+# first, as a list of {CopyObj, CopyTimestamp} plus a Version counter.
+# Disowned copies are still written one item per copy for the cleaner.
+# Live per-copy items from before the ring layout are folded into the ring,
+# as its oldest copies, when it is created or next rotates.
+RING_TIMESTAMP = 0
 
-def handler(event, context):
-    for record in event["Records"]:
-        event_name = record["eventName"]
-        object_key = record["s3"]["object"]["key"]
+# Per-copy items are live unless disowned. Items from before the ring layout
+# carry IsDisowned = "false"; ones written since leave it out.
+LIVE_CONDITION = "attribute_not_exists(IsDisowned) OR IsDisowned <> :true"
+
+table = aws_clients.table(TABLE_NAME)
+# Transactions go through the low-level client
+dynamodb_client = aws_clients.client("dynamodb")
+serializer = TypeSerializer()
+TABLE_CALLS = {"Put": "put_item", "Update": "update_item", "Delete": "delete_item"}
+
+# Per-key sequencer high-water marks, so a duplicate or late S3 notification
+# doesn't copy an object twice or undo a newer event. A mark is raised in the
+# same transaction as the ring write that applies its event.
+orderer = EventOrderer(
+    "replicator",
+    aws_clients.table(SEQUENCER_TABLE_NAME) if SEQUENCER_TABLE_NAME else None
+)
+
+
+def ring_key(object_key):
+    return {"OriginalObj": object_key, "CopyTimestamp": RING_TIMESTAMP}
+
+
+def collapse_records(records):
+    """
+    Group records by object and keep only the events that still matter for
+    each, in S3 sequencer order: the last event, plus the last DELETE before
+    it if that is a PUT. Several PUTs only need the last copy and a key PUT
+    then DELETEd only needs the DELETE, but a DELETE then PUT still has to
+    disown the old copies before the new one goes in. Returns one list of
+    records per object.
+    """
+    by_object = {}
+    for record in sorted(records, key=lambda r: sequencer_of(r) or ""):
+        oid = (record["s3"]["bucket"]["name"], record["s3"]["object"]["key"])
+        by_object.setdefault(oid, []).append(record)
+
+    collapsed = []
+    for object_records in by_object.values():
+        last = object_records[-1]
+        deletes = [r for r in object_records if r["eventName"].startswith("ObjectRemoved:")]
+        if deletes and deletes[-1] is not last:
+            collapsed.append([deletes[-1], last])
+        else:
+            collapsed.append([last])
+    return collapsed
+
+
+def collapsed(event):
+    """
+    collapse_records() of the event's records, logging how many were dropped.
+    """
+    groups = collapse_records(event["Records"])
+    kept = sum(len(records) for records in groups)
+    if kept < len(event["Records"]):
+        print(f"Collapsed {len(event['Records'])} events to {kept} for {len(groups)} keys")
+    return groups
+
+
+def describe(records):
+    return f"{' then '.join(r['eventName'] for r in records)} for {records[-1]['s3']['object']['key']}"
+
+
+def replicate_all(records):
+    """
+    Replicate one object's records in order, stopping at the first failure
+    so a PUT never lands before the DELETE ahead of it.
+    """
+    for record in records:
+        replicate(record)
+
+
+def replicate(record):
+    event_name = record["eventName"]
+    bucket_name = record["s3"]["bucket"]["name"]
+    object_key = record["s3"]["object"]["key"]
+    sequencer = sequencer_of(record)
 
+    if orderer.is_stale(bucket_name, object_key, sequencer):
+        print(f"Skipping stale or duplicate {event_name} for {object_key}")
+        return
+
+    mark = orderer.mark_write(bucket_name, object_key, sequencer)
+    try:
+        if event_name.startswith("ObjectCreated:"):  # PUT event
+            handle_put(object_key, record["s3"]["object"].get("size"), mark)
+        elif event_name.startswith("ObjectRemoved:"):  # DELETE event
+            handle_delete(object_key, mark)
+    except StaleEvent:
+        orderer.drop()
+        print(f"Skipping {event_name} for {object_key}: a newer event was applied first")
+        return
+    if sequencer:
+        orderer.remember(bucket_name, object_key, sequencer)
+
+
+async def replicate_async(record, s3_async):
+    """
+    replicate() on the event loop: the copy goes through the async S3
+    client, the DynamoDB bookkeeping runs on worker threads.
+    """
+    event_name = record["eventName"]
+    bucket_name = record["s3"]["bucket"]["name"]
+    object_key = record["s3"]["object"]["key"]
+    sequencer = sequencer_of(record)
+
+    if await asyncio.to_thread(orderer.is_stale, bucket_name, object_key, sequencer):
+        print(f"Skipping stale or duplicate {event_name} for {object_key}")
+        return
+
+    mark = orderer.mark_write(bucket_name, object_key, sequencer)
+    try:
         if event_name.startswith("ObjectCreated:"):  # PUT event
-            handle_put(object_key)
+            timestamp, copy_key = new_copy_key(object_key)
+            await copy_engine.copy_async(
+                s3_async, SRC_BUCKET, object_key, DST_BUCKET, copy_key,
+                size=record["s3"]["object"].get("size")
+            )
+            try:
+                await asyncio.to_thread(record_copy, object_key, copy_key, timestamp, mark)
+            except StaleEvent:
+                await asyncio.to_thread(discard_copy, object_key, copy_key)
+                raise
         elif event_name.startswith("ObjectRemoved:"):  # DELETE event
-            handle_delete(object_key)
+            await asyncio.to_thread(handle_delete, object_key, mark)
+    except StaleEvent:
+        orderer.drop()
+        print(f"Skipping {event_name} for {object_key}: a newer event was applied first")
+        return
+    if sequencer:
+        orderer.remember(bucket_name, object_key, sequencer)
+
+
+async def replicate_all_async(records, s3_async):
+    for record in records:
+        await replicate_async(record, s3_async)
+
+
+async def handler_async(event, context):
+    groups = collapsed(event)
+    at = aio.deadline(context, SAFETY_MARGIN_MS)
+
+    async with aio.async_client(s3, REPLICATOR_WORKERS * copy_engine.CONCURRENCY) as s3_async:
+        tasks = {asyncio.ensure_future(replicate_all_async(records, s3_async)): records for records in groups}
+        cancelled = await aio.wait_all(list(tasks), at)
+
+    failures = []
+    for task, records in tasks.items():
+        error = TimeoutError("ran out of time") if task.cancelled() else task.exception()
+        if error:
+            print(f"Failed to replicate {describe(records)}: {error}")
+            failures.append(error)
+    if cancelled:
+        print(f"Abandoned {cancelled} keys at the time budget")
+    if failures:
+        raise failures[0]
+
+
+@aws_clients.log_request_stats
+def handler(event, context):
+    if IO_MODE == "async":
+        return aio.run(handler_async(event, context), REPLICATOR_WORKERS * copy_engine.CONCURRENCY)
+
+    groups = collapsed(event)
+
+    # Keys are independent, so replicate them concurrently
+    failures = []
+    with ThreadPoolExecutor(max_workers=max(1, min(REPLICATOR_WORKERS, len(groups)))) as pool:
+        futures = {pool.submit(replicate_all, records): records for records in groups}
+        for future, records in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Failed to replicate {describe(records)}: {e}")
+                failures.append(e)
+
+    # Fail the invocation so the async retry runs it again; keys that
+    # succeeded had their mark raised with their ring write and are skipped
+    if failures:
+        raise failures[0]
 
 
-def handle_put(object_key):
+def new_copy_key(object_key):
     timestamp = int(datetime.utcnow().timestamp())
-    copy_key = f"{object_key}_{timestamp}"
+    return timestamp, f"{object_key}_{timestamp}"
 
-    # Copy object to destination bucket
-    s3.copy_object(
-        Bucket=DST_BUCKET,
-        CopySource={"Bucket": SRC_BUCKET, "Key": object_key},
-        Key=copy_key
-    )
 
-    # Fetch existing copies
-    response = table.query(
-        KeyConditionExpression="OriginalObj = :obj",
-        ExpressionAttributeValues={":obj": object_key}
-    )
+def to_attributes(values):
+    return {name: serializer.serialize(value) for name, value in values.items()}
+
+
+def write_together(writes, mark=None):
+    """
+    Apply [(action, params)] writes to the table, plus the event's sequencer
+    mark, all or nothing. params are what the Table method takes. Returns
+    False if a write's condition failed or another transaction got in the
+    way, in which case the caller re-reads and tries again. Raises
+    StaleEvent if the mark's condition failed.
+    """
+    if mark is None and len(writes) == 1:
+        action, params = writes[0]
+        try:
+            getattr(table, TABLE_CALLS[action])(**params)
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return False
+
+    actions = []
+    for action, params in writes:
+        params = dict(params, TableName=TABLE_NAME)
+        for name in ("Key", "Item", "ExpressionAttributeValues"):
+            if name in params:
+                params[name] = to_attributes(params[name])
+        actions.append({action: params})
+    if mark:
+        actions.append(mark)
+    try:
+        dynamodb_client.transact_write_items(TransactItems=actions)
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "TransactionCanceledException":
+            raise
+        reasons = [reason.get("Code") for reason in e.response.get("CancellationReasons", [])]
+        if mark and reasons[-1:] == ["ConditionalCheckFailed"]:
+            raise StaleEvent()
+        if not set(reasons) <= {"None", "ConditionalCheckFailed", "TransactionConflict"}:
+            raise
+        return False
+
+
+def handle_put(object_key, size=None, mark=None):
+    timestamp, copy_key = new_copy_key(object_key)
+
+    # Copy object to destination bucket (multipart above the size threshold)
+    copy_engine.copy(s3, SRC_BUCKET, object_key, DST_BUCKET, copy_key, size=size)
+    try:
+        record_copy(object_key, copy_key, timestamp, mark)
+    except StaleEvent:
+        discard_copy(object_key, copy_key)
+        raise
+
+
+def discard_copy(object_key, copy_key):
+    """
+    Delete a copy made for an event that turned out to be stale, unless the
+    ring holds it: a duplicate in the same second shares the copy key.
+    """
+    ring = table.get_item(Key=ring_key(object_key), ConsistentRead=True).get("Item") or {}
+    if all(live["CopyObj"] != copy_key for live in ring.get("Copies", [])):
+        s3.delete_object(Bucket=DST_BUCKET, Key=copy_key)
 
-    copies = sorted(response.get("Items", []), key=lambda x: x["CopyTimestamp"])
 
-    # Delete oldest copy if more than 3 exist
-    if len(copies) >= 3:
-        oldest = copies[0]
-        s3.delete_object(Bucket=DST_BUCKET, Key=oldest["CopyObj"])
-        table.delete_item(
-            Key={"OriginalObj": object_key, "CopyTimestamp": oldest["CopyTimestamp"]}
+def record_copy(object_key, copy_key, timestamp, mark=None):
+    """
+    Add a new copy to the object's ring, deleting the copies it rotates out.
+    The event's sequencer mark, if any, is raised in the same write.
+    """
+    new_copy = {"CopyObj": copy_key, "CopyTimestamp": timestamp}
+
+    # Ring exists and isn't full yet: append in one conditional update, no
+    # read needed
+    append = ("Update", {
+        "Key": ring_key(object_key),
+        "UpdateExpression": "SET Copies = list_append(Copies, :new) ADD Version :one",
+        "ConditionExpression": "attribute_exists(Copies) AND size(Copies) < :n",
+        "ExpressionAttributeValues": {":new": [new_copy], ":one": 1, ":n": MAX_COPIES},
+    })
+    if write_together([append], mark):
+        return
+
+    while True:
+        ring, legacy = live_items(object_key)
+        if ring is not None and not legacy and len(ring["Copies"]) < MAX_COPIES:
+            # Rotated since the append was tried, or the append ran into
+            # another write; there is room now
+            if write_together([append], mark):
+                return
+            continue
+
+        # New or full ring: write it with the oldest copies rotated out,
+        # guarded so a concurrent PUT can't grow it past MAX_COPIES. Legacy
+        # copies are the oldest, so they go first; a new ring takes in the
+        # rest, so a key never has more than MAX_COPIES live copies.
+        copies = sorted(
+            [{"CopyObj": item["CopyObj"], "CopyTimestamp": item["CopyTimestamp"]} for item in legacy]
+            + (ring["Copies"] if ring else []),
+            key=lambda live: live["CopyTimestamp"]
+        )
+        evicted = copies[:max(0, len(copies) - MAX_COPIES + 1)]
+        if ring is None:
+            writes = [("Put", {
+                "Item": dict(ring_key(object_key), Copies=copies[len(evicted):] + [new_copy], Version=1),
+                "ConditionExpression": "attribute_not_exists(OriginalObj)",
+            })]
+        else:
+            writes = [("Update", {
+                "Key": ring_key(object_key),
+                "UpdateExpression": "SET Copies = :copies ADD Version :one",
+                "ConditionExpression": "Version = :v",
+                "ExpressionAttributeValues": {
+                    ":copies": copies[len(evicted):] + [new_copy], ":one": 1, ":v": ring["Version"]
+                },
+            })]
+        # Folded into the ring; a DELETE that disowns them in the meantime
+        # cancels the write
+        writes.extend(
+            ("Delete", {
+                "Key": {"OriginalObj": object_key, "CopyTimestamp": item["CopyTimestamp"]},
+                "ConditionExpression": LIVE_CONDITION,
+                "ExpressionAttributeValues": {":true": "true"},
+            })
+            for item in legacy
         )
+        if write_together(writes, mark):
+            break
 
-    # Store new copy in DynamoDB
-    table.put_item(
-        Item={
-            "OriginalObj": object_key,
-            "CopyTimestamp": timestamp,
-            "CopyObj": copy_key,
-            "IsDisowned": "false"
-        }
+    if legacy:
+        print(f"Moved {len(legacy)} per-copy items of {object_key} into its ring")
+    delete_evicted(object_key, evicted, copy_key)
+
+
+def live_items(object_key):
+    """
+    The object's ring item (or None) and its live per-copy items written
+    before the ring layout, in one consistent read.
+    """
+    response = table.query(
+        KeyConditionExpression="OriginalObj = :obj",
+        FilterExpression=LIVE_CONDITION,
+        ExpressionAttributeValues={":obj": object_key, ":true": "true"},
+        ConsistentRead=True
     )
+    ring, legacy = None, []
+    for item in response.get("Items", []):
+        if item["CopyTimestamp"] == RING_TIMESTAMP:
+            ring = item
+        else:
+            legacy.append(item)
+    return ring, legacy
+
 
+def delete_evicted(object_key, evicted, copy_key):
+    """
+    Delete the copies a rotation evicted. The ring no longer holds them and
+    a retry of the event is dropped as stale, so a copy that can't be
+    deleted now is handed to the cleaner as a disowned item instead.
+    """
+    for evicted_copy in evicted:
+        # Two PUTs in the same second share a copy key; keep the live one
+        if evicted_copy["CopyObj"] == copy_key:
+            continue
+        try:
+            s3.delete_object(Bucket=DST_BUCKET, Key=evicted_copy["CopyObj"])
+        except ClientError as e:
+            print(f"Failed to delete evicted copy {evicted_copy['CopyObj']}, leaving it to the cleaner: {e}")
+            table.put_item(Item={
+                "OriginalObj": object_key,
+                "CopyTimestamp": evicted_copy["CopyTimestamp"],
+                "CopyObj": evicted_copy["CopyObj"],
+                "IsDisowned": "true",
+                "DeleteTime": int(datetime.utcnow().timestamp()),
+            })
 
-def handle_delete(object_key):
+
+def handle_delete(object_key, mark=None):
     response = table.query(
         KeyConditionExpression="OriginalObj = :obj",
-        ExpressionAttributeValues={":obj": object_key}
+        ExpressionAttributeValues={":obj": object_key},
+        ConsistentRead=True
     )
+    now = int(datetime.utcnow().timestamp())
 
+    ring = None
     for item in response.get("Items", []):
+        if item["CopyTimestamp"] == RING_TIMESTAMP:
+            ring = item
+            continue
+        # Per-copy items written before the ring layout
         table.update_item(
             Key={"OriginalObj": item["OriginalObj"], "CopyTimestamp": item["CopyTimestamp"]},
             UpdateExpression="SET IsDisowned = :val, DeleteTime = :time",
-            ExpressionAttributeValues={":val": "true", ":time": int(datetime.utcnow().timestamp())}
+            ExpressionAttributeValues={":val": "true", ":time": now}
         )
 
+    if ring is not None:
+        disown_ring(ring, now, mark)
+    else:
+        raise_mark(mark)
+
+
+def raise_mark(mark):
+    """
+    Raise the event's mark on its own, for an event that changed nothing
+    in the table. Raises StaleEvent if a newer event got there first.
+    """
+    while mark and not write_together([], mark):
+        pass
+
+
+def disown_ring(ring, now, mark=None):
+    """
+    Turn every copy in the ring into a disowned per-copy item for the cleaner
+    to reap and drop the ring, in one transaction with the event's mark. A
+    PUT that lands in between bumps the version, so the ring is re-read and
+    the new copy disowned with the rest.
+    """
+    while True:
+        writes = [
+            ("Put", {"Item": {
+                "OriginalObj": ring["OriginalObj"],
+                "CopyTimestamp": live["CopyTimestamp"],
+                "CopyObj": live["CopyObj"],
+                "IsDisowned": "true",
+                "DeleteTime": now,
+            }})
+            for live in ring.get("Copies", [])
+        ]
+        writes.append(("Delete", {
+            "Key": ring_key(ring["OriginalObj"]),
+            "ConditionExpression": "Version = :v",
+            "ExpressionAttributeValues": {":v": ring["Version"]},
+        }))
+        if write_together(writes, mark):
+            return
+        ring = table.get_item(Key=ring_key(ring["OriginalObj"]), ConsistentRead=True).get("Item")
+        if ring is None:
+            raise_mark(mark)
+            return
@@ -8,19 +8,31 @@ class CleanerStack(cdk.Stack):
     def __init__(self, scope: Construct, id: str, storage, **kwargs):
         super().__init__(scope, id, **kwargs)
 
+        # Where a run that hit its time budget stopped reading the index
+        self.checkpoint_table = dynamodb.Table(
+            self, "CheckpointTable",
+            partition_key=dynamodb.Attribute(name="job_id", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=cdk.RemovalPolicy.DESTROY
+        )
+
         self.cleaner_fn = _lambda.Function(
             self, "CleanerLambda",
             runtime=_lambda.Runtime.PYTHON_3_9,
             handler="cleaner.handler",
             code=_lambda.Code.from_asset("lambda/"),
+            # Runs every minute; stays under that so runs don't overlap
+            timeout=cdk.Duration.seconds(55),
             environment={
                 "DST_BUCKET": storage.dst_bucket.bucket_name,
                 "TABLE_NAME": storage.table.table_name,
+                "CHECKPOINT_TABLE_NAME": self.checkpoint_table.table_name,
             },
         )
 
         storage.dst_bucket.grant_read_write(self.cleaner_fn)
         storage.table.grant_full_access(self.cleaner_fn)
+        self.checkpoint_table.grant_read_write_data(self.cleaner_fn)
 
         events.Rule(
             self, "CleanerSchedule",
@@ -26,16 +26,33 @@ class StorageReplicatorStack(cdk.Stack):
             sort_key=dynamodb.Attribute(name="DeleteTime", type=dynamodb.AttributeType.NUMBER)
         )
 
+        # Highest S3 sequencer processed per key, to drop duplicate and
+        # out-of-order event deliveries
+        self.sequencer_table = dynamodb.Table(
+            self, "SequencerTable",
+            partition_key=dynamodb.Attribute(name="object_id", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=cdk.RemovalPolicy.DESTROY
+        )
+
         # Create Replicator Lambda
         self.replicator_fn = _lambda.Function(
             self, "ReplicatorLambda",
             runtime=_lambda.Runtime.PYTHON_3_9,
             handler="replicator.handler",
             code=_lambda.Code.from_asset("lambda/"),
+            # Multi-GB multipart copies need more than the 3 second default
+            timeout=cdk.Duration.minutes(5),
             environment={
                 "SRC_BUCKET": self.src_bucket.bucket_name,
                 "DST_BUCKET": self.dst_bucket.bucket_name,
                 "TABLE_NAME": "TableT",
+                "SEQUENCER_TABLE_NAME": self.sequencer_table.table_name,
+                "COPY_MULTIPART_THRESHOLD": str(256 * 1024 * 1024),
+                "COPY_PART_SIZE": str(64 * 1024 * 1024),
+                "COPY_CONCURRENCY": "10",
+                "MAX_COPIES": "3",
+                "REPLICATOR_WORKERS": "8",
             },
         )
 
@@ -54,4 +71,5 @@ class StorageReplicatorStack(cdk.Stack):
         self.src_bucket.grant_read(self.replicator_fn)
         self.dst_bucket.grant_write(self.replicator_fn)
         self.table.grant_full_access(self.replicator_fn)
+        self.sequencer_table.grant_read_write_data(self.replicator_fn)
 
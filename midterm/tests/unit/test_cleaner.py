@@ -0,0 +1,221 @@
+import threading
+import time
+
+import boto3
+import pytest
+
+DST = "dst-bucket"
+
+
+class FakeContext:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+@pytest.fixture(params=["threads", "async"])
+def io_mode(request):
+    return request.param
+
+
+@pytest.fixture
+def cleaner(aws, load_handler, io_mode):
+    boto3.client("s3").create_bucket(Bucket=DST)
+    boto3.client("dynamodb").create_table(
+        TableName="TableT",
+        KeySchema=[{"AttributeName": "OriginalObj", "KeyType": "HASH"},
+                   {"AttributeName": "CopyTimestamp", "KeyType": "RANGE"}],
+        AttributeDefinitions=[{"AttributeName": "OriginalObj", "AttributeType": "S"},
+                              {"AttributeName": "CopyTimestamp", "AttributeType": "N"},
+                              {"AttributeName": "IsDisowned", "AttributeType": "S"},
+                              {"AttributeName": "DeleteTime", "AttributeType": "N"}],
+        GlobalSecondaryIndexes=[{
+            "IndexName": "DisownedIndex",
+            "KeySchema": [{"AttributeName": "IsDisowned", "KeyType": "HASH"},
+                          {"AttributeName": "DeleteTime", "KeyType": "RANGE"}],
+            "Projection": {"ProjectionType": "ALL"},
+        }],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    return load_handler("cleaner", {"DST_BUCKET": DST, "TABLE_NAME": "TableT", "IO_MODE": io_mode})
+
+
+def disown(cleaner, count, delete_time=1):
+    s3 = boto3.client("s3")
+    for i in range(count):
+        copy_key = f"obj{i}-copy"
+        s3.put_object(Bucket=DST, Key=copy_key, Body=b"x")
+        cleaner.table.put_item(Item={
+            "OriginalObj": f"obj{i}", "CopyTimestamp": i, "CopyObj": copy_key,
+            "IsDisowned": "true", "DeleteTime": delete_time,
+        })
+
+
+def remaining(cleaner):
+    return len(cleaner.table.scan()["Items"]), boto3.client("s3").list_objects_v2(Bucket=DST)["KeyCount"]
+
+
+def test_reaps_disowned_copies(cleaner):
+    disown(cleaner, 5)
+    result = cleaner.handler({}, None)
+    assert (result["reaped"], result["stopped_early"]) == (5, False)
+    assert remaining(cleaner) == (0, 0)
+
+
+def test_recently_disowned_copies_are_kept(cleaner):
+    disown(cleaner, 2, delete_time=int(time.time()))
+    assert cleaner.handler({}, None)["reaped"] == 0
+    assert remaining(cleaner) == (2, 2)
+
+
+def test_at_most_reaper_workers_batches_in_flight(cleaner, monkeypatch):
+    disown(cleaner, 12)
+    monkeypatch.setattr(cleaner, "S3_DELETE_BATCH", 1)
+    monkeypatch.setattr(cleaner, "REAPER_WORKERS", 3)
+    reap_batch = cleaner.reap_batch
+    lock, running, peak = threading.Lock(), [0], [0]
+
+    def counting(*args):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.01)
+        try:
+            return reap_batch(*args)
+        finally:
+            with lock:
+                running[0] -= 1
+
+    monkeypatch.setattr(cleaner, "reap_batch", counting)
+    if cleaner.IO_MODE == "async":
+        reap_batch_async = cleaner.reap_batch_async
+
+        async def counting_async(*args):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            try:
+                return await reap_batch_async(*args)
+            finally:
+                with lock:
+                    running[0] -= 1
+
+        monkeypatch.setattr(cleaner, "reap_batch_async", counting_async)
+    result = cleaner.handler({}, None)
+    assert (result["reaped"], result["batches"]) == (12, 12)
+    assert peak[0] <= 3
+
+
+def test_out_of_time_starts_no_batches(cleaner):
+    disown(cleaner, 3)
+    result = cleaner.handler({}, FakeContext(remaining_ms=1000))
+    assert (result["reaped"], result["batches"], result["stopped_early"]) == (0, 0, True)
+    assert remaining(cleaner) == (3, 3)
+
+
+def test_reap_batch_does_nothing_once_the_budget_is_spent(cleaner):
+    disown(cleaner, 1)
+    items = cleaner.table.scan()["Items"]
+    assert cleaner.reap_batch(items, cleaner.Budget(FakeContext(1000), 5000)) is None
+    assert remaining(cleaner) == (1, 1)
+
+
+def test_unprocessed_items_are_retried_a_bounded_number_of_times(cleaner, monkeypatch):
+    class Throttled:
+        calls = 0
+
+        def batch_write_item(self, RequestItems):
+            self.calls += 1
+            return {"UnprocessedItems": RequestItems}
+
+    throttled = Throttled()
+    monkeypatch.setattr(cleaner, "dynamodb", throttled)
+    monkeypatch.setattr(cleaner.time, "sleep", lambda seconds: None)
+    with pytest.raises(RuntimeError):
+        cleaner.delete_table_items([{"OriginalObj": "a", "CopyTimestamp": 1}], max_retries=2)
+    assert throttled.calls == 3
+
+
+def fake_pages(cleaner, monkeypatch, pages):
+    """
+    Serve the given pages of disowned items (three items each) instead of
+    querying the index, and capture the saved resume key.
+    """
+    def disowned_pages(cutoff, start_key=None):
+        for page_number, page_key in enumerate(pages):
+            yield [{"OriginalObj": f"p{page_number}-{i}", "CopyTimestamp": i, "CopyObj": f"p{page_number}-{i}"}
+                   for i in range(3)], page_key
+
+    saved = []
+    monkeypatch.setattr(cleaner, "disowned_pages", disowned_pages)
+    monkeypatch.setattr(cleaner, "save_progress", lambda resume_key, owner: saved.append(resume_key))
+    monkeypatch.setattr(cleaner, "S3_DELETE_BATCH", 1)
+    return saved
+
+
+def test_resumes_at_the_first_page_with_an_unfinished_batch(cleaner, monkeypatch):
+    saved = fake_pages(cleaner, monkeypatch, [None, {"k": "page1"}, {"k": "page2"}])
+
+    def reap(items, *budgets):
+        # A batch of page 1 ran into the budget; the later ones didn't
+        return None if items[0]["CopyObj"] == "p1-1" else 1
+
+    async def reap_async(s3_async, items, *budgets):
+        return reap(items)
+
+    monkeypatch.setattr(cleaner, "reap_batch", reap)
+    monkeypatch.setattr(cleaner, "reap_batch_async", reap_async)
+    result = cleaner.handler({}, None)
+    assert saved == [{"k": "page1"}]
+    assert (result["reaped"], result["batches"], result["stopped_early"]) == (8, 9, True)
+
+
+def test_failed_batches_do_not_hold_the_checkpoint_back(cleaner, monkeypatch):
+    saved = fake_pages(cleaner, monkeypatch, [None, {"k": "page1"}])
+
+    def reap(items, *budgets):
+        if items[0]["CopyObj"] == "p0-0":
+            raise RuntimeError("throttled")
+        return 1
+
+    async def reap_async(s3_async, items, *budgets):
+        return reap(items)
+
+    monkeypatch.setattr(cleaner, "reap_batch", reap)
+    monkeypatch.setattr(cleaner, "reap_batch_async", reap_async)
+    result = cleaner.handler({}, None)
+    # Read to the end: the next run starts over and retries the failed batch
+    assert saved == [None]
+    assert (result["reaped"], result["stopped_early"]) == (5, False)
+
+
+def test_stopping_on_the_first_page_restarts_from_the_beginning(cleaner, monkeypatch):
+    saved = fake_pages(cleaner, monkeypatch, [None, {"k": "page1"}])
+    result = cleaner.handler({}, FakeContext(remaining_ms=1000))
+    assert saved == [{}]
+    assert result["stopped_early"]
+
+
+def test_skips_while_another_run_holds_the_checkpoint(aws, load_handler, io_mode, monkeypatch):
+    boto3.client("dynamodb").create_table(
+        TableName="Checkpoints",
+        KeySchema=[{"AttributeName": "job_id", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "job_id", "AttributeType": "S"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    monkeypatch.setenv("CHECKPOINT_TABLE_NAME", "Checkpoints")
+    cleaner = load_handler("cleaner", {"DST_BUCKET": DST, "TABLE_NAME": "TableT", "IO_MODE": io_mode})
+    monkeypatch.setattr(cleaner, "disowned_pages", lambda cutoff, start_key=None: iter([]))
+    cleaner.checkpoints.acquire(cleaner.CHECKPOINT_JOB_ID, "slow-run", 60)
+
+    assert cleaner.handler({}, None)["skipped"]
+
+    cleaner.checkpoints.save(cleaner.CHECKPOINT_JOB_ID, "slow-run", {"start_key": {"k": "page1"}})
+    seen = []
+    monkeypatch.setattr(cleaner, "disowned_pages", lambda cutoff, start_key=None: seen.append(start_key) or iter([]))
+    assert not cleaner.handler({}, None).get("skipped")
+    # Resumed where the slow run stopped, and read to the end
+    assert seen == [{"k": "page1"}]
+    assert cleaner.checkpoints.load(cleaner.CHECKPOINT_JOB_ID) is None
@@ -0,0 +1,62 @@
+import boto3
+import pytest
+
+from copy_engine import MAX_PARTS, MB, MIN_PART_SIZE, copy, part_ranges
+
+
+def test_part_ranges_cover_the_object_exactly():
+    ranges = part_ranges(25 * MB + 3, 10 * MB)
+    assert ranges == [(0, 10 * MB - 1), (10 * MB, 20 * MB - 1), (20 * MB, 25 * MB + 2)]
+
+
+def test_part_ranges_respect_the_minimum_part_size():
+    assert part_ranges(12 * MB, MB) == [(0, MIN_PART_SIZE - 1), (MIN_PART_SIZE, 2 * MIN_PART_SIZE - 1),
+                                        (2 * MIN_PART_SIZE, 12 * MB - 1)]
+
+
+def test_part_ranges_grow_to_stay_within_the_part_limit():
+    size = 100 * 1024 * MB
+    ranges = part_ranges(size, MIN_PART_SIZE)
+    assert len(ranges) <= MAX_PARTS
+    assert ranges[-1][1] == size - 1
+    assert all(first == prev_last + 1 for (_, prev_last), (first, _) in zip(ranges, ranges[1:]))
+
+
+def test_part_ranges_of_an_empty_object():
+    assert part_ranges(0, MIN_PART_SIZE) == []
+
+
+@pytest.fixture
+def s3(aws):
+    client = boto3.client("s3")
+    client.create_bucket(Bucket="src-bucket")
+    client.create_bucket(Bucket="dst-bucket")
+    return client
+
+
+def test_small_objects_use_a_single_copy(s3):
+    s3.put_object(Bucket="src-bucket", Key="a", Body=b"hello")
+    assert copy(s3, "src-bucket", "a", "dst-bucket", "a-copy", size=5) == "single"
+    assert s3.get_object(Bucket="dst-bucket", Key="a-copy")["Body"].read() == b"hello"
+
+
+def test_large_objects_are_copied_in_parts(s3):
+    body = bytes(range(256)) * (11 * MB // 256)
+    s3.put_object(Bucket="src-bucket", Key="big", Body=body, Metadata={"owner": "me"})
+    assert copy(s3, "src-bucket", "big", "dst-bucket", "big-copy",
+                threshold=MB, part_size=MIN_PART_SIZE, concurrency=2) == "multipart"
+    copied = s3.get_object(Bucket="dst-bucket", Key="big-copy")
+    assert copied["Body"].read() == body
+    assert copied["Metadata"] == {"owner": "me"}
+
+
+def test_failed_part_aborts_the_upload(s3, monkeypatch):
+    s3.put_object(Bucket="src-bucket", Key="big", Body=b"x" * (11 * MB))
+
+    def failing(**kwargs):
+        raise RuntimeError("throttled")
+
+    monkeypatch.setattr(s3, "upload_part_copy", failing)
+    with pytest.raises(RuntimeError):
+        copy(s3, "src-bucket", "big", "dst-bucket", "big-copy", threshold=MB, part_size=MIN_PART_SIZE)
+    assert s3.list_multipart_uploads(Bucket="dst-bucket").get("Uploads", []) == []
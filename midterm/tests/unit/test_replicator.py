@@ -0,0 +1,265 @@
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+SRC, DST = "src-bucket", "dst-bucket"
+
+
+@pytest.fixture
+def replicator(aws, load_handler):
+    s3 = boto3.client("s3")
+    s3.create_bucket(Bucket=SRC)
+    s3.create_bucket(Bucket=DST)
+    ddb = boto3.client("dynamodb")
+    ddb.create_table(
+        TableName="TableT",
+        KeySchema=[{"AttributeName": "OriginalObj", "KeyType": "HASH"},
+                   {"AttributeName": "CopyTimestamp", "KeyType": "RANGE"}],
+        AttributeDefinitions=[{"AttributeName": "OriginalObj", "AttributeType": "S"},
+                              {"AttributeName": "CopyTimestamp", "AttributeType": "N"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    ddb.create_table(
+        TableName="sequencers",
+        KeySchema=[{"AttributeName": "object_id", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "object_id", "AttributeType": "S"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    return load_handler("replicator", {
+        "SRC_BUCKET": SRC, "DST_BUCKET": DST, "TABLE_NAME": "TableT",
+        "SEQUENCER_TABLE_NAME": "sequencers", "MAX_COPIES": "3",
+    })
+
+
+def record(event_name, key, sequencer, size=5):
+    obj = {"key": key, "sequencer": sequencer}
+    if event_name.startswith("ObjectCreated"):
+        obj["size"] = size
+    return {"eventName": event_name, "s3": {"bucket": {"name": SRC}, "object": obj}}
+
+
+def put_source(key, body=b"hello"):
+    boto3.client("s3").put_object(Bucket=SRC, Key=key, Body=body)
+
+
+def items(replicator, key):
+    return replicator.table.query(
+        KeyConditionExpression="OriginalObj = :k", ExpressionAttributeValues={":k": key}
+    )["Items"]
+
+
+def copies_in_dst():
+    return sorted(o["Key"] for o in boto3.client("s3").list_objects_v2(Bucket=DST).get("Contents", []))
+
+
+def test_duplicate_put_is_copied_once(replicator):
+    put_source("a")
+    replicator.replicate(record("ObjectCreated:Put", "a", "01"))
+    replicator.orderer._marks.clear()
+    replicator.replicate(record("ObjectCreated:Put", "a", "01"))
+    (ring,) = items(replicator, "a")
+    assert len(ring["Copies"]) == 1
+    assert len(copies_in_dst()) == 1
+
+
+def test_failed_ring_write_is_not_dropped_on_retry(replicator, monkeypatch):
+    put_source("a")
+    write_together = replicator.write_together
+
+    def failing(writes, mark=None):
+        raise RuntimeError("throttled")
+
+    monkeypatch.setattr(replicator, "write_together", failing)
+    with pytest.raises(RuntimeError):
+        replicator.replicate(record("ObjectCreated:Put", "a", "01"))
+
+    # The mark wasn't raised, so the retry goes through
+    monkeypatch.setattr(replicator, "write_together", write_together)
+    replicator.orderer._marks.clear()
+    replicator.replicate(record("ObjectCreated:Put", "a", "01"))
+    (ring,) = items(replicator, "a")
+    assert len(ring["Copies"]) == 1
+
+
+def test_late_put_after_delete_is_skipped(replicator):
+    put_source("a")
+    replicator.replicate(record("ObjectCreated:Put", "a", "01"))
+    replicator.replicate(record("ObjectRemoved:Delete", "a", "03"))
+    replicator.replicate(record("ObjectCreated:Put", "a", "02"))
+    assert all(item.get("IsDisowned") == "true" for item in items(replicator, "a"))
+    assert len(items(replicator, "a")) == 1
+
+
+def test_put_that_loses_the_race_discards_its_copy(replicator):
+    put_source("a")
+    replicator.replicate(record("ObjectCreated:Put", "a", "01"))
+    # A newer event is applied by another container after this one's check
+    replicator.orderer.advance(SRC, "a", "05")
+    replicator.orderer._marks.clear()
+    is_stale = replicator.orderer.is_stale
+    replicator.orderer.is_stale = lambda *args: False
+    replicator.replicate(record("ObjectCreated:Put", "a", "02"))
+    replicator.orderer.is_stale = is_stale
+
+    (ring,) = items(replicator, "a")
+    assert len(ring["Copies"]) == 1
+    assert copies_in_dst() == [ring["Copies"][0]["CopyObj"]]
+
+
+def test_delete_of_uncopied_object_raises_the_mark(replicator):
+    replicator.replicate(record("ObjectRemoved:Delete", "never-copied", "02"))
+    mark = replicator.orderer.table.get_item(Key={"object_id": "replicator:src-bucket:never-copied"})["Item"]
+    assert mark["sequencer"].endswith("02")
+
+
+def test_puts_rotate_the_oldest_copy_out(replicator):
+    put_source("a")
+    for i in range(4):
+        replicator.record_copy("a", f"a_{i}", i + 1)
+        boto3.client("s3").put_object(Bucket=DST, Key=f"a_{i}", Body=b"x")
+    (ring,) = items(replicator, "a")
+    assert [c["CopyObj"] for c in ring["Copies"]] == ["a_1", "a_2", "a_3"]
+    assert "a_0" not in copies_in_dst()
+
+
+def test_ring_deleted_after_a_failed_append_is_recreated(replicator, monkeypatch):
+    write_together = replicator.write_together
+    calls = []
+
+    def first_append_fails(writes, mark=None):
+        calls.append(writes)
+        return False if len(calls) == 1 else write_together(writes, mark)
+
+    monkeypatch.setattr(replicator, "write_together", first_append_fails)
+    replicator.record_copy("a", "a_1", 1)
+    (ring,) = items(replicator, "a")
+    assert [c["CopyObj"] for c in ring["Copies"]] == ["a_1"]
+
+
+def test_legacy_copies_are_rotated_out_first(replicator):
+    s3 = boto3.client("s3")
+    for i in range(2):
+        s3.put_object(Bucket=DST, Key=f"a_old{i}", Body=b"x")
+        # How handle_put wrote copies before the ring layout
+        replicator.table.put_item(Item={
+            "OriginalObj": "a", "CopyTimestamp": i + 1, "CopyObj": f"a_old{i}", "IsDisowned": "false"
+        })
+    replicator.table.put_item(Item={
+        "OriginalObj": "a", "CopyTimestamp": 99, "CopyObj": "gone", "IsDisowned": "true", "DeleteTime": 1
+    })
+    for i in range(4):
+        s3.put_object(Bucket=DST, Key=f"a_{i}", Body=b"x")
+        replicator.record_copy("a", f"a_{i}", 100 + i)
+
+    remaining = items(replicator, "a")
+    (ring,) = [item for item in remaining if item["CopyTimestamp"] == 0]
+    assert [c["CopyObj"] for c in ring["Copies"]] == ["a_1", "a_2", "a_3"]
+    # Only the disowned item is left for the cleaner
+    assert [item["CopyObj"] for item in remaining if item["CopyTimestamp"] != 0] == ["gone"]
+    assert not {"a_old0", "a_old1", "a_0"} & set(copies_in_dst())
+
+
+def test_legacy_copies_count_towards_a_new_ring(replicator):
+    s3 = boto3.client("s3")
+    for i in range(3):
+        s3.put_object(Bucket=DST, Key=f"a_old{i}", Body=b"x")
+        replicator.table.put_item(Item={
+            "OriginalObj": "a", "CopyTimestamp": i + 1, "CopyObj": f"a_old{i}", "IsDisowned": "false"
+        })
+    s3.put_object(Bucket=DST, Key="a_new", Body=b"x")
+    replicator.record_copy("a", "a_new", 100)
+
+    (ring,) = items(replicator, "a")
+    assert [c["CopyObj"] for c in ring["Copies"]] == ["a_old1", "a_old2", "a_new"]
+    assert copies_in_dst() == ["a_new", "a_old1", "a_old2"]
+
+
+def test_evicted_copy_that_fails_to_delete_is_disowned(replicator, monkeypatch):
+    for i in range(3):
+        replicator.record_copy("a", f"a_{i}", i + 1)
+    delete_object = replicator.s3.delete_object
+
+    def failing(**kwargs):
+        raise ClientError({"Error": {"Code": "SlowDown", "Message": "slow down"}}, "DeleteObject")
+
+    monkeypatch.setattr(replicator.s3, "delete_object", failing)
+    replicator.record_copy("a", "a_3", 4)
+    monkeypatch.setattr(replicator.s3, "delete_object", delete_object)
+
+    by_kind = {item["CopyTimestamp"] == 0: item for item in items(replicator, "a")}
+    assert [c["CopyObj"] for c in by_kind[True]["Copies"]] == ["a_1", "a_2", "a_3"]
+    assert (by_kind[False]["CopyObj"], by_kind[False]["IsDisowned"]) == ("a_0", "true")
+
+
+def test_collapse_keeps_the_last_event_per_key(replicator):
+    records = [
+        record("ObjectCreated:Put", "a", "01"),
+        record("ObjectCreated:Put", "b", "02"),
+        record("ObjectCreated:Put", "a", "03"),
+        record("ObjectRemoved:Delete", "b", "04"),
+    ]
+    groups = replicator.collapse_records(records)
+    assert [[r["s3"]["object"]["sequencer"] for r in group] for group in groups] == [["03"], ["04"]]
+
+
+def test_collapse_keeps_a_delete_followed_by_a_put(replicator):
+    records = [
+        record("ObjectRemoved:Delete", "a", "01"),
+        record("ObjectCreated:Put", "a", "04"),
+        record("ObjectRemoved:Delete", "a", "02"),
+        record("ObjectCreated:Put", "a", "03"),
+    ]
+    (group,) = replicator.collapse_records(records)
+    assert [(r["eventName"], r["s3"]["object"]["sequencer"]) for r in group] == [
+        ("ObjectRemoved:Delete", "02"), ("ObjectCreated:Put", "04")
+    ]
+
+
+def test_delete_then_put_in_one_batch_disowns_the_old_copies(replicator):
+    put_source("a")
+    replicator.handler({"Records": [record("ObjectCreated:Put", "a", "01")]}, None)
+    (ring,) = items(replicator, "a")
+    (old_copy,) = ring["Copies"]
+
+    replicator.handler({"Records": [
+        record("ObjectRemoved:Delete", "a", "02"),
+        record("ObjectCreated:Put", "a", "03"),
+    ]}, None)
+
+    by_kind = {item["CopyTimestamp"] == 0: item for item in items(replicator, "a")}
+    assert by_kind[False]["CopyObj"] == old_copy["CopyObj"]
+    assert by_kind[False]["IsDisowned"] == "true"
+    assert len(by_kind[True]["Copies"]) == 1
+
+
+class Context:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def test_async_mode_abandons_and_reports_keys_past_the_deadline(replicator, monkeypatch, capsys):
+    import asyncio
+    put_source("fast")
+    put_source("slow")
+    copy_async = replicator.copy_engine.copy_async
+
+    async def stuck_on_slow(s3_async, src, key, *args, **kwargs):
+        if key == "slow":
+            await asyncio.sleep(10)
+        return await copy_async(s3_async, src, key, *args, **kwargs)
+
+    monkeypatch.setattr(replicator, "IO_MODE", "async")
+    monkeypatch.setattr(replicator.copy_engine, "copy_async", stuck_on_slow)
+    event = {"Records": [record("ObjectCreated:Put", "fast", "01"), record("ObjectCreated:Put", "slow", "02")]}
+    with pytest.raises(TimeoutError):
+        replicator.handler(event, Context(replicator.SAFETY_MARGIN_MS + 500))
+
+    out = capsys.readouterr().out
+    assert "Abandoned 1 keys at the time budget" in out
+    assert "Failed to replicate ObjectCreated:Put for slow: ran out of time" in out
+    (ring,) = items(replicator, "fast")
+    assert len(ring["Copies"]) == 1
+    assert items(replicator, "slow") == []
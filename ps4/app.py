@@ -36,6 +36,12 @@ lambda_stack = LambdaStack(
     app,
     "LambdaStack",
     table=dynamodb_stack.table,
+    object_index_table=dynamodb_stack.object_index_table,
+    totals_table=dynamodb_stack.totals_table,
+    rollup_table=dynamodb_stack.rollup_table,
+    logging_index_table=dynamodb_stack.logging_index_table,
+    sequencer_table=dynamodb_stack.sequencer_table,
+    checkpoint_table=dynamodb_stack.checkpoint_table,
     bucket_arn=s3_stack.bucket_arn,
     size_queue=messaging_stack.size_tracking_queue,
     log_queue=messaging_stack.logging_queue,
@@ -49,15 +55,14 @@ api_stack = APIStack(
     "APIStack",
     plotting_lambda=lambda_stack.plotting_lambda,
     bucket=s3_stack.bucket,
-    table=dynamodb_stack.table
+    table=dynamodb_stack.table,
+    object_index_table=dynamodb_stack.object_index_table
 )
 
-# 6) Create CloudWatch metric filter and alarm
+# 6) Create CloudWatch alarm on the logging Lambda's EMF metric
 monitoring_stack = MonitoringStack(
     app,
     "MonitoringStack",
-    # logging_lambda=lambda_stack.logging_lambda,
-    logging_log_group_name=f"/aws/lambda/{lambda_stack.logging_lambda.function_name}",
     # cleaner_lambda=lambda_stack.cleaner_lambda
     cleaner_lambda_name=lambda_stack.cleaner_lambda.function_name
 )
@@ -0,0 +1,381 @@
+"""
+Offline benchmarks for the ps4 and midterm Lambda handlers.
+
+Each handler is imported and invoked in-process against moto's S3 and
+DynamoDB, fed with synthetic S3 notifications (wrapped in SNS and SQS where
+the real pipeline does that). For every handler the run reports records per
+second, p50/p99 invocation latency and the AWS API calls it made, counted
+with a botocore event hook.
+
+    pip install -r requirements-dev.txt
+    python benchmarks/run_benchmarks.py --suite all --batches 20 --batch-size 10
+"""
+import argparse
+import importlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import redirect_stdout
+
+import boto3
+from moto import mock_aws
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PS4_LAMBDA = os.path.normpath(os.path.join(HERE, "..", "lambda"))
+MIDTERM_LAMBDA = os.path.normpath(os.path.join(HERE, "..", "..", "midterm", "lambda"))
+LAMBDA_DIRS = (PS4_LAMBDA, MIDTERM_LAMBDA)
+
+sys.path.insert(0, PS4_LAMBDA)
+from load_generator import percentiles  # noqa: E402
+
+REGION = "us-east-1"
+BUCKET = "bench-bucket"
+
+
+class ApiCalls:
+    """
+    Counts every AWS API call made through boto3's default session, by
+    "service.Operation". Counting can be paused around setup code.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.paused = False
+        self.lock = threading.Lock()
+
+    def install(self):
+        boto3.setup_default_session(region_name=REGION)
+        boto3.DEFAULT_SESSION.events.register("before-call", self)
+
+    def __call__(self, event_name, **kwargs):
+        if self.paused:
+            return
+        _, service, operation = event_name.split(".", 2)
+        with self.lock:
+            self.counts[f"{service}.{operation}"] += 1
+
+    def reset(self):
+        with self.lock:
+            self.counts = Counter()
+
+
+def serialize_moto():
+    """
+    moto's in-memory backends aren't thread-safe (a DynamoDB transaction
+    deep-copies the tables while other threads write to them), so let one
+    mocked request through at a time. The handlers' own threads still
+    overlap everything else.
+    """
+    from moto.core.botocore_stubber import BotocoreStubber
+    lock = threading.Lock()
+    process_request = BotocoreStubber.process_request
+
+    def locked(self, request):
+        with lock:
+            return process_request(self, request)
+
+    BotocoreStubber.process_request = locked
+
+
+class LambdaContext:
+    """
+    Just enough of the Lambda context object for the handlers.
+    """
+
+    def __init__(self, timeout_seconds=900):
+        self.deadline = time.time() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.time()) * 1000)
+
+
+def load_handler_module(lambda_dir, name, env):
+    """
+    Import a Lambda module from one of the lambda asset directories with the
+    given environment, re-running its module-level setup. The assets are flat
+    and share module names (event_ordering), so modules imported from the
+    other asset are dropped first.
+    """
+    os.environ.update(env)
+    for module_name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None) or ""
+        if path.startswith(LAMBDA_DIRS) and (not path.startswith(lambda_dir) or module_name == name):
+            del sys.modules[module_name]
+    for path in LAMBDA_DIRS:
+        while path in sys.path:
+            sys.path.remove(path)
+    sys.path.insert(0, lambda_dir)
+    return importlib.import_module(name)
+
+
+def s3_record(event_name, key, sequencer, size=None, bucket=BUCKET):
+    obj = {"key": key, "sequencer": f"{sequencer:016X}"}
+    if size is not None:
+        obj["size"] = size
+    return {
+        "eventSource": "aws:s3",
+        "eventName": event_name,
+        "s3": {"bucket": {"name": bucket}, "object": obj},
+    }
+
+
+def sqs_event(s3_records, batch_number):
+    """
+    An SQS batch with one SNS-wrapped S3 notification per message.
+    """
+    return {
+        "Records": [
+            {
+                "messageId": f"msg-{batch_number}-{i}",
+                "body": json.dumps({"Message": json.dumps({"Records": [record]})}),
+            }
+            for i, record in enumerate(s3_records)
+        ]
+    }
+
+
+def create_table(dynamodb, name, hash_key, range_key=None, indexes=()):
+    """
+    Create a PAY_PER_REQUEST table; keys are (name, type) pairs, and indexes
+    are (index_name, hash_key, range_key, projection) tuples.
+    """
+    attributes = {hash_key[0]: hash_key[1]}
+    schema = [{"AttributeName": hash_key[0], "KeyType": "HASH"}]
+    if range_key:
+        attributes[range_key[0]] = range_key[1]
+        schema.append({"AttributeName": range_key[0], "KeyType": "RANGE"})
+
+    kwargs = {}
+    if indexes:
+        kwargs["GlobalSecondaryIndexes"] = []
+        for index_name, index_hash, index_range, projection in indexes:
+            attributes[index_hash[0]] = index_hash[1]
+            attributes[index_range[0]] = index_range[1]
+            kwargs["GlobalSecondaryIndexes"].append({
+                "IndexName": index_name,
+                "KeySchema": [
+                    {"AttributeName": index_hash[0], "KeyType": "HASH"},
+                    {"AttributeName": index_range[0], "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": projection},
+            })
+
+    dynamodb.create_table(
+        TableName=name,
+        KeySchema=schema,
+        AttributeDefinitions=[{"AttributeName": n, "AttributeType": t} for n, t in attributes.items()],
+        BillingMode="PAY_PER_REQUEST",
+        **kwargs
+    )
+
+
+def run_scenario(calls, name, invoke, events, records_per_event, before_each=None):
+    """
+    Invoke a handler once per event and summarise latency, throughput and
+    API calls. before_each runs untimed and uncounted before every call.
+    """
+    latencies = []
+    calls.reset()
+    with redirect_stdout(io.StringIO()):
+        for event in events:
+            if before_each:
+                calls.paused = True
+                before_each()
+                calls.paused = False
+            started = time.perf_counter()
+            invoke(event)
+            latencies.append(time.perf_counter() - started)
+
+    records = records_per_event * len(events)
+    busy = sum(latencies)
+    return {
+        "handler": name,
+        "invocations": len(events),
+        "records": records,
+        "records_per_second": round(records / busy, 1) if busy else None,
+        "latency_ms": percentiles(latencies),
+        "api_calls": dict(sorted(calls.counts.items())),
+        "api_calls_per_invocation": round(sum(calls.counts.values()) / len(events), 1),
+    }
+
+
+def put_objects(s3, bucket, keys, size):
+    body = b"x" * size
+    for key in keys:
+        s3.put_object(Bucket=bucket, Key=key, Body=body)
+
+
+def bench_ps4(calls, batches, batch_size):
+    s3 = boto3.client("s3", region_name=REGION)
+    ddb = boto3.client("dynamodb", region_name=REGION)
+    s3.create_bucket(Bucket=BUCKET)
+
+    create_table(ddb, "history", ("bucket_name", "S"), ("timestamp", "N"))
+    create_table(ddb, "object-index", ("bucket_name", "S"), ("object_key", "S"),
+                 indexes=[("SizeIndex", ("bucket_name", "S"), ("size", "N"), "KEYS_ONLY")])
+    create_table(ddb, "totals", ("bucket_name", "S"))
+    create_table(ddb, "rollups", ("series", "S"), ("bucket_start", "N"))
+    create_table(ddb, "logging-index", ("bucket_name", "S"), ("object_key", "S"))
+    create_table(ddb, "sequencers", ("object_id", "S"))
+
+    env = {
+        "BUCKET_NAME": BUCKET,
+        "DYNAMODB_TABLE_NAME": "history",
+        "OBJECT_INDEX_TABLE_NAME": "object-index",
+        "TOTALS_TABLE_NAME": "totals",
+        "ROLLUP_TABLE_NAME": "rollups",
+        "SIZE_INDEX_TABLE_NAME": "logging-index",
+        "SEQUENCER_TABLE_NAME": "sequencers",
+    }
+
+    keys = [f"bench/{i:06d}.bin" for i in range(batches * batch_size)]
+    put_objects(s3, BUCKET, keys, 1024)
+    put_events = [
+        sqs_event([s3_record("ObjectCreated:Put", key, n * batch_size + i + 1, 1024)
+                   for i, key in enumerate(keys[n * batch_size:(n + 1) * batch_size])], n)
+        for n in range(batches)
+    ]
+
+    results = []
+    size_tracking = load_handler_module(PS4_LAMBDA, "size_tracking_lambda", env)
+    results.append(run_scenario(calls, "size_tracking_lambda", lambda e: size_tracking.lambda_handler(e, None),
+                                put_events, batch_size))
+
+    logging_lambda = load_handler_module(PS4_LAMBDA, "logging_lambda", env)
+    results.append(run_scenario(calls, "logging_lambda", lambda e: logging_lambda.lambda_handler(e, None),
+                                put_events, batch_size))
+
+    results.append(run_scenario(calls, "size_tracking_lambda.reconcile_handler",
+                                lambda e: size_tracking.reconcile_handler(e, None), [{}] * 3, len(keys)))
+
+    try:
+        plotting = load_handler_module(PS4_LAMBDA, "plotting_lambda", env)
+    except ImportError as e:
+        print(f"Skipping plotting_lambda: {e}", file=sys.stderr)
+    else:
+        from size_index import BucketTotals
+        totals = BucketTotals(boto3.resource("dynamodb", region_name=REGION).Table("totals"))
+        plot_events = [{"queryStringParameters": {"window": "300"}}] * 5
+        # A history write forces a fresh render; without one the cached plot is served
+        results.append(run_scenario(calls, "plotting_lambda (render)", lambda e: plotting.lambda_handler(e, None),
+                                    plot_events, 1, before_each=lambda: totals.bump_history_version(BUCKET)))
+        results.append(run_scenario(calls, "plotting_lambda (cached)", lambda e: plotting.lambda_handler(e, None),
+                                    plot_events, 1))
+
+    # Each run evicts roughly a tenth of what's left
+    cleaner = load_handler_module(PS4_LAMBDA, "cleaner_lambda", dict(env, EVICTION_POLICY="largest"))
+
+    def evict_tenth(event):
+        size = cleaner.get_bucket_size()
+        cleaner.lambda_handler({"target_size": size - size // 10}, None)
+
+    results.append(run_scenario(calls, "cleaner_lambda (budget)", evict_tenth, [{}] * 3, 1))
+    return results
+
+
+def bench_midterm(calls, batches, batch_size):
+    s3 = boto3.client("s3", region_name=REGION)
+    ddb = boto3.client("dynamodb", region_name=REGION)
+    s3.create_bucket(Bucket="bench-src")
+    s3.create_bucket(Bucket="bench-dst")
+
+    create_table(ddb, "TableT", ("OriginalObj", "S"), ("CopyTimestamp", "N"),
+                 indexes=[("DisownedIndex", ("IsDisowned", "S"), ("DeleteTime", "N"), "ALL")])
+    create_table(ddb, "midterm-sequencers", ("object_id", "S"))
+
+    env = {
+        "SRC_BUCKET": "bench-src",
+        "DST_BUCKET": "bench-dst",
+        "TABLE_NAME": "TableT",
+        "SEQUENCER_TABLE_NAME": "midterm-sequencers",
+    }
+
+    keys = [f"bench/{i:06d}.bin" for i in range(batches * batch_size)]
+    put_objects(s3, "bench-src", keys, 1024)
+    put_events = [
+        {"Records": [s3_record("ObjectCreated:Put", key, n * batch_size + i + 1, 1024, bucket="bench-src")
+                     for i, key in enumerate(keys[n * batch_size:(n + 1) * batch_size])]}
+        for n in range(batches)
+    ]
+    delete_events = [
+        {"Records": [s3_record("ObjectRemoved:Delete", key, 10 ** 6 + n * batch_size + i, bucket="bench-src")
+                     for i, key in enumerate(keys[n * batch_size:(n + 1) * batch_size])]}
+        for n in range(batches)
+    ]
+
+    results = []
+    replicator = load_handler_module(MIDTERM_LAMBDA, "replicator", env)
+    results.append(run_scenario(calls, "replicator (put)", lambda e: replicator.handler(e, None),
+                                put_events, batch_size))
+    results.append(run_scenario(calls, "replicator (delete)", lambda e: replicator.handler(e, None),
+                                delete_events, batch_size))
+
+    # Age the disowned copies past the cleaner's 10 second grace period
+    table = boto3.resource("dynamodb", region_name=REGION).Table("TableT")
+    calls.paused = True
+    for item in table.scan()["Items"]:
+        if item.get("IsDisowned") == "true":
+            table.update_item(
+                Key={"OriginalObj": item["OriginalObj"], "CopyTimestamp": item["CopyTimestamp"]},
+                UpdateExpression="SET DeleteTime = :t",
+                ExpressionAttributeValues={":t": 0},
+            )
+    calls.paused = False
+
+    cleaner = load_handler_module(MIDTERM_LAMBDA, "cleaner", env)
+    results.append(run_scenario(calls, "cleaner", lambda e: cleaner.handler(e, LambdaContext()), [{}], len(keys)))
+    return results
+
+
+def print_table(results):
+    header = f"{'handler':40} {'calls':>6} {'records/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'API/call':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['handler']:40} {r['invocations']:>6} {r['records_per_second'] or 0:>10} "
+              f"{r['latency_ms']['p50']:>8} {r['latency_ms']['p99']:>8} {r['api_calls_per_invocation']:>9}")
+    print()
+    for r in results:
+        print(f"{r['handler']}: " + ", ".join(f"{op}={n}" for op, n in r["api_calls"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--suite", choices=("ps4", "midterm", "all"), default="all")
+    parser.add_argument("--batches", type=int, default=20, help="invocations per handler")
+    parser.add_argument("--batch-size", type=int, default=10, help="S3 records per invocation")
+    parser.add_argument("--io-mode", choices=("threads", "async"), default="threads",
+                        help="IO_MODE for the handlers that support both")
+    parser.add_argument("--json", help="also write the full results to this file")
+    args = parser.parse_args()
+
+    # Credentials and region for moto; nothing leaves the process
+    os.environ.update({
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_DEFAULT_REGION": REGION,
+        "IO_MODE": args.io_mode,
+    })
+
+    calls = ApiCalls()
+    results = []
+    serialize_moto()
+    with mock_aws():
+        calls.install()
+        if args.suite in ("ps4", "all"):
+            results.extend(bench_ps4(calls, args.batches, args.batch_size))
+        if args.suite in ("midterm", "all"):
+            results.extend(bench_midterm(calls, args.batches, args.batch_size))
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import aio
+
+# list_objects_v2 returns at most 1,000 keys per page
+PAGE_SIZE = 1000
+
+# Where the keys under a prefix are split into key ranges when the prefix
+# has no subprefixes to list in parallel: before each of these as the next
+# character, in S3's (UTF-8 binary) listing order
+SPLIT_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+
+def list_prefix(s3_client, bucket_name, prefix="", delimiter=None, continuation_token=None, start_after=None):
+    """
+    Yield every page of list_objects_v2 under a prefix, following
+    continuation tokens until the listing is exhausted. continuation_token
+    starts from a page an earlier listing stopped at; otherwise start_after
+    skips every key up to and including it.
+    """
+    kwargs = {"Bucket": bucket_name, "Prefix": prefix, "MaxKeys": PAGE_SIZE}
+    if delimiter:
+        kwargs["Delimiter"] = delimiter
+    if continuation_token:
+        kwargs["ContinuationToken"] = continuation_token
+    elif start_after:
+        kwargs["StartAfter"] = start_after
+
+    while True:
+        response = s3_client.list_objects_v2(**kwargs)
+        yield response
+        if not response.get("IsTruncated"):
+            return
+        kwargs.pop("StartAfter", None)
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+
+def listed_upto(page):
+    """
+    Upper end of the key range a listing has accounted for once it has
+    returned this page: every key up to it is on this page or an earlier
+    one, or rolled up into a common prefix. None on the last page, which
+    accounts for the rest of the listing.
+    """
+    if not page.get("IsTruncated"):
+        return None
+    keys = [o["Key"] for o in page.get("Contents", [])[-1:]]
+    keys += [p["Prefix"] for p in page.get("CommonPrefixes", [])[-1:]]
+    return max(keys)
+
+
+def _common_prefixes(page):
+    return [p["Prefix"] for p in page.get("CommonPrefixes", [])]
+
+
+def _visit(on_page, prefix, delimiter, page, after):
+    """
+    Report a page to the caller's on_page(prefix, delimiter, objects, after,
+    upto, common_prefixes) hook: objects are all the keys under the prefix
+    in (after, upto] except those below a delimiter, which are rolled up
+    into common_prefixes (always empty without a delimiter). Returns upto,
+    the `after` of the listing's next page.
+    """
+    upto = listed_upto(page)
+    if on_page:
+        on_page(prefix, delimiter, page.get("Contents", []), after, upto, _common_prefixes(page))
+    return upto
+
+
+def new_shard(prefix, after=None, upto=None):
+    """
+    A piece of the keyspace to list on its own: the keys under prefix in
+    (after, upto], where None leaves that end open. token is the
+    continuation token of its next page once it has been started.
+    """
+    return {"prefix": prefix, "after": after, "upto": upto, "token": None}
+
+
+def split_shard(prefix, after=None):
+    """
+    Key-range shards that together cover everything under prefix after the
+    given key, split at each of SPLIT_CHARS: (after, prefix + "0"],
+    (prefix + "0", prefix + "1"], ... (prefix + "z", ..). Each range starts
+    with a StartAfter, so flat keys can still be listed in parallel.
+    """
+    bounds = [prefix + char for char in SPLIT_CHARS if after is None or prefix + char > after]
+    return [new_shard(prefix, start, upto) for start, upto in zip([after] + bounds, bounds + [None])]
+
+
+def _clip(shard, page):
+    """
+    The page's objects that fall in the shard's range, its next continuation
+    token (None once the shard is done) and the key the next page starts
+    after (the shard's upper end once it is done).
+    """
+    objects = page.get("Contents", [])
+    token = page.get("NextContinuationToken") if page.get("IsTruncated") else None
+    upto = shard.get("upto")
+    if upto is not None and objects and objects[-1]["Key"] >= upto:
+        objects = [obj for obj in objects if obj["Key"] <= upto]
+        token = None
+    return objects, token, (objects[-1]["Key"] if token else upto)
+
+
+def list_shard(s3_client, bucket_name, shard, on_page=None):
+    """
+    Yield (objects, token, after) for each page of a shard from where it
+    stands: the page's objects in range, the continuation token of the next
+    page (None once the shard is done) and the last key accounted for.
+    Every page is reported to on_page.
+    """
+    after = shard.get("after")
+    pages = list_prefix(
+        s3_client, bucket_name, shard["prefix"], continuation_token=shard.get("token"), start_after=after
+    )
+    for page in pages:
+        objects, token, upto = _clip(shard, page)
+        if on_page:
+            on_page(shard["prefix"], None, objects, after, upto, [])
+        after = upto
+        yield objects, token, after
+        if token is None:
+            return
+
+
+def _empty_stats():
+    return {"total_size": 0, "object_count": 0, "largest": None}
+
+
+def _add_objects(stats, objects):
+    for obj in objects:
+        stats["total_size"] += obj["Size"]
+        stats["object_count"] += 1
+        if stats["largest"] is None or obj["Size"] > stats["largest"]["Size"]:
+            stats["largest"] = {"Key": obj["Key"], "Size": obj["Size"]}
+
+
+def _merge_stats(stats, other):
+    stats["total_size"] += other["total_size"]
+    stats["object_count"] += other["object_count"]
+    if other["largest"] and (stats["largest"] is None or other["largest"]["Size"] > stats["largest"]["Size"]):
+        stats["largest"] = other["largest"]
+
+
+def scan_shard(s3_client, bucket_name, shard, on_page=None):
+    """
+    Serially list one shard and return its stats.
+    """
+    stats = _empty_stats()
+    for objects, _, _ in list_shard(s3_client, bucket_name, shard, on_page):
+        _add_objects(stats, objects)
+    return stats
+
+
+def scan_prefix(s3_client, bucket_name, prefix, on_page=None):
+    """
+    Serially list everything under one prefix and return its stats.
+    """
+    return scan_shard(s3_client, bucket_name, new_shard(prefix), on_page)
+
+
+def plan_shards(page, prefix=""):
+    """
+    Shards for the keyspace under prefix, from the first page of its listing
+    with a delimiter, and the objects of that page not covered by them. A
+    level that fits in one page gets one shard per common prefix. A longer
+    level (typically flat keys) is split into key ranges as a whole rather
+    than listed serially to find out.
+    """
+    objects = page.get("Contents", [])
+    prefixes = _common_prefixes(page)
+    if page.get("IsTruncated"):
+        return [], split_shard(prefix)
+    return objects, [new_shard(p) for p in prefixes]
+
+
+def split_rest(shard, token, after):
+    """
+    What is left of a shard after its first page: nothing once it is done,
+    otherwise the rest of it split into key ranges. Only a prefix with more
+    than a page of keys is worth listing in parallel.
+    """
+    return split_shard(shard["prefix"], after) if token else []
+
+
+def discover_shards(s3_client, bucket_name, prefix="", delimiter="/", on_page=None):
+    """
+    List the first page of one level of the keyspace with a delimiter.
+    Returns the objects found on the way and the shards to list in parallel
+    for the rest (see plan_shards). When the level is a single common prefix,
+    its first page is listed as well and the prefix is only split into key
+    ranges if there is more than that page.
+    """
+    page = next(list_prefix(s3_client, bucket_name, prefix, delimiter))
+    _visit(on_page, prefix, delimiter, page, None)
+    objects, shards = plan_shards(page, prefix)
+    if len(shards) == 1 and not page.get("IsTruncated"):
+        first, token, after = next(list_shard(s3_client, bucket_name, shards[0], on_page))
+        objects, shards = objects + first, split_rest(shards[0], token, after)
+    return objects, shards
+
+
+def scan_bucket(s3_client, bucket_name, prefixes=None, delimiter="/", max_workers=8, breakdown=False,
+                on_page=None):
+    """
+    Compute total size, object count and the largest object of a bucket.
+
+    The keyspace is split into shards, either the given prefixes or what
+    discover_shards finds, and each shard is listed on a thread pool. With
+    breakdown=True the result also has per-prefix stats under "prefixes".
+    on_page, if given, sees every page listed (see _visit); it is called
+    from the pool's threads.
+    """
+    result = _empty_stats()
+    per_prefix = {}
+
+    if prefixes is None:
+        root_objects, shards = discover_shards(s3_client, bucket_name, delimiter=delimiter, on_page=on_page)
+        _add_objects(result, root_objects)
+        if breakdown and root_objects:
+            per_prefix[""] = _empty_stats()
+            _add_objects(per_prefix[""], root_objects)
+    else:
+        shards = [new_shard(prefix) for prefix in prefixes]
+
+    if shards:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(shards))) as pool:
+            shard_stats = pool.map(lambda shard: scan_shard(s3_client, bucket_name, shard, on_page), shards)
+            for shard, stats in zip(shards, shard_stats):
+                _merge_stats(result, stats)
+                if breakdown:
+                    _merge_stats(per_prefix.setdefault(shard["prefix"], _empty_stats()), stats)
+
+    if breakdown:
+        result["prefixes"] = per_prefix
+    return result
+
+
+def scan_resumable(s3_client, bucket_name, state=None, budget=None, delimiter="/", max_workers=8,
+                   on_page=None):
+    """
+    Total size and object count of a bucket, listed in pieces that fit a
+    time budget. state is None for a new scan, or what an earlier call
+    returned: running totals plus the shards still to list, each with the
+    continuation token of its next page and the last key accounted for.
+    Shards are listed in parallel and each stops after the page during which
+    the budget ran out. on_page is called as for scan_bucket. Returns
+    (state, done); state only holds strings and ints so it can be
+    checkpointed to DynamoDB as is.
+
+    Discovery lists at most two pages, so the root level is never listed to
+    the end before the budget is first checked; if the budget runs out
+    during it, the shards are returned unstarted for the next call.
+    """
+    if state is None:
+        root_objects, shards = discover_shards(s3_client, bucket_name, delimiter=delimiter, on_page=on_page)
+        state = {
+            "total_size": sum(o["Size"] for o in root_objects),
+            "object_count": len(root_objects),
+            "shards": shards,
+        }
+        if shards and budget and budget.exhausted():
+            return state, False
+
+    def list_some(shard):
+        total_size = object_count = 0
+        token, after = None, shard.get("after")
+        for objects, token, after in list_shard(s3_client, bucket_name, shard, on_page):
+            total_size += sum(o["Size"] for o in objects)
+            object_count += len(objects)
+            if token and budget and budget.exhausted():
+                break
+        return total_size, object_count, token, after
+
+    shards = state["shards"]
+    remaining = []
+    if shards:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(shards))) as pool:
+            for shard, (total_size, object_count, token, after) in zip(shards, pool.map(list_some, shards)):
+                state["total_size"] += total_size
+                state["object_count"] += object_count
+                if token:
+                    remaining.append(dict(shard, token=token, after=after))
+
+    state["shards"] = remaining
+    return state, not remaining
+
+
+def list_all_objects(s3_client, bucket_name, delimiter="/", max_workers=8):
+    """
+    Every object of the bucket as {"Key", "Size", "LastModified"}, listed
+    with the same sharding as scan_bucket.
+    """
+    root_objects, shards = discover_shards(s3_client, bucket_name, delimiter=delimiter)
+
+    def list_objects(shard):
+        objects = []
+        for page_objects, _, _ in list_shard(s3_client, bucket_name, shard):
+            objects.extend(page_objects)
+        return objects
+
+    objects = list(root_objects)
+    if shards:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(shards))) as pool:
+            for shard_objects in pool.map(list_objects, shards):
+                objects.extend(shard_objects)
+    return [{"Key": o["Key"], "Size": o["Size"], "LastModified": o["LastModified"]} for o in objects]
+
+
+async def list_prefix_async(client, bucket_name, prefix="", delimiter=None, start_after=None):
+    """
+    list_prefix() on an aio.AsyncClient, as an async generator of pages.
+    """
+    kwargs = {"Bucket": bucket_name, "Prefix": prefix, "MaxKeys": PAGE_SIZE}
+    if delimiter:
+        kwargs["Delimiter"] = delimiter
+    if start_after:
+        kwargs["StartAfter"] = start_after
+
+    while True:
+        response = await client.list_objects_v2(**kwargs)
+        yield response
+        if not response.get("IsTruncated"):
+            return
+        kwargs.pop("StartAfter", None)
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+
+async def _report_async(on_page, *args):
+    if on_page:
+        # The hook makes blocking calls, so keep it off the event loop
+        await asyncio.to_thread(on_page, *args)
+
+
+async def scan_shard_async(client, bucket_name, shard, on_page=None):
+    stats = _empty_stats()
+    after = shard.get("after")
+    async for page in list_prefix_async(client, bucket_name, shard["prefix"], start_after=after):
+        objects, token, upto = _clip(shard, page)
+        _add_objects(stats, objects)
+        await _report_async(on_page, shard["prefix"], None, objects, after, upto, [])
+        after = upto
+        if token is None:
+            break
+    return stats
+
+
+async def scan_prefix_async(client, bucket_name, prefix, on_page=None):
+    return await scan_shard_async(client, bucket_name, new_shard(prefix), on_page)
+
+
+async def scan_bucket_async(client, bucket_name, prefixes=None, delimiter="/", breakdown=False, deadline=None,
+                            on_page=None):
+    """
+    scan_bucket() on an aio.AsyncClient: every shard is listed concurrently,
+    bounded by the client's semaphore. A partial total is worse than none,
+    so if the deadline passes the unfinished shards are cancelled and
+    TimeoutError is raised.
+    """
+    result = _empty_stats()
+    per_prefix = {}
+
+    if prefixes is None:
+        page = await client.list_objects_v2(
+            Bucket=bucket_name, Prefix="", Delimiter=delimiter, MaxKeys=PAGE_SIZE
+        )
+        await _report_async(
+            on_page, "", delimiter, page.get("Contents", []), None, listed_upto(page), _common_prefixes(page)
+        )
+        root_objects, shards = plan_shards(page)
+        if len(shards) == 1 and not page.get("IsTruncated"):
+            first = await client.list_objects_v2(Bucket=bucket_name, Prefix=shards[0]["prefix"], MaxKeys=PAGE_SIZE)
+            objects, token, after = _clip(shards[0], first)
+            await _report_async(on_page, shards[0]["prefix"], None, objects, None, after, [])
+            root_objects, shards = root_objects + objects, split_rest(shards[0], token, after)
+        _add_objects(result, root_objects)
+        if breakdown and root_objects:
+            per_prefix[""] = _empty_stats()
+            _add_objects(per_prefix[""], root_objects)
+    else:
+        shards = [new_shard(prefix) for prefix in prefixes]
+
+    tasks = [asyncio.ensure_future(scan_shard_async(client, bucket_name, shard, on_page)) for shard in shards]
+    if await aio.wait_all(tasks, deadline):
+        raise TimeoutError(f"Scan of {bucket_name} did not finish within the time budget")
+
+    for shard, task in zip(shards, tasks):
+        stats = task.result()
+        _merge_stats(result, stats)
+        if breakdown:
+            _merge_stats(per_prefix.setdefault(shard["prefix"], _empty_stats()), stats)
+
+    if breakdown:
+        result["prefixes"] = per_prefix
+    return result
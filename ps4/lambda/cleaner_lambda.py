@@ -1,35 +1,173 @@
 import os
-import boto3
+import json
 import logging
 
+import aws_clients
+
+from budget import Budget, CheckpointBusy, Checkpoints, lease_seconds, resume_later, run_id
+from bucket_scanner import scan_bucket, list_all_objects
+from eviction import select_victims, delete_objects, order_ties, policy_key
+from size_index import ObjectSizeIndex, BucketTotals, SizeLedger
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-s3 = boto3.client("s3")
+s3 = aws_clients.client("s3")
+lambda_client = aws_clients.client("lambda")
 BUCKET_NAME = os.environ["BUCKET_NAME"]
 
+# Size-ordered object index maintained by the size tracker. Without it the
+# cleaner falls back to listing the whole bucket.
+OBJECT_INDEX_TABLE_NAME = os.environ.get("OBJECT_INDEX_TABLE_NAME")
+TOTALS_TABLE_NAME = os.environ.get("TOTALS_TABLE_NAME")
+
+# Optional byte budget: evict objects until the bucket fits in it, choosing
+# victims by EVICTION_POLICY (largest, oldest or lru). Without a budget a
+# single largest object is deleted per alarm. Both can be overridden by
+# invoking the cleaner with {"target_size": ..., "policy": ...}.
+SIZE_BUDGET_BYTES = os.environ.get("SIZE_BUDGET_BYTES")
+EVICTION_POLICY = os.environ.get("EVICTION_POLICY", "largest")
+
+# An eviction that runs short of time checkpoints what is left to free and
+# the last object it deleted, then hands over to a fresh invocation
+CHECKPOINT_TABLE_NAME = os.environ.get("CHECKPOINT_TABLE_NAME")
+SAFETY_MARGIN_MS = int(os.environ.get("SAFETY_MARGIN_MS", "5000"))
+CHECKPOINT_JOB_ID = f"cleaner:{BUCKET_NAME}"
+
+def get_bucket_size():
+    """
+    Current bucket size from the running total, or from a full scan.
+    """
+    if TOTALS_TABLE_NAME:
+        totals = BucketTotals(aws_clients.table(TOTALS_TABLE_NAME)).get(BUCKET_NAME)
+        return int(totals.get("total_size", 0))
+    return scan_bucket(s3, BUCKET_NAME)["total_size"]
+
+def get_candidates(policy):
+    """
+    Objects to choose victims from, and whether they already come in policy
+    order. Largest-first reads the size index lazily; the other policies need
+    LastModified, so they list the bucket.
+    """
+    if policy == "largest" and OBJECT_INDEX_TABLE_NAME:
+        index = ObjectSizeIndex(aws_clients.table(OBJECT_INDEX_TABLE_NAME))
+        objects = ({"Key": key, "Size": size} for key, size in index.largest(BUCKET_NAME))
+        return order_ties(objects, policy), True
+    return list_all_objects(s3, BUCKET_NAME), False
+
+def forget_deleted(victims, report):
+    """
+    Drop the objects DeleteObjects removed from the size index and subtract
+    them from the running totals. Keys outside the ObjectRemoved notification
+    filter never reach the size tracker, and without this the index would
+    keep offering the same deleted objects as victims. The ledger works out
+    deltas from the index, so the tracker handling the removal events as
+    well counts nothing twice. Returns the bytes taken off the totals.
+    """
+    if not (OBJECT_INDEX_TABLE_NAME and TOTALS_TABLE_NAME):
+        return 0
+    failed = {error["Key"] for error in report["errors"]}
+    deleted = [obj["Key"] for obj in victims[:report["processed"]] if obj["Key"] not in failed]
+    if not deleted:
+        return 0
+    ledger = SizeLedger(aws_clients.client("dynamodb"), OBJECT_INDEX_TABLE_NAME, TOTALS_TABLE_NAME)
+    size_delta, _ = ledger.apply(BUCKET_NAME, dict.fromkeys(deleted))
+    return -size_delta
+
+def release_lease(checkpoints, owner, checkpoint):
+    """
+    Give up the lease of a run that failed, so alarms aren't turned away
+    until it expires. A resumed eviction keeps its checkpoint; objects
+    deleted since it was saved are simply deleted again by the next run.
+    """
+    try:
+        if checkpoint:
+            checkpoints.save(CHECKPOINT_JOB_ID, owner, checkpoint)
+        else:
+            checkpoints.clear(CHECKPOINT_JOB_ID, owner)
+    except Exception as e:
+        logger.error(f"Could not release the eviction lease: {e}")
+
+@aws_clients.log_request_stats
 def lambda_handler(event, context):
+    checkpoints, owner, checkpoint, leased = None, run_id(context), None, False
     try:
         logger.info(f"Cleaner triggered by CloudWatch alarm. Bucket: {BUCKET_NAME}")
+        event = event or {}
+        checkpoints = Checkpoints(aws_clients.table(CHECKPOINT_TABLE_NAME)) if CHECKPOINT_TABLE_NAME else None
+        after = None
+        if checkpoints:
+            # Leased, so an alarm firing while a resumed eviction runs
+            # doesn't start a second one over the same objects
+            try:
+                checkpoint = checkpoints.acquire(CHECKPOINT_JOB_ID, owner, lease_seconds(context))
+                leased = True
+            except CheckpointBusy:
+                logger.info("An eviction is already running.")
+                return
+
+        # 1. Work out how much has to go, or pick up an eviction that ran
+        #    out of time (the totals may not reflect its deletes yet)
+        if checkpoint:
+            policy = checkpoint["policy"]
+            bytes_to_free = int(checkpoint["bytes_to_free"])
+            after = tuple(checkpoint["after"]) if checkpoint.get("after") else None
+            logger.info(f"Resuming {policy} eviction, {bytes_to_free} bytes still to free")
+        else:
+            policy = event.get("policy", EVICTION_POLICY)
+            target_size = event.get("target_size", SIZE_BUDGET_BYTES)
+            if target_size is not None:
+                bytes_to_free = get_bucket_size() - int(target_size)
+                if bytes_to_free <= 0:
+                    if checkpoints:
+                        checkpoints.clear(CHECKPOINT_JOB_ID, owner)
+                    logger.info("Bucket is already within its size budget.")
+                    return
+            else:
+                # No budget: just the single largest object, as before
+                policy, bytes_to_free = "largest", 1
 
-        # 1. List all objects in the bucket
-        response = s3.list_objects_v2(Bucket=BUCKET_NAME)
-        if "Contents" not in response or not response["Contents"]:
+        # 2. Choose victims by policy, skipping everything up to the last
+        #    object an earlier run deleted
+        candidates, presorted = get_candidates(policy)
+        if after is not None:
+            candidates = (obj for obj in candidates if policy_key(obj, policy) > after)
+        victims = select_victims(candidates, bytes_to_free, policy, presorted=presorted)
+        if not victims:
+            if checkpoints:
+                checkpoints.clear(CHECKPOINT_JOB_ID, owner)
             logger.info("No objects in bucket.")
             return
 
-        objects = response["Contents"]
-
-        # 2. Find the largest file
-        largest = max(objects, key=lambda obj: obj["Size"])
-        key = largest["Key"]
-        size = largest["Size"]
+        # 3. Delete them in DeleteObjects batches while the time budget lasts,
+        #    then drop the deleted ones from the index and the totals
+        logger.info(f"Deleting {len(victims)} objects ({policy} first), starting with {victims[0]['Key']}")
+        report = delete_objects(s3, BUCKET_NAME, victims, budget=Budget(context, SAFETY_MARGIN_MS))
+        report.update({"policy": policy, "bytes_to_free": bytes_to_free})
+        report["bytes_unindexed"] = forget_deleted(victims, report)
 
-        logger.info(f"Deleting largest file: {key} ({size} bytes)")
+        # 4. Checkpoint unfinished work and continue in a fresh invocation
+        if checkpoints and report["processed"] < len(victims):
+            if report["processed"]:
+                after = policy_key(victims[report["processed"] - 1], policy)
+            try:
+                checkpoints.save(CHECKPOINT_JOB_ID, owner, {
+                    "policy": policy,
+                    "bytes_to_free": bytes_to_free - report["bytes_reclaimed"],
+                    "after": list(after) if after else None,
+                })
+                leased = False
+                resume_later(lambda_client, context)
+                report["resumed_later"] = True
+            except CheckpointBusy:
+                logger.info("Another run took the eviction over; not resuming this one.")
+        elif checkpoints:
+            checkpoints.clear(CHECKPOINT_JOB_ID, owner)
 
-        # 3. Delete it
-        s3.delete_object(Bucket=BUCKET_NAME, Key=key)
-        logger.info(f"Deleted: {key}")
+        logger.info(f"Eviction report: {json.dumps(report, default=str)}")
+        return report
 
     except Exception as e:
         logger.error(f"Error in cleaner lambda: {e}")
+        if leased:
+            release_lease(checkpoints, owner, checkpoint)
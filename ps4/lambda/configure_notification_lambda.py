@@ -1,10 +1,11 @@
 import json
-import boto3
+import aws_clients
 import cfnresponse  # Make sure to include this in your zip
 
+@aws_clients.log_request_stats
 def lambda_handler(event, context):
     print("Event:", json.dumps(event))
-    s3 = boto3.client("s3")
+    s3 = aws_clients.client("s3")
     
     try:
         props = event['ResourceProperties']
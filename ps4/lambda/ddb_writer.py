@@ -0,0 +1,78 @@
+import time
+
+# BatchWriteItem accepts at most 25 put/delete requests per call
+MAX_BATCH_SIZE = 25
+
+
+class BufferedBatchWriter:
+    """
+    Collects items for one DynamoDB table and writes them with BatchWriteItem
+    in groups of up to 25, retrying UnprocessedItems with exponential backoff.
+
+    `dynamodb` is a boto3 DynamoDB service resource (or any stand-in with a
+    compatible batch_write_item), so a DynamoDB Local endpoint works offline.
+    Items with the same key_names values replace each other in the buffer,
+    since BatchWriteItem rejects duplicate keys in one request.
+    """
+
+    def __init__(self, dynamodb, table_name, key_names, batch_size=MAX_BATCH_SIZE,
+                 max_retries=5, base_delay=0.05, sleep=time.sleep):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.key_names = key_names
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.sleep = sleep
+
+        self._buffer = {}
+        self.flush_count = 0
+        self.items_written = 0
+        self.retry_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+    def put(self, item):
+        """
+        Buffer one item, sending a batch as soon as a full one is available.
+        """
+        key = tuple(item[name] for name in self.key_names)
+        self._buffer[key] = item
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write everything in the buffer. Raises RuntimeError if some items are
+        still unprocessed after max_retries attempts.
+        """
+        items = list(self._buffer.values())
+        self._buffer.clear()
+
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            self._write_batch([{"PutRequest": {"Item": item}} for item in batch])
+            self.items_written += len(batch)
+
+    def _write_batch(self, requests):
+        attempt = 0
+        while requests:
+            response = self.dynamodb.batch_write_item(RequestItems={self.table_name: requests})
+            self.flush_count += 1
+            requests = response.get("UnprocessedItems", {}).get(self.table_name, [])
+            if not requests:
+                return
+
+            attempt += 1
+            if attempt > self.max_retries:
+                raise RuntimeError(
+                    f"{len(requests)} items still unprocessed for {self.table_name} "
+                    f"after {self.max_retries} retries"
+                )
+            self.retry_count += 1
+            # Unprocessed items mean we are being throttled, so back off
+            self.sleep(self.base_delay * (2 ** (attempt - 1)))
@@ -1,12 +1,80 @@
-import boto3
 import json
 import time
 import requests
 import os
 
-s3_client = boto3.client("s3")
+import aws_clients
+from eviction import delete_objects
+from load_generator import parse_workload, run_workload, IndexWatcher
 
+s3_client = aws_clients.client("s3")
+
+# Object index written by the size tracker together with the bucket totals;
+# lets load mode measure when each upload is counted in the totals
+OBJECT_INDEX_TABLE_NAME = os.environ.get("OBJECT_INDEX_TABLE_NAME")
+# Key prefix the bucket's ObjectRemoved notification is filtered to, if any
+REMOVAL_EVENT_PREFIX = os.environ.get("REMOVAL_EVENT_PREFIX", "")
+
+def wait_for_plot(plotting_api, previous_etag, timeout):
+    """
+    Poll the plot API until it serves a render other than previous_etag.
+    Returns the new ETag, or None on timeout.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = requests.get(plotting_api)
+        etag = response.headers.get("ETag")
+        if response.status_code == 200 and etag != previous_etag:
+            return etag
+        time.sleep(1)
+    return None
+
+def run_load(bucket_name, plotting_api, spec):
+    """
+    Drive the bucket with a generated workload and report throughput and
+    latency from upload to the bucket totals and to the plot.
+    """
+    workload = parse_workload(spec, REMOVAL_EVENT_PREFIX)
+    # One pooled connection per worker, so uploads don't queue for a socket
+    s3 = aws_clients.client("s3", max_pool_connections=max(workload["concurrency"], 10))
+    print(f"Running workload: {json.dumps(workload)}")
+
+    # 1. Remember the current render so a fresh one can be recognised
+    previous_etag = requests.get(plotting_api).headers.get("ETag")
+
+    # 2. Run the operations, watching the totals (via the index) as they land
+    watcher = None
+    if OBJECT_INDEX_TABLE_NAME:
+        watcher = IndexWatcher(aws_clients.resource("dynamodb"), OBJECT_INDEX_TABLE_NAME, bucket_name)
+    report, live_keys = run_workload(s3, bucket_name, workload, watcher)
+
+    # 3. Time until the plot reflects the run
+    etag = wait_for_plot(plotting_api, previous_etag, workload["settle_timeout"])
+    report["plot_latency_ms"] = round((time.time() - report["last_operation_at"]) * 1000, 1) if etag else None
+
+    # 4. Optionally remove what the run left behind
+    if spec.get("cleanup"):
+        cleanup = delete_objects(s3, bucket_name, [{"Key": key, "Size": 0} for key in live_keys])
+        report["cleanup"] = {"objects_deleted": cleanup["objects_deleted"], "errors": len(cleanup["errors"])}
+
+    print(f"Load report: {json.dumps(report)}")
+    return report
+
+@aws_clients.log_request_stats
 def lambda_handler(event, context):
+    event = event or {}
+    if event.get("mode") == "load":
+        try:
+            report = run_load(os.environ["BUCKET_NAME"], os.environ["PLOTTING_LAMBDA_API"], event.get("workload", {}))
+            return {"statusCode": 200, "body": json.dumps(report)}
+        except ValueError as e:
+            # Invalid workload spec
+            print(f"❌ Error: {str(e)}")
+            return {"statusCode": 400, "body": f"Error: {str(e)}"}
+        except Exception as e:
+            print(f"❌ Error: {str(e)}")
+            return {"statusCode": 500, "body": f"Error: {str(e)}"}
+
     try:
         print("🚀 Driver Lambda started.")
         bucket_name = os.environ["BUCKET_NAME"]
@@ -0,0 +1,60 @@
+import json
+import time
+
+NAMESPACE = "Assignment4App"
+METRIC_NAME = "TotalObjectSize"
+
+
+class SizeDeltaBatch:
+    """
+    Collects the size deltas of one invocation and writes them as a single
+    CloudWatch Embedded Metric Format (EMF) document. CloudWatch extracts the
+    TotalObjectSize metric straight from that log line, so no metric filter
+    is needed and there is one log line per batch instead of one per object.
+
+    The metric is the aggregated sum with no dimensions (what the size alarm
+    watches). EMF allows one value per dimension per document, so the
+    per-object deltas are kept as a log property for Logs Insights rather
+    than as a dimension.
+    """
+
+    def __init__(self, namespace=NAMESPACE, metric_name=METRIC_NAME, write=print):
+        self.namespace = namespace
+        self.metric_name = metric_name
+        self.write = write
+        self.deltas = []
+
+    def add(self, object_name, size_delta):
+        self.deltas.append({"object_name": object_name, "size_delta": size_delta})
+
+    def to_document(self):
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [[]],
+                    "Metrics": [{
+                        "Name": self.metric_name,
+                        "Unit": "Bytes",
+                        # High resolution, so the 10 second alarm period works
+                        "StorageResolution": 1
+                    }]
+                }]
+            },
+            self.metric_name: sum(d["size_delta"] for d in self.deltas),
+            "object_count": len(self.deltas),
+            "size_deltas": self.deltas
+        }
+
+    def flush(self):
+        """
+        Write the batch as one EMF log line. EMF has to be the raw JSON line,
+        so this prints instead of going through the logging module's prefix.
+        """
+        if not self.deltas:
+            return None
+        document = self.to_document()
+        self.write(json.dumps(document))
+        self.deltas = []
+        return document
@@ -0,0 +1,142 @@
+import threading
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+# Sequencers are hex strings of varying length. Left-padding them to a fixed
+# width makes plain string comparison (in Python and in DynamoDB condition
+# expressions) match S3's ordering.
+SEQUENCER_WIDTH = 32
+
+
+def normalize_sequencer(sequencer):
+    return sequencer.upper().rjust(SEQUENCER_WIDTH, "0")
+
+
+def sequencer_of(s3_record):
+    sequencer = s3_record["s3"]["object"].get("sequencer")
+    return normalize_sequencer(sequencer) if sequencer else None
+
+
+class StaleEvent(Exception):
+    """
+    A newer event for the object was already applied, so this one must not be.
+    """
+
+
+class EventOrderer:
+    """
+    Drops stale and duplicate S3 events using the per-key sequencer.
+
+    Every (bucket, key) has a high-water mark: the largest sequencer already
+    applied. An event is only processed if its sequencer is above the mark,
+    and the mark is only advanced once the event's side effects have
+    succeeded, so a failed or timed-out event is processed again on retry.
+    Callers whose side effects are DynamoDB writes put mark_write() in the
+    same transaction; others call advance() afterwards.
+
+    Marks are cached in memory (LRU) across warm invocations, with an
+    optional DynamoDB table as the persistent backstop so that separate
+    containers agree. `consumer` namespaces the marks, so several Lambdas
+    reading the same events can share one table.
+    """
+
+    def __init__(self, consumer, table=None, cache_size=10000):
+        self.consumer = consumer
+        self.table = table
+        self.cache_size = cache_size
+        self._marks = OrderedDict()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def object_id(self, bucket_name, object_key):
+        return f"{self.consumer}:{bucket_name}:{object_key}"
+
+    def remember(self, bucket_name, object_key, sequencer):
+        """
+        Cache a mark that was just written.
+        """
+        object_id = self.object_id(bucket_name, object_key)
+        with self._lock:
+            if self._marks.get(object_id, "") < sequencer:
+                self._marks[object_id] = sequencer
+            self._marks.move_to_end(object_id)
+            if len(self._marks) > self.cache_size:
+                self._marks.popitem(last=False)
+
+    def drop(self):
+        """
+        Count an event skipped as stale or duplicate.
+        """
+        with self._lock:
+            self.dropped += 1
+
+    def seen(self, bucket_name, object_key, sequencer):
+        """
+        True if the cached mark already covers sequencer. Only a fast
+        pre-filter: the table may hold a newer mark than the cache.
+        """
+        if sequencer is None:
+            return False
+        with self._lock:
+            cached = self._marks.get(self.object_id(bucket_name, object_key))
+        return cached is not None and cached >= sequencer
+
+    def is_stale(self, bucket_name, object_key, sequencer):
+        """
+        True (and counted as dropped) if the event is a duplicate or older
+        than one already applied, checking the cache and then the table.
+        Events without a sequencer (e.g. s3:TestEvent) can't be ordered.
+        """
+        if sequencer is None:
+            return False
+        stale = self.seen(bucket_name, object_key, sequencer)
+        if not stale and self.table is not None:
+            item = self.table.get_item(
+                Key={"object_id": self.object_id(bucket_name, object_key)}, ConsistentRead=True
+            ).get("Item")
+            if item:
+                self.remember(bucket_name, object_key, item["sequencer"])
+                stale = item["sequencer"] >= sequencer
+        if stale:
+            self.drop()
+        return stale
+
+    def mark_write(self, bucket_name, object_key, sequencer):
+        """
+        TransactWriteItems action that raises the mark to sequencer, failing
+        its condition if the mark is already there or beyond. None when there
+        is nothing to write (no table or no sequencer).
+        """
+        if self.table is None or sequencer is None:
+            return None
+        return {"Put": {
+            "TableName": self.table.name,
+            "Item": {
+                "object_id": {"S": self.object_id(bucket_name, object_key)},
+                "sequencer": {"S": sequencer},
+            },
+            "ConditionExpression": "attribute_not_exists(sequencer) OR sequencer < :s",
+            "ExpressionAttributeValues": {":s": {"S": sequencer}},
+        }}
+
+    def advance(self, bucket_name, object_key, sequencer):
+        """
+        Raise the mark to sequencer after the event's side effects succeeded.
+        Returns False if a newer event had already moved it further.
+        """
+        if sequencer is None:
+            return True
+        if self.table is not None:
+            try:
+                self.table.put_item(
+                    Item={"object_id": self.object_id(bucket_name, object_key), "sequencer": sequencer},
+                    ConditionExpression="attribute_not_exists(sequencer) OR sequencer < :s",
+                    ExpressionAttributeValues={":s": sequencer},
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+                return False
+        self.remember(bucket_name, object_key, sequencer)
+        return True
@@ -0,0 +1,99 @@
+from itertools import groupby
+
+# DeleteObjects accepts at most 1,000 keys per call
+MAX_DELETE_BATCH = 1000
+
+POLICIES = ("largest", "oldest", "lru")
+
+
+def _timestamp(value):
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+def policy_key(obj, policy):
+    """
+    Sort key of an object in the policy's eviction order, with ties broken
+    by key. The key of the last object deleted is what a resumed eviction
+    skips up to, so it is built from strings and ints only.
+    """
+    if policy == "largest":
+        return (-obj["Size"], obj["Key"])
+    if policy == "oldest":
+        return (_timestamp(obj["LastModified"]), obj["Key"])
+    if policy == "lru":
+        # S3 has no last-access time without server access logs, so use
+        # LastAccessed when the caller has one and LastModified otherwise
+        return (_timestamp(obj.get("LastAccessed", obj["LastModified"])), obj["Key"])
+    raise ValueError(f"Unknown eviction policy: {policy}")
+
+
+def _order(candidates, policy):
+    return sorted(candidates, key=lambda obj: policy_key(obj, policy))
+
+
+def order_ties(candidates, policy):
+    """
+    Put candidates that are only ordered by the policy's first sort field
+    (the size index returns equal sizes in no particular key order) fully in
+    policy order, by sorting each run of equal values by key. Lazy apart
+    from holding one run at a time.
+
+    A resumed eviction skips everything up to the last object deleted, so
+    the victims must come in exactly this order or equal-size objects that
+    were never deleted could sort before that point and be passed over.
+    """
+    for _, run in groupby(candidates, key=lambda obj: policy_key(obj, policy)[0]):
+        yield from _order(run, policy)
+
+
+def select_victims(candidates, bytes_to_free, policy="largest", presorted=False):
+    """
+    Choose objects to delete, in policy order, until they cover bytes_to_free.
+    candidates are dicts with "Key" and "Size" (and "LastModified" for the
+    oldest/lru policies). presorted=True means candidates already come in
+    policy order and may be a lazy iterator, e.g. from the size index.
+    """
+    if bytes_to_free <= 0:
+        return []
+    ordered = candidates if presorted else _order(candidates, policy)
+
+    victims, covered = [], 0
+    for obj in ordered:
+        if obj["Size"] <= 0:
+            continue
+        victims.append(obj)
+        covered += obj["Size"]
+        if covered >= bytes_to_free:
+            break
+    return victims
+
+
+def delete_objects(s3_client, bucket_name, victims, budget=None):
+    """
+    Delete the victims with DeleteObjects in batches of up to 1,000 keys and
+    report what was reclaimed. With a budget, no batch is started once it is
+    exhausted; "processed" says how many victims were handled.
+    """
+    report = {"objects_deleted": 0, "bytes_reclaimed": 0, "delete_calls": 0, "errors": [], "processed": 0}
+    sizes = {obj["Key"]: obj["Size"] for obj in victims}
+    keys = list(sizes)
+
+    for start in range(0, len(keys), MAX_DELETE_BATCH):
+        if budget and budget.exhausted():
+            break
+        batch = keys[start:start + MAX_DELETE_BATCH]
+        response = s3_client.delete_objects(
+            Bucket=bucket_name,
+            Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True}
+        )
+        report["delete_calls"] += 1
+
+        # Quiet mode only reports failures
+        failed = {error["Key"] for error in response.get("Errors", [])}
+        report["errors"].extend(response.get("Errors", []))
+        for key in batch:
+            if key not in failed:
+                report["objects_deleted"] += 1
+                report["bytes_reclaimed"] += sizes[key]
+        report["processed"] += len(batch)
+    return report
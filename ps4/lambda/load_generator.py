@@ -0,0 +1,285 @@
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKLOAD = {
+    "object_count": 100,
+    # {"type": "fixed", "size": n}, {"type": "uniform", "min": a, "max": b}
+    # or {"type": "lognormal", "median": m, "sigma": s, "max": b}
+    "size_distribution": {"type": "uniform", "min": 1, "max": 4096},
+    # Fraction of operations that delete an object uploaded earlier in the run
+    "delete_ratio": 0.0,
+    # Operations started per second; 0 means as fast as the pool allows
+    "rate": 10,
+    "concurrency": 16,
+    "key_prefix": "load/",
+    # Stop waiting for the pipeline this long after the last operation
+    "settle_timeout": 60,
+    "seed": None,
+}
+
+# Parameters each size distribution must be given (see draw_size)
+SIZE_DISTRIBUTION_PARAMS = {"fixed": ("size",), "uniform": ("min", "max"), "lognormal": ("median",)}
+
+# batch_get_item takes at most 100 keys
+MAX_GET_BATCH = 100
+POLL_INTERVAL = 0.25
+
+
+def parse_workload(spec, removal_prefix=""):
+    """
+    Fill in defaults for a workload spec and validate it. removal_prefix is
+    the key prefix the bucket sends ObjectRemoved events for: deletes outside
+    it never reach the size tracker, so they could never be seen to settle.
+    """
+    workload = dict(DEFAULT_WORKLOAD)
+    workload.update(spec or {})
+    for name, kind in (("object_count", int), ("concurrency", int), ("delete_ratio", float),
+                       ("rate", float), ("settle_timeout", float)):
+        try:
+            workload[name] = kind(workload[name])
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be a number")
+    if workload["object_count"] < 1:
+        raise ValueError("object_count must be at least 1")
+    if not 0 <= workload["delete_ratio"] < 1:
+        raise ValueError("delete_ratio must be in [0, 1)")
+    if workload["delete_ratio"] and not workload["key_prefix"].startswith(removal_prefix):
+        raise ValueError(
+            f"key_prefix must be under {removal_prefix!r} for deletes to send removal events"
+        )
+    if workload["concurrency"] < 1:
+        raise ValueError("concurrency must be at least 1")
+    check_size_distribution(workload["size_distribution"])
+    return workload
+
+
+def check_size_distribution(distribution):
+    """
+    Raise ValueError unless the distribution is a known type with the
+    numbers draw_size needs.
+    """
+    if not isinstance(distribution, dict):
+        raise ValueError("size_distribution must be an object")
+    kind = distribution.get("type")
+    if kind not in SIZE_DISTRIBUTION_PARAMS:
+        raise ValueError(f"Unknown size distribution: {kind}")
+    for name in SIZE_DISTRIBUTION_PARAMS[kind]:
+        try:
+            value = float(distribution[name])
+        except KeyError:
+            raise ValueError(f"{kind} size distribution needs {name}")
+        except (TypeError, ValueError):
+            raise ValueError(f"size_distribution {name} must be a number")
+        # Empty objects are fine, but the lognormal works from log(median)
+        if value < 0 or (name == "median" and value == 0):
+            raise ValueError(f"size_distribution {name} must be positive")
+
+
+def draw_size(distribution, rng):
+    kind = distribution["type"]
+    if kind == "fixed":
+        return int(distribution["size"])
+    if kind == "uniform":
+        return rng.randint(int(distribution["min"]), int(distribution["max"]))
+    size = int(rng.lognormvariate(math.log(distribution["median"]), distribution.get("sigma", 1.0)))
+    return max(1, min(size, int(distribution.get("max", size))))
+
+
+def plan_operations(workload):
+    """
+    The operations of a run, in start order: object_count PUTs of new keys,
+    interleaved with DELETEs of keys already PUT so the mix matches
+    delete_ratio. Each DELETE refers to the index of its PUT.
+    """
+    rng = random.Random(workload["seed"])
+    distribution = workload["size_distribution"]
+    operations, live = [], []
+    puts = 0
+
+    while puts < workload["object_count"]:
+        if live and rng.random() < workload["delete_ratio"]:
+            put_index = live.pop(rng.randrange(len(live)))
+            operations.append({"op": "DELETE", "key": operations[put_index]["key"], "after": put_index})
+        else:
+            key = f"{workload['key_prefix']}{len(operations):06d}"
+            operations.append({"op": "PUT", "key": key, "size": draw_size(distribution, rng)})
+            live.append(len(operations) - 1)
+            puts += 1
+    return operations
+
+
+def percentiles(values):
+    """
+    Nearest-rank p50/p90/p99 plus count, mean and max, in milliseconds.
+    """
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p):
+        return round(ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] * 1000, 1)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 1),
+        "p50": rank(50),
+        "p90": rank(90),
+        "p99": rank(99),
+        "max": round(ordered[-1] * 1000, 1),
+    }
+
+
+class IndexWatcher:
+    """
+    Polls the size tracker's object index until every operation is visible
+    (an item for a PUT, no item for a DELETE) and records the delay from the
+    S3 call returning to it showing up there. The tracker changes an index
+    row in the same transaction as the bucket totals, so this is when the
+    operation counts towards the bucket size; the history datapoint is
+    written later in the same invocation.
+    """
+
+    def __init__(self, dynamodb, table_name, bucket_name):
+        # A DynamoDB service resource: keys and items are plain values
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.bucket_name = bucket_name
+        self.lock = threading.Lock()
+        # key -> (expect_present, sent_at); only the newest operation per key
+        self.pending = {}
+        self.latencies = {"PUT": [], "DELETE": []}
+        self.superseded = 0
+
+    def expect(self, key, present, sent_at):
+        with self.lock:
+            if key in self.pending:
+                self.superseded += 1
+            self.pending[key] = (present, sent_at)
+
+    def poll_once(self):
+        with self.lock:
+            keys = list(self.pending)
+        for start in range(0, len(keys), MAX_GET_BATCH):
+            self.check(keys[start:start + MAX_GET_BATCH])
+
+    def check(self, keys):
+        response = self.dynamodb.batch_get_item(RequestItems={
+            self.table_name: {
+                "Keys": [{"bucket_name": self.bucket_name, "object_key": key} for key in keys],
+                "ConsistentRead": True,
+            }
+        })
+        seen_at = time.time()
+        found = {item["object_key"] for item in response["Responses"].get(self.table_name, [])}
+        # Keys DynamoDB didn't get to stay pending for the next round
+        unprocessed = {
+            key["object_key"]
+            for key in response.get("UnprocessedKeys", {}).get(self.table_name, {}).get("Keys", [])
+        }
+
+        with self.lock:
+            for key in keys:
+                if key in unprocessed or key not in self.pending:
+                    continue
+                present, sent_at = self.pending[key]
+                if (key in found) == present:
+                    del self.pending[key]
+                    self.latencies["PUT" if present else "DELETE"].append(seen_at - sent_at)
+
+    def run(self, done, deadline):
+        """
+        Poll until the operations are finished and all visible, or the
+        deadline (set once they are finished) passes.
+        """
+        while True:
+            self.poll_once()
+            with self.lock:
+                remaining = len(self.pending)
+            if done.is_set() and (remaining == 0 or time.time() > deadline["at"]):
+                return remaining
+            time.sleep(POLL_INTERVAL)
+
+
+def run_workload(s3_client, bucket_name, workload, watcher=None):
+    """
+    Run the planned operations against the bucket from a thread pool, paced
+    to the target rate, and report throughput, S3 call latency and (with an
+    IndexWatcher) latency until the size tracker has applied each operation
+    to the bucket totals. Returns the report and the keys left in the bucket.
+    """
+    operations = plan_operations(workload)
+    put_done = [threading.Event() for _ in operations]
+    s3_latencies = {"PUT": [], "DELETE": []}
+    errors = []
+    lock = threading.Lock()
+
+    def execute(i):
+        op = operations[i]
+        try:
+            if op["op"] == "PUT":
+                started = time.time()
+                s3_client.put_object(Bucket=bucket_name, Key=op["key"], Body=b"x" * op["size"])
+            else:
+                # Never delete a key before its PUT has gone through
+                put_done[op["after"]].wait()
+                started = time.time()
+                s3_client.delete_object(Bucket=bucket_name, Key=op["key"])
+            sent_at = time.time()
+            with lock:
+                s3_latencies[op["op"]].append(sent_at - started)
+            if watcher:
+                watcher.expect(op["key"], op["op"] == "PUT", sent_at)
+        except Exception as e:
+            with lock:
+                errors.append(f"{op['op']} {op['key']}: {e}")
+        finally:
+            put_done[i].set()
+
+    done = threading.Event()
+    deadline = {"at": None}
+    watcher_pool = ThreadPoolExecutor(max_workers=1)
+    watcher_result = watcher_pool.submit(watcher.run, done, deadline) if watcher else None
+
+    rate = workload["rate"]
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=workload["concurrency"]) as pool:
+        for i in range(len(operations)):
+            # Open-loop pacing: operation i starts at i / rate
+            if rate:
+                delay = started + i / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(execute, i)
+    elapsed = time.time() - started
+
+    deadline["at"] = time.time() + workload["settle_timeout"]
+    done.set()
+    unsettled = watcher_result.result() if watcher else None
+    watcher_pool.shutdown()
+
+    report = {
+        "operations": len(operations),
+        "puts": sum(op["op"] == "PUT" for op in operations),
+        "deletes": sum(op["op"] == "DELETE" for op in operations),
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 2),
+        "achieved_rate": round(len(operations) / elapsed, 2) if elapsed else None,
+        "s3_latency_ms": {op: percentiles(values) for op, values in s3_latencies.items()},
+        "last_operation_at": started + elapsed,
+    }
+    if watcher:
+        report["totals_latency_ms"] = {op: percentiles(values) for op, values in watcher.latencies.items()}
+        report["totals_unsettled"] = unsettled
+        report["totals_superseded"] = watcher.superseded
+    return report, live_keys(operations)
+
+
+def live_keys(operations):
+    """
+    Keys still in the bucket at the end of a run.
+    """
+    deleted = {op["key"] for op in operations if op["op"] == "DELETE"}
+    return [op["key"] for op in operations if op["op"] == "PUT" and op["key"] not in deleted]
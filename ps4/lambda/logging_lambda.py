@@ -1,69 +1,68 @@
-import json
 import logging
 import os
-import boto3
-from datetime import datetime, timedelta
+
+import aws_clients
+
+from emf import SizeDeltaBatch
+from size_index import ObjectSizeIndex, InMemorySizeIndex
+from event_ordering import EventOrderer
+from sqs_consumer import consume
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-logs = boto3.client("logs")
+SIZE_INDEX_TABLE_NAME = os.environ.get("SIZE_INDEX_TABLE_NAME")
+SEQUENCER_TABLE_NAME = os.environ.get("SEQUENCER_TABLE_NAME")
+_local_index = InMemorySizeIndex()
 
-LOG_GROUP = f"/aws/lambda/{os.environ['AWS_LAMBDA_FUNCTION_NAME']}"
+# Per-key sequencer high-water marks, cached across warm invocations
+orderer = EventOrderer(
+    "logging",
+    aws_clients.table(SEQUENCER_TABLE_NAME) if SEQUENCER_TABLE_NAME else None
+)
 
-def get_previous_size(object_name):
-    try:
-        now = datetime.utcnow()
-        start_time = int((now - timedelta(days=1)).timestamp() * 1000)
-        end_time = int(now.timestamp() * 1000)
+def get_size_index():
+    """
+    key -> last known size index, so a delete (which S3 reports with no size)
+    can be logged with the size the object had. Falls back to an in-memory
+    index when no table is configured.
+    """
+    if SIZE_INDEX_TABLE_NAME:
+        return ObjectSizeIndex(aws_clients.table(SIZE_INDEX_TABLE_NAME))
+    return _local_index
 
-        response = logs.filter_log_events(
-            logGroupName=LOG_GROUP,
-            startTime=start_time,
-            endTime=end_time,
-            filterPattern=f'"{object_name}" "size_delta"',
-            limit=50
-        )
+def log_s3_record(s3_record, size_index):
+    """
+    Size delta of one S3 record as (object_key, size_delta),
+    or None for events that don't change the size.
+    """
+    event_name = s3_record["eventName"]
+    bucket_name = s3_record["s3"]["bucket"]["name"]
+    object_key = s3_record["s3"]["object"]["key"]
 
-        for event in response.get("events", []):
-            try:
-                data = json.loads(event["message"])
-                if data.get("object_name") == object_name and data.get("size_delta", 0) > 0:
-                    return data["size_delta"]
-            except Exception:
-                continue
-    except Exception as e:
-        logger.error(f"Log lookup failed: {e}")
-    return -1  # fallback
+    if event_name.startswith("ObjectCreated"):
+        object_size = s3_record["s3"]["object"]["size"]
+        # An overwrite only changes the size by the difference
+        prev_size = size_index.record_put(bucket_name, object_key, object_size)
+        return object_key, object_size - (prev_size or 0)
 
-def lambda_handler(event, context):
-    for record in event["Records"]:
-        try:
-            sns_message = json.loads(record["body"])
-            s3_event = json.loads(sns_message["Message"])
+    elif event_name.startswith("ObjectRemoved"):
+        # O(1) lookup instead of scanning a day of log events
+        prev_size = size_index.record_delete(bucket_name, object_key)
+        return object_key, -(prev_size or 0)
 
-            for s3_record in s3_event["Records"]:
-                event_name = s3_record["eventName"]
-                object_key = s3_record["s3"]["object"]["key"]
-                object_size = s3_record["s3"]["object"]["size"]
+    return None
 
-                if event_name.startswith("ObjectCreated"):
-                    log_data = {
-                        "object_name": object_key,
-                        "size_delta": object_size
-                    }
-
-                elif event_name.startswith("ObjectRemoved"):
-                    # prev_size = get_previous_size(object_key)
-                    log_data = {
-                        "object_name": object_key,
-                        "size_delta": -object_size
-                    }
-                else:
-                    continue
+@aws_clients.log_request_stats
+def lambda_handler(event, context):
+    size_index = get_size_index()
+    metrics = SizeDeltaBatch()
 
-                logger.info(json.dumps(log_data))
+    batch = consume(event, lambda s3_record: log_s3_record(s3_record, size_index), orderer=orderer)
+    for message_id, s3_record, result in batch.results:
+        if result:
+            metrics.add(*result)
 
-        except Exception as e:
-            logger.info(record)
-            logger.error(f"Failed to parse record: {e}")
+    # One EMF document for the whole batch
+    metrics.flush()
+    return batch.response()
@@ -0,0 +1,96 @@
+import io
+import os
+import time
+
+# Matplotlib writes its font cache under MPLCONFIGDIR, and /tmp is the only
+# writable path in AWS Lambda. Must be set before matplotlib is imported.
+os.environ.setdefault("MPLCONFIGDIR", "/tmp/matplotlib")
+
+_engine = None
+
+
+class RenderEngine:
+    """
+    One Agg Figure/Axes built on the first render and cleared and reused on
+    every warm invocation, instead of a new pyplot figure per request (which
+    were never closed and leaked memory across invocations).
+    """
+
+    def __init__(self):
+        start = time.perf_counter()
+
+        import matplotlib
+        matplotlib.use("Agg")
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        import matplotlib.dates as mdates
+        from matplotlib import font_manager
+
+        # Resolving the default font loads (or builds) the font cache in
+        # MPLCONFIGDIR now rather than in the middle of the first render
+        font_manager.findfont(font_manager.FontProperties())
+
+        self.mdates = mdates
+        self.figure = Figure(figsize=(8, 5))
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot()
+        # Room for the rotated time labels
+        self.figure.subplots_adjust(bottom=0.22)
+
+        self.init_ms = (time.perf_counter() - start) * 1000
+        self.render_count = 0
+        self.last_timings = {}
+
+    def render(self, datetimes, sizes, max_size, window_start, window_end, window_seconds):
+        """
+        Draw the size line and max-size line and return a PNG in a BytesIO.
+        """
+        start = time.perf_counter()
+        ax = self.axes
+        ax.clear()
+
+        # Show only the requested window on X-axis
+        ax.set_xlim(window_start, window_end)
+
+        # Plot
+        ax.plot(datetimes, sizes, marker="o", linestyle="-", label="Bucket Size")
+        ax.axhline(y=max_size, linestyle="--", label="Max Size")
+
+        # Format X-axis
+        if window_seconds <= 60:
+            ax.xaxis.set_major_locator(self.mdates.SecondLocator(interval=1))
+            ax.xaxis.set_major_formatter(self.mdates.DateFormatter("%H:%M:%S"))
+        else:
+            locator = self.mdates.AutoDateLocator()
+            ax.xaxis.set_major_locator(locator)
+            ax.xaxis.set_major_formatter(self.mdates.ConciseDateFormatter(locator))
+        ax.tick_params(axis="x", labelrotation=45)
+
+        ax.set_xlabel(f"Time (Last {window_seconds} Seconds)")
+        ax.set_ylabel("Size (bytes)")
+        ax.set_title(f"S3 Bucket Size Over Last {window_seconds} Seconds")
+        ax.legend()
+        ax.grid(True)
+
+        buf = io.BytesIO()
+        self.figure.savefig(buf, format="png")
+        buf.seek(0)
+
+        cold = self.render_count == 0
+        self.render_count += 1
+        self.last_timings = {
+            "cold_start": cold,
+            "init_ms": round(self.init_ms, 1) if cold else 0,
+            "render_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+        return buf
+
+
+def get_engine():
+    """
+    The per-container render engine; matplotlib is only imported on the first call.
+    """
+    global _engine
+    if _engine is None:
+        _engine = RenderEngine()
+    return _engine
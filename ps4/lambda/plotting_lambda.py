@@ -1,134 +1,265 @@
-import boto3
+import hashlib
 import json
 import time
-import io
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from datetime import datetime, timedelta
+import math
+import numpy as np
 import os
 
-# Fix Matplotlib cache issue in AWS Lambda
-os.environ["MPLCONFIGDIR"] = "/tmp"
+import aws_clients
+from plot_renderer import get_engine
+from rollups import RESOLUTIONS, SizeRollups, choose_resolution
+from series import SizeSeries
+from size_index import BucketTotals
 
 # AWS Clients
-dynamodb = boto3.resource("dynamodb")
-s3_client = boto3.client("s3")
+s3_client = aws_clients.client("s3")
 
 # Read from environment variables set by CDK
 TABLE_NAME = os.environ["DYNAMODB_TABLE_NAME"]  # Provided by table.table_name]
 BUCKET_NAME = os.environ["BUCKET_NAME"]         # We'll set this in lambda_stack
+ROLLUP_TABLE_NAME = os.environ.get("ROLLUP_TABLE_NAME")
+TOTALS_TABLE_NAME = os.environ.get("TOTALS_TABLE_NAME")
 PLOT_OBJECT_NAME = "plot.png"
 
-def get_recent_data():
+# The default plot queries 5 minutes of history so the line isn't just
+# the last 10 seconds, but only shows the last 10 seconds on the X-axis
+DEFAULT_QUERY_SECONDS = 300
+DEFAULT_VIEW_SECONDS = 10
+
+# More points than this can't be told apart on an 8 inch wide figure
+MAX_PLOT_POINTS = 2000
+
+# plot object key -> ETag of the render stored there, kept across warm invocations
+_render_cache = {}
+
+def query_pages(table, **kwargs):
     """
-    Query the last 10 seconds of bucket size data from DynamoDB.
+    Run a DynamoDB query and yield the items of every page,
+    following LastEvaluatedKey until the result is exhausted.
     """
-    table = dynamodb.Table(TABLE_NAME)
-    ten_seconds_ago = int(time.time()) - 10
-    
-    response = table.query(
-        KeyConditionExpression="bucket_name = :b AND #ts > :t",
-        ExpressionAttributeNames={"#ts": "timestamp"},
-        ExpressionAttributeValues={":b": BUCKET_NAME, ":t": ten_seconds_ago}
-    )
-    return response.get("Items", [])
+    while True:
+        response = table.query(**kwargs)
+        yield response.get("Items", [])
+        if "LastEvaluatedKey" not in response:
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
 
-def get_full_data():
+def query_size_series(start_time, end_time, resolution="auto"):
     """
-    Query the last 5 minutes of bucket size history
-    so the line plot isn't just the last 10 seconds.
+    Bucket size history between start_time and end_time as a SizeSeries,
+    oldest first with no duplicate timestamps.
+
+    resolution is "raw", one of the rollup resolutions, or "auto" to pick
+    the coarsest rollup that still fills the window.
     """
-    table = dynamodb.Table(TABLE_NAME)
-    five_minutes_ago = int(time.time()) - 300
-    
-    response = table.query(
-        KeyConditionExpression="bucket_name = :b AND #ts >= :t",
-        ExpressionAttributeNames={"#ts": "timestamp"},
-        ExpressionAttributeValues={":b": BUCKET_NAME, ":t": five_minutes_ago}
-    )
-    return response.get("Items", [])
+    if resolution == "auto":
+        resolution = choose_resolution(end_time - start_time) if ROLLUP_TABLE_NAME else None
+    if resolution == "raw":
+        resolution = None
+
+    if resolution is None:
+        pages = query_pages(
+            aws_clients.table(TABLE_NAME),
+            KeyConditionExpression="bucket_name = :b AND #ts BETWEEN :s AND :e",
+            ExpressionAttributeNames={"#ts": "timestamp"},
+            ExpressionAttributeValues={":b": BUCKET_NAME, ":s": start_time, ":e": end_time}
+        )
+        series = SizeSeries.from_pages(pages)
+    else:
+        items = SizeRollups(aws_clients.table(ROLLUP_TABLE_NAME)).query(
+            BUCKET_NAME, resolution, start_time, end_time
+        )
+        series = SizeSeries.from_items(items, time_key="bucket_start", size_key="last_size")
+
+    # Query results are already in sort key order; this only drops duplicates
+    return series.sorted()
 
 def get_max_size():
     """
-    Scan the entire table for the max historical size.
+    Read the bucket's maintained high-water mark with a single GetItem.
+    Falls back to scanning the history table if no totals table is configured.
     """
-    table = dynamodb.Table(TABLE_NAME)
-    response = table.scan(ProjectionExpression="total_size")
-    if not response["Items"]:
-        return 0
-    return max(int(item["total_size"]) for item in response["Items"])
+    if TOTALS_TABLE_NAME:
+        return BucketTotals(aws_clients.table(TOTALS_TABLE_NAME)).get_max_size(BUCKET_NAME)
 
-def generate_plot(data, max_size):
+    table = aws_clients.table(TABLE_NAME)
+    max_size = 0
+    kwargs = {"ProjectionExpression": "total_size"}
+    while True:
+        response = table.scan(**kwargs)
+        for item in response.get("Items", []):
+            max_size = max(max_size, int(item["total_size"]))
+        if "LastEvaluatedKey" not in response:
+            return max_size
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+def generate_plot(series, max_size, window_seconds=DEFAULT_VIEW_SECONDS):
     """
     Generate and return a PNG plot in memory (BytesIO).
+    series must be sorted, as returned by query_size_series.
+    The X-axis shows the last window_seconds up to the newest datapoint.
     """
-    if not data:
+    if not len(series):
         return None
-    
-    data.sort(key=lambda x: int(x["timestamp"]))
-    timestamps = [datetime.utcfromtimestamp(int(item["timestamp"])) for item in data]
-    sizes = [int(item["total_size"]) for item in data]
-
-    plt.figure(figsize=(8, 5))
-
-    # Show only last 10 seconds on X-axis
-    latest_time = max(timestamps)
-    start_time = latest_time - timedelta(seconds=10)
-    plt.xlim(start_time, latest_time)
-
-    # Plot
-    plt.plot(timestamps, sizes, marker="o", linestyle="-", label="Bucket Size")
-    plt.axhline(y=max_size, linestyle="--", label="Max Size")
-
-    # Format X-axis
-    plt.gca().xaxis.set_major_locator(mdates.SecondLocator(interval=1))
-    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter("%H:%M:%S"))
-    plt.xticks(rotation=45)
-
-    plt.xlabel("Time (Last 10 Seconds)")
-    plt.ylabel("Size (bytes)")
-    plt.title("S3 Bucket Size Over Last 10 Seconds")
-    plt.legend()
-    plt.grid()
-    
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png")
-    buf.seek(0)
+
+    latest = int(series.timestamps[-1])
+    series = series.clip(latest - window_seconds, latest, include_previous=True)
+    if len(series) > MAX_PLOT_POINTS:
+        series = series.resample(math.ceil(window_seconds / MAX_PLOT_POINTS))
+
+    # matplotlib is only imported here, so the no-data path above never loads it
+    engine = get_engine()
+    latest_time = np.datetime64(latest, "s")
+    buf = engine.render(
+        series.datetimes(), series.sizes, max_size,
+        latest_time - np.timedelta64(window_seconds, "s"), latest_time, window_seconds
+    )
+    print(json.dumps({"render_timings": engine.last_timings}))
     return buf
 
-def upload_to_s3(image_buffer):
+def get_data_version():
+    """
+    Read the bucket's history version from its totals item. The size tracker
+    bumps it after each history write has landed, so a render cached under
+    a version never misses datapoints written before it. Returns
+    (version, max_size); version is None if it is unknown, in which case
+    nothing can be cached.
+    """
+    if not TOTALS_TABLE_NAME:
+        return None, get_max_size()
+    item = BucketTotals(aws_clients.table(TOTALS_TABLE_NAME)).get(BUCKET_NAME)
+    version = item.get("history_version")
+    return (None if version is None else str(version)), int(item.get("max_size", 0))
+
+def render_etag(window_seconds, resolution, version, max_size):
     """
-    Upload the plot image to S3.
+    ETag of a render: the same bucket, window, resolution and data version
+    always produce the same image.
+    """
+    key = f"{BUCKET_NAME}:{window_seconds}:{resolution}:{version}:{max_size}"
+    return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+def plot_object_name(window_seconds, resolution):
+    """
+    Each window/resolution combination is stored under its own key so they
+    don't evict each other; the default plot keeps the old plot.png key.
+    Named from the parsed parameters, so equivalent query strings share a
+    render.
+    """
+    if (window_seconds, resolution) == (DEFAULT_VIEW_SECONDS, "auto"):
+        return PLOT_OBJECT_NAME
+    return f"plot-{window_seconds}-{resolution}.png"
+
+def plot_url(object_name):
+    return f"https://{BUCKET_NAME}.s3.amazonaws.com/{object_name}"
+
+def find_cached_render(object_name, etag):
+    """
+    True if the render with this ETag is already in S3, checking the
+    in-memory cache first and the stored object's metadata second.
+    """
+    if _render_cache.get(object_name) == etag:
+        return True
+    try:
+        head = s3_client.head_object(Bucket=BUCKET_NAME, Key=object_name)
+    except s3_client.exceptions.ClientError:
+        return False
+    if head.get("Metadata", {}).get("render-etag") == etag:
+        _render_cache[object_name] = etag
+        return True
+    return False
+
+def upload_to_s3(image_buffer, object_name=PLOT_OBJECT_NAME, etag=None):
+    """
+    Upload the plot image to S3, tagging it with the render ETag.
     """
     s3_client.put_object(
         Bucket=BUCKET_NAME,
-        Key=PLOT_OBJECT_NAME,
+        Key=object_name,
         Body=image_buffer,
-        ContentType="image/png"
+        ContentType="image/png",
+        Metadata={"render-etag": etag} if etag else {}
     )
-    return f"https://{BUCKET_NAME}.s3.amazonaws.com/{PLOT_OBJECT_NAME}"
+    if etag:
+        _render_cache[object_name] = etag
+    return plot_url(object_name)
+
+def parse_plot_params(params):
+    """
+    (window_seconds, query_seconds, resolution) from the query string.
+    Raises ValueError with a message for the client on bad input.
+    """
+    if "window" in params:
+        try:
+            window_seconds = int(params["window"])
+        except (TypeError, ValueError):
+            raise ValueError("window must be a whole number of seconds")
+        if window_seconds <= 0:
+            raise ValueError("window must be positive")
+        query_seconds = window_seconds
+    else:
+        window_seconds = DEFAULT_VIEW_SECONDS
+        query_seconds = DEFAULT_QUERY_SECONDS
 
+    resolution = params.get("resolution", "auto")
+    if resolution not in ("auto", "raw", *RESOLUTIONS):
+        raise ValueError(f"resolution must be one of auto, raw, {', '.join(RESOLUTIONS)}")
+    return window_seconds, query_seconds, resolution
+
+def get_header(event, name):
+    headers = (event or {}).get("headers") or {}
+    for key, value in headers.items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+@aws_clients.log_request_stats
 def lambda_handler(event, context):
     """
     Main Lambda function entry.
+    GET /plot?window=<seconds>&resolution=<raw|minute|hour|day|auto>
+    plots a custom window; without parameters the last 10 seconds are shown.
+
+    Renders are cached by data version: if nothing changed since the last
+    render the existing URL is returned (or 304 for a matching If-None-Match)
+    without querying history or touching matplotlib.
     """
-    recent_data = get_recent_data()
-    full_data = get_full_data()
-    max_size = get_max_size()
+    params = (event or {}).get("queryStringParameters") or {}
+    end_time = int(time.time())
+
+    try:
+        window_seconds, query_seconds, resolution = parse_plot_params(params)
+    except ValueError as e:
+        return {"statusCode": 400, "body": json.dumps(str(e))}
+
+    version, max_size = get_data_version()
+    object_name = plot_object_name(window_seconds, resolution)
+    etag = render_etag(window_seconds, resolution, version, max_size) if version else None
+    headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else {}
 
-    # Merge them for a continuous line
-    all_data = recent_data + full_data
-    
-    image_buffer = generate_plot(all_data, max_size)
+    if etag:
+        if_none_match = get_header(event, "If-None-Match") or ""
+        if etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return {"statusCode": 304, "headers": headers, "body": ""}
+        if find_cached_render(object_name, etag):
+            return {
+                "statusCode": 200,
+                "headers": headers,
+                "body": json.dumps({"plot_url": plot_url(object_name)})
+            }
+
+    data = query_size_series(end_time - query_seconds, end_time, resolution)
+
+    image_buffer = generate_plot(data, max_size, window_seconds)
     if not image_buffer:
         return {
             "statusCode": 400,
             "body": json.dumps("No data available for plotting.")
         }
-    
-    plot_url = upload_to_s3(image_buffer)
+
+    url = upload_to_s3(image_buffer, object_name, etag)
     return {
         "statusCode": 200,
-        "body": json.dumps({"plot_url": plot_url})
+        "headers": headers,
+        "body": json.dumps({"plot_url": url})
     }
-
@@ -0,0 +1,111 @@
+from botocore.exceptions import ClientError
+
+# Rollup resolutions in seconds, finest first
+RESOLUTIONS = {
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+}
+
+# A plot should have at least this many points before we downsample
+MIN_POINTS = 60
+
+
+def series_key(bucket_name, resolution):
+    return f"{bucket_name}#{resolution}"
+
+
+def bucket_start(timestamp, resolution):
+    """
+    Start of the rollup bucket that a timestamp falls into.
+    """
+    step = RESOLUTIONS[resolution]
+    return timestamp - timestamp % step
+
+
+def choose_resolution(window_seconds, min_points=MIN_POINTS):
+    """
+    Pick the coarsest rollup resolution that still gives at least min_points
+    points over the window. Returns None when the window is short enough
+    that the raw history should be used.
+    """
+    chosen = None
+    for resolution, step in RESOLUTIONS.items():
+        if window_seconds // step >= min_points:
+            chosen = resolution
+    return chosen
+
+
+class SizeRollups:
+    """
+    Per-minute, per-hour and per-day min/max/last bucket size, maintained
+    incrementally by the size tracker so plots of long windows read a few
+    hundred items instead of every raw datapoint.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def record(self, bucket_name, timestamp, total_size, object_count):
+        """
+        Fold one datapoint into every resolution.
+        """
+        for resolution in RESOLUTIONS:
+            self._record(bucket_name, resolution, timestamp, total_size, object_count)
+
+    def _record(self, bucket_name, resolution, timestamp, total_size, object_count):
+        key = {
+            "series": series_key(bucket_name, resolution),
+            "bucket_start": bucket_start(timestamp, resolution)
+        }
+        response = self.table.update_item(
+            Key=key,
+            UpdateExpression=(
+                "SET last_size = :s, last_timestamp = :t, object_count = :c, "
+                "min_size = if_not_exists(min_size, :s), max_size = if_not_exists(max_size, :s)"
+            ),
+            ExpressionAttributeValues={":s": total_size, ":t": timestamp, ":c": object_count},
+            ReturnValues="ALL_NEW"
+        )
+        attrs = response["Attributes"]
+
+        # DynamoDB has no MIN/MAX update function, so only widen the range
+        # with a conditional write when this datapoint is outside it
+        if total_size > int(attrs["max_size"]):
+            self._widen(key, "max_size", "<", total_size)
+        if total_size < int(attrs["min_size"]):
+            self._widen(key, "min_size", ">", total_size)
+
+    def _widen(self, key, attribute, operator, value):
+        try:
+            self.table.update_item(
+                Key=key,
+                UpdateExpression=f"SET {attribute} = :v",
+                ConditionExpression=f"{attribute} {operator} :v",
+                ExpressionAttributeValues={":v": value}
+            )
+        except ClientError as e:
+            # Someone else already widened it further
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+    def query(self, bucket_name, resolution, start_time, end_time):
+        """
+        Return the rollup items of one resolution between start_time and
+        end_time, oldest first.
+        """
+        kwargs = {
+            "KeyConditionExpression": "series = :k AND bucket_start BETWEEN :a AND :b",
+            "ExpressionAttributeValues": {
+                ":k": series_key(bucket_name, resolution),
+                ":a": bucket_start(start_time, resolution),
+                ":b": end_time
+            }
+        }
+        items = []
+        while True:
+            response = self.table.query(**kwargs)
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                return items
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
@@ -0,0 +1,83 @@
+import numpy as np
+
+
+class SizeSeries:
+    """
+    Bucket size history held as two int64 NumPy arrays (Unix seconds and
+    bytes) instead of a list of DynamoDB dicts, so sorting, clipping and
+    resampling are vectorized and matplotlib can plot the arrays directly.
+    """
+
+    def __init__(self, timestamps, sizes):
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.sizes = np.asarray(sizes, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @classmethod
+    def from_items(cls, items, time_key="timestamp", size_key="total_size"):
+        """
+        Build a series from DynamoDB items (Decimal values), without
+        creating an intermediate dict per point.
+        """
+        count = len(items)
+        timestamps = np.fromiter((int(item[time_key]) for item in items), dtype=np.int64, count=count)
+        sizes = np.fromiter((int(item[size_key]) for item in items), dtype=np.int64, count=count)
+        return cls(timestamps, sizes)
+
+    @classmethod
+    def from_pages(cls, pages, time_key="timestamp", size_key="total_size"):
+        """
+        Build a series from a sequence of query pages (lists of items).
+        """
+        parts = [cls.from_items(page, time_key, size_key) for page in pages]
+        if not parts:
+            return cls([], [])
+        return cls(
+            np.concatenate([p.timestamps for p in parts]),
+            np.concatenate([p.sizes for p in parts])
+        )
+
+    def sorted(self):
+        """
+        Return a copy ordered by timestamp with one point per timestamp;
+        for duplicate timestamps the last point wins.
+        """
+        if not len(self):
+            return self
+        order = np.argsort(self.timestamps, kind="stable")
+        timestamps, sizes = self.timestamps[order], self.sizes[order]
+        # Keep the last occurrence of every timestamp
+        keep = np.append(timestamps[1:] != timestamps[:-1], True)
+        return SizeSeries(timestamps[keep], sizes[keep])
+
+    def clip(self, start_time, end_time, include_previous=False):
+        """
+        Points with start_time <= timestamp <= end_time. The series must be sorted.
+        include_previous also keeps the last point before start_time, so a
+        line plot still enters the window from the left edge.
+        """
+        lo = np.searchsorted(self.timestamps, start_time, side="left")
+        if include_previous and lo > 0:
+            lo -= 1
+        hi = np.searchsorted(self.timestamps, end_time, side="right")
+        return SizeSeries(self.timestamps[lo:hi], self.sizes[lo:hi])
+
+    def resample(self, step):
+        """
+        Downsample to one point per step seconds, keeping the last size in
+        each step (the same "last" semantics as the rollup tables).
+        The series must be sorted.
+        """
+        if not len(self) or step <= 1:
+            return self
+        buckets = self.timestamps // step
+        last = np.append(buckets[1:] != buckets[:-1], True)
+        return SizeSeries(buckets[last] * step, self.sizes[last])
+
+    def datetimes(self):
+        """
+        Timestamps as datetime64[s], which matplotlib plots natively.
+        """
+        return self.timestamps.astype("datetime64[s]")
@@ -0,0 +1,395 @@
+import time
+
+from botocore.exceptions import ClientError
+
+# GSI on (bucket_name, size) of the object index table
+SIZE_INDEX_NAME = "SizeIndex"
+
+# TransactWriteItems takes at most 100 actions, one of which is the totals
+# update; BatchGetItem takes at most 100 keys
+MAX_TRANSACT_ACTIONS = 100
+
+# Sorts after every character S3 allows in a key, so prefix + MAX_KEY_CHAR
+# is the upper end of the prefix's key range
+MAX_KEY_CHAR = "\U0010ffff"
+
+
+class ObjectSizeIndex:
+    """
+    Last known size of every object, keyed by (bucket_name, object_key).
+    Lets a delete or an overwrite be turned into a size delta without
+    listing the bucket.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def record_put(self, bucket_name, object_key, size):
+        """
+        Store the new size of an object. Returns the previous size,
+        or None if the object was not indexed before.
+        """
+        response = self.table.put_item(
+            Item={
+                "bucket_name": bucket_name,
+                "object_key": object_key,
+                "size": size,
+                "updated_at": int(time.time())
+            },
+            ReturnValues="ALL_OLD"
+        )
+        old = response.get("Attributes")
+        return int(old["size"]) if old else None
+
+    def record_delete(self, bucket_name, object_key):
+        """
+        Remove an object from the index. Returns its last known size,
+        or None if the object was not indexed.
+        """
+        response = self.table.delete_item(
+            Key={"bucket_name": bucket_name, "object_key": object_key},
+            ReturnValues="ALL_OLD"
+        )
+        old = response.get("Attributes")
+        return int(old["size"]) if old else None
+
+    def largest(self, bucket_name, limit=10):
+        """
+        Yield (object_key, size) from largest to smallest, reading the
+        size-ordered GSI one page of `limit` items at a time.
+        """
+        kwargs = {
+            "IndexName": SIZE_INDEX_NAME,
+            "KeyConditionExpression": "bucket_name = :b",
+            "ExpressionAttributeValues": {":b": bucket_name},
+            "ScanIndexForward": False,
+            "Limit": limit
+        }
+        while True:
+            response = self.table.query(**kwargs)
+            for item in response.get("Items", []):
+                yield item["object_key"], int(item["size"])
+            if "LastEvaluatedKey" not in response:
+                return
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+    def prune(self, bucket_name, prefix, delimiter, objects, after, upto, listed_since, common_prefixes=()):
+        """
+        Drop the rows of keys a listing page no longer has. objects are all
+        the keys under prefix in (after, upto] (None for either end means
+        unbounded), leaving out keys below a delimiter, which the page rolls
+        up into common_prefixes; the rows under those are left to the
+        listings of the prefixes and not read at all. Rows written since
+        listed_since are kept, as their object may have been created after
+        the page was listed. Returns the number of rows dropped.
+        """
+        listed = {obj["Key"] for obj in objects}
+        low = after or prefix
+        high = upto if upto is not None else (prefix + MAX_KEY_CHAR if prefix else None)
+        pruned = 0
+        for object_key in self._keys_between(bucket_name, low, high, sorted(common_prefixes)):
+            if object_key in listed or (after is not None and object_key <= after):
+                continue
+            if not object_key.startswith(prefix):
+                continue
+            if delimiter and delimiter in object_key[len(prefix):]:
+                continue
+            pruned += self._delete_if_older(bucket_name, object_key, listed_since)
+        return pruned
+
+    def _keys_between(self, bucket_name, low, high, skipped_prefixes=()):
+        """
+        Yield the indexed keys of a bucket from low to high (inclusive, None
+        for an open end), leaving out the key ranges of skipped_prefixes.
+        """
+        for prefix in skipped_prefixes:
+            yield from self._query_keys(bucket_name, low, prefix)
+            low = prefix + MAX_KEY_CHAR
+        yield from self._query_keys(bucket_name, low, high)
+
+    def _query_keys(self, bucket_name, low, high):
+        condition = "bucket_name = :b"
+        values = {":b": bucket_name}
+        if low and high:
+            condition += " AND object_key BETWEEN :low AND :high"
+            values.update({":low": low, ":high": high})
+        elif low:
+            condition += " AND object_key >= :low"
+            values[":low"] = low
+        elif high:
+            condition += " AND object_key <= :high"
+            values[":high"] = high
+
+        kwargs = {"KeyConditionExpression": condition, "ExpressionAttributeValues": values,
+                  "ProjectionExpression": "object_key"}
+        while True:
+            response = self.table.query(**kwargs)
+            for item in response.get("Items", []):
+                yield item["object_key"]
+            if "LastEvaluatedKey" not in response:
+                return
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def _delete_if_older(self, bucket_name, object_key, since):
+        try:
+            self.table.delete_item(
+                Key={"bucket_name": bucket_name, "object_key": object_key},
+                ConditionExpression="attribute_exists(object_key) AND "
+                                    "(attribute_not_exists(updated_at) OR updated_at < :t)",
+                ExpressionAttributeValues={":t": since}
+            )
+            return 1
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return 0
+            raise
+
+
+class InMemorySizeIndex:
+    """
+    Dict-backed stand-in for ObjectSizeIndex, for local runs and for
+    deployments without an index table. Only lives as long as the container.
+    """
+
+    def __init__(self):
+        self.sizes = {}
+
+    def record_put(self, bucket_name, object_key, size):
+        previous = self.sizes.get((bucket_name, object_key))
+        self.sizes[(bucket_name, object_key)] = size
+        return previous
+
+    def record_delete(self, bucket_name, object_key):
+        return self.sizes.pop((bucket_name, object_key), None)
+
+    def largest(self, bucket_name, limit=10):
+        items = [(k, size) for (b, k), size in self.sizes.items() if b == bucket_name]
+        return iter(sorted(items, key=lambda item: item[1], reverse=True))
+
+
+class SizeLedger:
+    """
+    Applies object changes to the object index and the bucket's running
+    totals in one TransactWriteItems call, so an index row never changes
+    without its delta reaching the totals. A call that fails changes
+    neither and can simply be retried: deltas are worked out again from
+    the index as it is then, so changes that did land count as zero.
+
+    Index rows are written on condition that they still hold the size that
+    was read; a concurrent writer cancels the transaction and it is retried
+    from a fresh read. With an EventOrderer, each key's sequencer mark is
+    raised in the same transaction, and keys whose mark is already at or
+    past the batch's events are dropped as stale. Uses the low-level
+    client, which is thread-safe.
+    """
+
+    def __init__(self, client, index_table_name, totals_table_name, orderer=None,
+                 max_attempts=5, base_delay=0.05, sleep=time.sleep):
+        self.client = client
+        self.index_table_name = index_table_name
+        self.totals_table_name = totals_table_name
+        self.orderer = orderer
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.sleep = sleep
+
+    def apply(self, bucket_name, changes, sequencers=None):
+        """
+        Apply {object_key: new size, or None for a deleted object} to one
+        bucket. sequencers maps keys to the sequencer of their newest event.
+        Returns the (size_delta, count_delta) added to its totals.
+        """
+        sequencers = sequencers or {}
+        marked = self.orderer is not None and self.orderer.table is not None
+        chunk_size = (MAX_TRANSACT_ACTIONS - 1) // (2 if marked else 1)
+        keys = list(changes)
+        size_delta = count_delta = 0
+        for start in range(0, len(keys), chunk_size):
+            chunk = {key: changes[key] for key in keys[start:start + chunk_size]}
+            chunk_size_delta, chunk_count_delta = self._apply_chunk(bucket_name, chunk, sequencers)
+            size_delta += chunk_size_delta
+            count_delta += chunk_count_delta
+        return size_delta, count_delta
+
+    def _apply_chunk(self, bucket_name, changes, sequencers):
+        changes = dict(changes)
+        for attempt in range(1, self.max_attempts + 1):
+            previous = self._read_sizes(bucket_name, list(changes)) if changes else {}
+            writes, owners, size_delta, count_delta = self._plan(bucket_name, changes, previous, sequencers)
+            if not writes:
+                return 0, 0
+            if any(action == "index" for _, action in owners):
+                writes.append(self._totals_update(bucket_name, size_delta, count_delta))
+            try:
+                self.client.transact_write_items(TransactItems=writes)
+            except ClientError as e:
+                if not _retryable_cancellation(e):
+                    raise
+                reasons = [reason.get("Code") for reason in e.response.get("CancellationReasons", [])]
+                stale = {key for (key, action), code in zip(owners, reasons)
+                         if action == "mark" and code == "ConditionalCheckFailed"}
+                for key in stale:
+                    # A newer event for the key was applied elsewhere
+                    del changes[key]
+                    self.orderer.drop()
+                if len(stale) < len([code for code in reasons if code not in (None, "None")]):
+                    # Another writer got there first: back off and start over
+                    self.sleep(self.base_delay * (2 ** (attempt - 1)))
+                continue
+            for key, action in owners:
+                if action == "mark":
+                    self.orderer.remember(bucket_name, key, sequencers[key])
+            return size_delta, count_delta
+        raise RuntimeError(
+            f"Size changes for {bucket_name} still conflicting after {self.max_attempts} attempts"
+        )
+
+    def _read_sizes(self, bucket_name, object_keys):
+        """
+        Current index size of each key (None if not indexed), with
+        consistent reads.
+        """
+        sizes = dict.fromkeys(object_keys)
+        request = {self.index_table_name: {
+            "Keys": [{"bucket_name": {"S": bucket_name}, "object_key": {"S": key}} for key in object_keys],
+            "ConsistentRead": True,
+        }}
+        while request:
+            response = self.client.batch_get_item(RequestItems=request)
+            for item in response["Responses"].get(self.index_table_name, []):
+                sizes[item["object_key"]["S"]] = int(item["size"]["N"])
+            request = response.get("UnprocessedKeys") or None
+            if request:
+                self.sleep(self.base_delay)
+        return sizes
+
+    def _plan(self, bucket_name, changes, previous, sequencers):
+        """
+        Conditional index writes for the keys whose size actually changes,
+        mark writes for keys with a sequencer, the (key, "index"/"mark")
+        each write belongs to, and the deltas the index writes add up to.
+        """
+        writes, owners, size_delta, count_delta = [], [], 0, 0
+        for object_key, size in changes.items():
+            mark = self.orderer.mark_write(bucket_name, object_key, sequencers.get(object_key)) \
+                if self.orderer else None
+            if mark:
+                writes.append(mark)
+                owners.append((object_key, "mark"))
+
+            old = previous[object_key]
+            if size == old:
+                continue
+            key = {"bucket_name": {"S": bucket_name}, "object_key": {"S": object_key}}
+            if old is None:
+                condition = {"ConditionExpression": "attribute_not_exists(object_key)"}
+            else:
+                condition = {
+                    "ConditionExpression": "#size = :old",
+                    "ExpressionAttributeNames": {"#size": "size"},
+                    "ExpressionAttributeValues": {":old": {"N": str(old)}},
+                }
+            if size is None:
+                writes.append({"Delete": dict(TableName=self.index_table_name, Key=key, **condition)})
+            else:
+                item = dict(key, size={"N": str(size)}, updated_at={"N": str(int(time.time()))})
+                writes.append({"Put": dict(TableName=self.index_table_name, Item=item, **condition)})
+            owners.append((object_key, "index"))
+            size_delta += (size or 0) - (old or 0)
+            count_delta += (size is not None) - (old is not None)
+        return writes, owners, size_delta, count_delta
+
+    def _totals_update(self, bucket_name, size_delta, count_delta):
+        return {"Update": {
+            "TableName": self.totals_table_name,
+            "Key": {"bucket_name": {"S": bucket_name}},
+            "UpdateExpression": "ADD total_size :d, object_count :c SET updated_at = :t",
+            "ExpressionAttributeValues": {
+                ":d": {"N": str(size_delta)},
+                ":c": {"N": str(count_delta)},
+                ":t": {"N": str(int(time.time()))},
+            },
+        }}
+
+
+def _retryable_cancellation(error):
+    """
+    True for a cancelled transaction that is worth retrying from a fresh
+    read: a condition failed or another transaction held an item.
+    """
+    if error.response["Error"]["Code"] != "TransactionCanceledException":
+        return False
+    codes = {reason.get("Code") for reason in error.response.get("CancellationReasons", [])}
+    return bool(codes & {"ConditionalCheckFailed", "TransactionConflict"}) and codes <= {
+        "None", "ConditionalCheckFailed", "TransactionConflict"
+    }
+
+
+class BucketTotals:
+    """
+    Running total size and object count per bucket.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def reset(self, bucket_name, total_size, object_count):
+        """
+        Overwrite the running totals with values from a full listing.
+        Returns the previous (total_size, object_count) so drift can be logged.
+        """
+        response = self.table.update_item(
+            Key={"bucket_name": bucket_name},
+            UpdateExpression="SET total_size = :s, object_count = :c, updated_at = :t, reconciled_at = :t",
+            ExpressionAttributeValues={
+                ":s": total_size,
+                ":c": object_count,
+                ":t": int(time.time())
+            },
+            ReturnValues="UPDATED_OLD"
+        )
+        old = response.get("Attributes", {})
+        return int(old.get("total_size", 0)), int(old.get("object_count", 0))
+
+    def record_max(self, bucket_name, total_size):
+        """
+        Raise the bucket's high-water mark to total_size if it is larger.
+        The conditional write makes concurrent updates safe. Returns True if
+        the mark was raised.
+        """
+        try:
+            self.table.update_item(
+                Key={"bucket_name": bucket_name},
+                UpdateExpression="SET max_size = :s",
+                ConditionExpression="attribute_not_exists(max_size) OR max_size < :s",
+                ExpressionAttributeValues={":s": total_size}
+            )
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+
+    def bump_history_version(self, bucket_name):
+        """
+        Count one more write to the bucket's size history. Called only after
+        the history datapoints are stored, so a reader that sees the new
+        version also finds the datapoints.
+        """
+        self.table.update_item(
+            Key={"bucket_name": bucket_name},
+            UpdateExpression="ADD history_version :one",
+            ExpressionAttributeValues={":one": 1}
+        )
+
+    def get(self, bucket_name, consistent=False):
+        """
+        Read the bucket's totals item in a single GetItem.
+        Returns an empty dict if the bucket has never been tracked.
+        """
+        response = self.table.get_item(Key={"bucket_name": bucket_name}, ConsistentRead=consistent)
+        return response.get("Item", {})
+
+    def get_max_size(self, bucket_name):
+        return int(self.get(bucket_name).get("max_size", 0))
@@ -1,61 +1,272 @@
-import boto3
 import json
 import time
 import os
-from datetime import datetime
+
+import aio
+import aws_clients
+from budget import Budget, CheckpointBusy, Checkpoints, lease_seconds, resume_later, run_id
+from bucket_scanner import scan_bucket, scan_bucket_async, scan_resumable
+from ddb_writer import BufferedBatchWriter
+from rollups import SizeRollups
+from size_index import ObjectSizeIndex, SizeLedger, BucketTotals
+from event_ordering import EventOrderer, sequencer_of
+from sqs_consumer import collect
 
 # AWS Clients
-s3_client = boto3.client("s3")
-dynamodb = boto3.resource("dynamodb")
+s3_client = aws_clients.client("s3")
+dynamodb = aws_clients.resource("dynamodb")
+lambda_client = aws_clients.client("lambda")
+
+# "incremental" applies each S3 event to a running total,
+# "full" re-lists the whole bucket on every event (old behaviour)
+SIZE_TRACKING_MODE = os.environ.get("SIZE_TRACKING_MODE", "incremental")
 
-# DynamoDB Table Name
+# DynamoDB Table Names
 TABLE_NAME = os.environ["DYNAMODB_TABLE_NAME"]
+# Incremental mode turns events into deltas through the index, so it can't run without it
+if SIZE_TRACKING_MODE == "incremental":
+    OBJECT_INDEX_TABLE_NAME = os.environ["OBJECT_INDEX_TABLE_NAME"]
+else:
+    OBJECT_INDEX_TABLE_NAME = os.environ.get("OBJECT_INDEX_TABLE_NAME")
+# Both modes keep the running totals and high-water mark here
+TOTALS_TABLE_NAME = os.environ["TOTALS_TABLE_NAME"]
+ROLLUP_TABLE_NAME = os.environ.get("ROLLUP_TABLE_NAME")
+SEQUENCER_TABLE_NAME = os.environ.get("SEQUENCER_TABLE_NAME")
+
+# Threads used to list prefix shards in parallel during full scans
+SCAN_WORKERS = int(os.environ.get("SCAN_WORKERS", "8"))
+
+# "threads" lists shards on a thread pool, "async" on an event loop
+# (aiobotocore when installed) with SCAN_WORKERS listings in flight
+IO_MODE = os.environ.get("IO_MODE", "threads")
+# Give up an async scan this close to the timeout rather than be killed
+SAFETY_MARGIN_MS = int(os.environ.get("SAFETY_MARGIN_MS", "5000"))
+
+# With a checkpoint table, reconciliation lists the bucket in as many
+# invocations as it takes, saving continuation tokens between them
+CHECKPOINT_TABLE_NAME = os.environ.get("CHECKPOINT_TABLE_NAME")
+
+# Per-key sequencer high-water marks, cached across warm invocations
+orderer = EventOrderer(
+    "size_tracking",
+    aws_clients.table(SEQUENCER_TABLE_NAME) if SEQUENCER_TABLE_NAME else None
+)
+
+# Applies each batch's object changes to the index and the totals atomically
+ledger = SizeLedger(aws_clients.client("dynamodb"), OBJECT_INDEX_TABLE_NAME, TOTALS_TABLE_NAME, orderer)
 
-def calculate_bucket_size(bucket_name):
+def calculate_bucket_size(bucket_name, context=None, on_page=None):
     """
     Calculate total size and object count of all objects in the given S3 bucket.
+    Every page is read and top-level prefixes are listed in parallel.
     """
-    response = s3_client.list_objects_v2(Bucket=bucket_name)
-    object_list = response.get("Contents", [])
+    if IO_MODE == "async":
+        async def scan():
+            async with aio.async_client(s3_client, SCAN_WORKERS) as client:
+                return await scan_bucket_async(
+                    client, bucket_name, deadline=aio.deadline(context, SAFETY_MARGIN_MS), on_page=on_page
+                )
+        stats = aio.run(scan(), SCAN_WORKERS)
+    else:
+        stats = scan_bucket(s3_client, bucket_name, max_workers=SCAN_WORKERS, on_page=on_page)
+    return stats["total_size"], stats["object_count"]
 
-    total_size = sum(obj["Size"] for obj in object_list)
-    object_count = len(object_list)
+def final_sizes(bucket_name, objects):
+    """
+    {object_key: size after the batch, or None if deleted} from each key's
+    records in sequencer order, and {object_key: newest sequencer}.
+    Records the cached sequencer marks already cover are skipped, and keys
+    with no ObjectCreated/ObjectRemoved record are left out.
+    """
+    sizes, sequencers = {}, {}
+    for object_key, items in objects.items():
+        for message_id, s3_record in items:
+            sequencer = sequencer_of(s3_record)
+            if orderer.seen(bucket_name, object_key, sequencer):
+                orderer.drop()
+                continue
+            event_name = s3_record["eventName"]
+            if event_name.startswith("ObjectCreated"):
+                sizes[object_key] = s3_record["s3"]["object"].get("size", 0)
+            elif event_name.startswith("ObjectRemoved"):
+                sizes[object_key] = None
+            else:
+                continue
+            if sequencer is not None:
+                sequencers[object_key] = sequencer
+    return sizes, sequencers
+
+def new_history_writer():
+    """
+    Buffered BatchWriteItem writer for the size history table.
+    """
+    return BufferedBatchWriter(dynamodb, TABLE_NAME, key_names=("bucket_name", "timestamp"))
 
-    return total_size, object_count
+def write_size_history(history, bucket_name, total_size, object_count):
+    """
+    Queue one datapoint for the size history table. It is written when the
+    writer is flushed at the end of the invocation. The minute/hour/day
+    rollups are updated right away.
+    """
+    timestamp = int(time.time())  # Unix timestamp
+    history.put({
+        "bucket_name": bucket_name,
+        "timestamp": timestamp,
+        "total_size": total_size,
+        "object_count": object_count
+    })
+    if ROLLUP_TABLE_NAME:
+        SizeRollups(aws_clients.table(ROLLUP_TABLE_NAME)).record(
+            bucket_name, timestamp, total_size, object_count
+        )
+    print(f"Updated size: {bucket_name} - Size: {total_size} bytes, Objects: {object_count}")
 
+@aws_clients.log_request_stats
 def lambda_handler(event, context):
     """
-    AWS Lambda function triggered by S3 events (PUT, POST, DELETE).
-    Computes total bucket size and writes to DynamoDB.
+    AWS Lambda function triggered by S3 events (PUT, POST, DELETE) via SQS.
+    Processes the whole SQS batch, merges the events per bucket so each bucket
+    gets one size update, and reports failed messages so only those are retried.
     """
-    print(f"Received event: {json.dumps(event)}")
+    print(f"Received {len(event['Records'])} SQS records")
+
+    totals = BucketTotals(aws_clients.table(TOTALS_TABLE_NAME))
+    batch, by_object = collect(event)
+    history = new_history_writer()
+
+    # bucket_name -> {object_key: [(message_id, s3_record)]}
+    by_bucket = {}
+    for (bucket_name, object_key), items in by_object.items():
+        by_bucket.setdefault(bucket_name, {})[object_key] = items
+
+    for bucket_name, objects in by_bucket.items():
+        message_ids = {message_id for items in objects.values() for message_id, _ in items}
+        try:
+            if SIZE_TRACKING_MODE == "full":
+                # Compute bucket size
+                total_size, object_count = calculate_bucket_size(bucket_name, context)
+                # Keep the totals current so readers of total_size/object_count
+                # see the same numbers whichever mode is deployed
+                totals.reset(bucket_name, total_size, object_count)
+                totals.record_max(bucket_name, total_size)
+            else:
+                # Index rows, totals and sequencer marks change together
+                # or not at all
+                size_delta, count_delta = ledger.apply(bucket_name, *final_sizes(bucket_name, objects))
+                item = totals.get(bucket_name, consistent=True)
+                total_size, object_count = int(item.get("total_size", 0)), int(item.get("object_count", 0))
+                # The high-water mark can only move when the bucket grew
+                if size_delta > 0:
+                    totals.record_max(bucket_name, total_size)
+            write_size_history(history, bucket_name, total_size, object_count)
+        except Exception as e:
+            # Nothing of this bucket's changes was applied that a retry
+            # would miss: the ledger works deltas out from the index again
+            print(f"Error updating size of {bucket_name}: {e}")
+            batch.fail(message_ids)
 
-    # Extract bucket name from event
     try:
-        message = json.loads(json.loads(event["Records"][0]["body"])['Message'])
-        bucket_name = message["Records"][0]["s3"]["bucket"]["name"]
-    except KeyError:
-        print("Error: Unable to retrieve bucket name from event.")
-        return {"statusCode": 400, "body": "Invalid event structure"}
-
-    # Compute bucket size
-    total_size, object_count = calculate_bucket_size(bucket_name)
-    timestamp = int(time.time())  # Unix timestamp
+        history.flush()
+        # Plot renders are cached by this version, so it only moves once the
+        # datapoints it stands for can be read
+        for bucket_name in by_bucket:
+            totals.bump_history_version(bucket_name)
+    except Exception as e:
+        # The totals are already right; a retry finds no deltas left to
+        # apply and just writes the datapoints again
+        print(f"Error writing size history: {e}")
+        for objects in by_bucket.values():
+            batch.fail(message_id for items in objects.values() for message_id, _ in items)
+    print(f"Wrote {history.items_written} datapoints in {history.flush_count} BatchWriteItem calls")
+    if orderer.dropped:
+        print(f"Skipped {orderer.dropped} stale or duplicate S3 events so far in this container")
+
+    return batch.response()
 
-    # Store data in DynamoDB
-    table = dynamodb.Table(TABLE_NAME)
-    response = table.put_item(
-        Item={
-            "bucket_name": bucket_name,
-            "timestamp": timestamp,
-            "total_size": total_size,
-            "object_count": object_count
-        }
-    )
+def index_pruner(bucket_name, listed_since, pruned):
+    """
+    on_page hook for the bucket scanners that drops object index rows whose
+    keys the listing no longer has, so the cleaner and eviction stop
+    offering them. Appends the number dropped per page to pruned. None
+    without an index table.
+    """
+    if not OBJECT_INDEX_TABLE_NAME:
+        return None
+    index = ObjectSizeIndex(aws_clients.table(OBJECT_INDEX_TABLE_NAME))
+
+    def on_page(prefix, delimiter, objects, after, upto, common_prefixes):
+        pruned.append(
+            index.prune(bucket_name, prefix, delimiter, objects, after, upto, listed_since, common_prefixes)
+        )
+    return on_page
+
+@aws_clients.log_request_stats
+def reconcile_handler(event, context):
+    """
+    Scheduled full reconciliation. Re-lists the bucket and overwrites the
+    running total to correct any drift from missed or duplicated events.
+    Index rows of objects the listing doesn't find are dropped on the way.
+    """
+    bucket_name = os.environ["BUCKET_NAME"]
+    totals = BucketTotals(aws_clients.table(TOTALS_TABLE_NAME))
+    pruned = []
 
+    checkpoints = Checkpoints(aws_clients.table(CHECKPOINT_TABLE_NAME)) if CHECKPOINT_TABLE_NAME else None
+    if checkpoints:
+        # Carry on from the last checkpoint; if the listing doesn't finish in
+        # this invocation, save where each shard got to and start another.
+        # The lease keeps a scheduled run and a resumed one from both
+        # working from the same checkpoint.
+        job_id, owner = f"reconcile:{bucket_name}", run_id(context)
+        try:
+            checkpoint = checkpoints.acquire(job_id, owner, lease_seconds(context))
+        except CheckpointBusy:
+            print(f"Reconcile of {bucket_name} is already running")
+            return {"statusCode": 409, "body": json.dumps("Reconcile already running")}
+        # Rows written after the listing began may be objects it missed
+        listed_since = int(checkpoint["listed_since"]) if checkpoint else int(time.time())
+        state, done = scan_resumable(
+            s3_client, bucket_name, checkpoint,
+            budget=Budget(context, SAFETY_MARGIN_MS), max_workers=SCAN_WORKERS,
+            on_page=index_pruner(bucket_name, listed_since, pruned)
+        )
+        state["listed_since"] = listed_since
+        if not done:
+            try:
+                checkpoints.save(job_id, owner, state)
+            except CheckpointBusy:
+                print(f"Reconcile of {bucket_name} was taken over by another run; dropping this listing")
+                return {"statusCode": 409, "body": json.dumps("Reconcile taken over by another run")}
+            resume_later(lambda_client, context)
+            print(f"Reconcile of {bucket_name} checkpointed with {len(state['shards'])} shards left, "
+                  f"{sum(pruned)} stale index rows dropped")
+            return {
+                "statusCode": 202,
+                "body": json.dumps({"shards_remaining": len(state["shards"])})
+            }
+        total_size, object_count = int(state["total_size"]), int(state["object_count"])
+    else:
+        listed_since = int(time.time())
+        total_size, object_count = calculate_bucket_size(
+            bucket_name, context, on_page=index_pruner(bucket_name, listed_since, pruned)
+        )
+    old_size, old_count = totals.reset(bucket_name, total_size, object_count)
+    totals.record_max(bucket_name, total_size)
+    if checkpoints:
+        # Release only once the totals are written, so no other run resets
+        # them at the same time
+        checkpoints.clear(job_id, owner)
 
-    print(f"DynamoDB Response: {response}")  # <-- Add this to debug
+    print(f"Reconciled {bucket_name}: size {old_size} -> {total_size} bytes, "
+          f"objects {old_count} -> {object_count}, {sum(pruned)} stale index rows dropped")
+    with new_history_writer() as history:
+        write_size_history(history, bucket_name, total_size, object_count)
+    totals.bump_history_version(bucket_name)
 
-    print(f"Updated DynamoDB: {bucket_name} - Size: {total_size} bytes, Objects: {object_count}")
-    
-    return {"statusCode": 200, "body": "Bucket size updated"}
+    return {
+        "statusCode": 200,
+        "body": json.dumps({
+            "size_drift": total_size - old_size,
+            "count_drift": object_count - old_count
+        })
+    }
@@ -0,0 +1,164 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from event_ordering import sequencer_of
+
+
+class ConsumedBatch:
+    """
+    Outcome of consuming one SQS batch: the result of every S3 record that was
+    handled and the SQS message ids that need to be retried.
+    """
+
+    def __init__(self, orderer=None):
+        # (message_id, s3_record, handler result), in batch order per key
+        self.results = []
+        self.failed_message_ids = set()
+        self.duplicates = 0
+        self.orderer = orderer
+        # (bucket, key) -> [(message_id, sequencer)] handled, in sequencer order
+        self.handled = {}
+
+    def fail(self, message_ids):
+        self.failed_message_ids.update(message_ids)
+
+    def advance_marks(self):
+        """
+        Raise each object's sequencer mark to its newest handled event whose
+        message isn't failed. Called once the caller's side effects are done,
+        so an event that fails anywhere, or never finishes because the
+        invocation timed out, isn't dropped as a duplicate on retry.
+        """
+        if not self.orderer:
+            return
+        for (bucket_name, object_key), handled in self.handled.items():
+            sequencers = [seq for message_id, seq in handled
+                          if seq is not None and message_id not in self.failed_message_ids]
+            if not sequencers:
+                continue
+            try:
+                self.orderer.advance(bucket_name, object_key, sequencers[-1])
+            except Exception as e:
+                # The event was applied; a late duplicate may be applied again
+                print(f"Error advancing the sequencer mark of {(bucket_name, object_key)}: {e}")
+
+    def response(self):
+        """
+        Lambda response for an SQS event source with ReportBatchItemFailures.
+        Advances the sequencer marks, so call it last.
+        """
+        self.advance_marks()
+        return {
+            "batchItemFailures": [
+                {"itemIdentifier": message_id} for message_id in sorted(self.failed_message_ids)
+            ]
+        }
+
+
+def unwrap_message(record):
+    """
+    SQS message -> SNS notification -> S3 event, in one pass.
+    Returns the S3 records (s3:TestEvent messages have none).
+    """
+    sns_message = json.loads(record["body"])
+    s3_event = json.loads(sns_message["Message"])
+    return s3_event.get("Records", [])
+
+
+def event_id(s3_record):
+    """
+    S3 delivers at least once; the same change has the same bucket, key
+    and sequencer on every delivery.
+    """
+    s3 = s3_record["s3"]
+    return s3["bucket"]["name"], s3["object"]["key"], s3["object"].get("sequencer"), s3_record["eventName"]
+
+
+def object_id(s3_record):
+    return s3_record["s3"]["bucket"]["name"], s3_record["s3"]["object"]["key"]
+
+
+def collect(event):
+    """
+    Unwrap every message of an SQS batch and group its S3 records by object,
+    dropping duplicate S3 events. Returns a ConsumedBatch (with no results
+    yet) and {(bucket, key): [(message_id, s3_record)]}, each list in
+    sequencer order. Malformed messages are logged and dropped, since they
+    would fail on every retry.
+    """
+    batch = ConsumedBatch()
+    seen = set()
+    by_object = {}
+
+    for record in event["Records"]:
+        try:
+            s3_records = unwrap_message(record)
+        except (KeyError, ValueError) as e:
+            print(f"Error: Invalid event structure in message {record.get('messageId')}: {e}")
+            continue
+
+        for s3_record in s3_records:
+            try:
+                eid = event_id(s3_record)
+                oid = object_id(s3_record)
+            except KeyError as e:
+                print(f"Error: Invalid S3 record in message {record.get('messageId')}: {e}")
+                continue
+            if eid[2] is not None and eid in seen:
+                batch.duplicates += 1
+                continue
+            seen.add(eid)
+            by_object.setdefault(oid, []).append((record["messageId"], s3_record))
+
+    for items in by_object.values():
+        # Records without a sequencer sort first
+        items.sort(key=lambda item: sequencer_of(item[1]) or "")
+    if batch.duplicates:
+        print(f"Dropped {batch.duplicates} duplicate S3 events")
+    return batch, by_object
+
+
+def consume(event, handle_record, max_workers=8, orderer=None):
+    """
+    Unwrap every message of an SQS batch, drop duplicate S3 events and call
+    handle_record(s3_record) for the rest.
+
+    Records for different objects are handled concurrently on a thread pool;
+    records for the same object are handled in sequencer order on one thread,
+    and stop at the first failure so a later event can't overtake a failed
+    one. A failing record marks its SQS message (and those of the skipped
+    records) as failed.
+
+    With an EventOrderer, events at or below the object's high-water mark
+    (duplicates and late deliveries from earlier batches) are skipped too.
+    The marks of handled events are only advanced by batch.response(), after
+    the caller's own side effects, and not for messages failed by then.
+    """
+    batch, by_object = collect(event)
+    batch.orderer = orderer
+
+    def handle_object(oid, items):
+        results, handled, failed = [], [], set()
+        for i, (message_id, s3_record) in enumerate(items):
+            sequencer = sequencer_of(s3_record)
+            if orderer and orderer.is_stale(*oid, sequencer):
+                continue
+            try:
+                results.append((message_id, s3_record, handle_record(s3_record)))
+            except Exception as e:
+                print(f"Error handling {oid} from message {message_id}: {e}")
+                failed.update(m for m, _ in items[i:])
+                break
+            handled.append((message_id, sequencer))
+        return oid, results, handled, failed
+
+    if by_object:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(by_object))) as pool:
+            for oid, results, handled, failed in pool.map(lambda group: handle_object(*group), by_object.items()):
+                batch.results.extend(results)
+                batch.handled[oid] = handled
+                batch.fail(failed)
+
+    if orderer and orderer.dropped:
+        print(f"Skipped {orderer.dropped} stale or duplicate S3 events so far in this container")
+    return batch
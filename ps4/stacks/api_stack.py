@@ -10,7 +10,7 @@ from aws_cdk import (
 from constructs import Construct
 
 class APIStack(Stack):
-    def __init__(self, scope: Construct, id: str, plotting_lambda, bucket, table, **kwargs):
+    def __init__(self, scope: Construct, id: str, plotting_lambda, bucket, table, object_index_table, **kwargs):
         super().__init__(scope, id, **kwargs)
 
         # ------------------------------------------------
@@ -43,12 +43,16 @@ class APIStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_11,
             handler="driver_lambda.lambda_handler",
             code=_lambda.Code.from_asset("lambda"),
-            timeout=Duration.seconds(60),
+            # Load mode runs whole workloads, not just the three scripted uploads
+            timeout=Duration.minutes(15),
+            memory_size=1024,
             environment={
                 "BUCKET_NAME": bucket.bucket_name,
-                "PLOTTING_LAMBDA_API": f"{self.api.url}/plot"  # ✅ This is good
+                "PLOTTING_LAMBDA_API": f"{self.api.url}/plot",  # ✅ This is good
+                "OBJECT_INDEX_TABLE_NAME": object_index_table.table_name
             }
         )
+        object_index_table.grant_read_data(self.driver_lambda)
 
         # ✅ Add permission to write to S3
         self.driver_lambda.add_to_role_policy(
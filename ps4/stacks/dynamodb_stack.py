@@ -19,3 +19,93 @@ class DynamoDBStack(Stack):
             billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
         )
 
+        # Last known size of every object, so deletes and overwrites can be
+        # applied to the running total without listing the bucket
+        self.object_index_table = dynamodb.Table(
+            self, "S3ObjectSizeIndex",
+            partition_key=dynamodb.Attribute(
+                name="bucket_name",
+                type=dynamodb.AttributeType.STRING
+            ),
+            sort_key=dynamodb.Attribute(
+                name="object_key",
+                type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
+        )
+
+        # Objects of a bucket ordered by size, so the cleaner can find the
+        # largest ones without listing the bucket
+        self.object_index_table.add_global_secondary_index(
+            index_name="SizeIndex",
+            partition_key=dynamodb.Attribute(
+                name="bucket_name",
+                type=dynamodb.AttributeType.STRING
+            ),
+            sort_key=dynamodb.Attribute(
+                name="size",
+                type=dynamodb.AttributeType.NUMBER
+            ),
+            projection_type=dynamodb.ProjectionType.KEYS_ONLY
+        )
+
+        # Running total size / object count per bucket
+        self.totals_table = dynamodb.Table(
+            self, "S3BucketSizeTotals",
+            partition_key=dynamodb.Attribute(
+                name="bucket_name",
+                type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
+        )
+
+        # Per-minute/hour/day min/max/last size, keyed by "<bucket>#<resolution>"
+        self.rollup_table = dynamodb.Table(
+            self, "S3BucketSizeRollups",
+            partition_key=dynamodb.Attribute(
+                name="series",
+                type=dynamodb.AttributeType.STRING
+            ),
+            sort_key=dynamodb.Attribute(
+                name="bucket_start",
+                type=dynamodb.AttributeType.NUMBER
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
+        )
+
+        # Last known object sizes for the logging Lambda. Kept apart from the
+        # size tracker's index, which removes keys when it handles a delete
+        self.logging_index_table = dynamodb.Table(
+            self, "S3LoggingSizeIndex",
+            partition_key=dynamodb.Attribute(
+                name="bucket_name",
+                type=dynamodb.AttributeType.STRING
+            ),
+            sort_key=dynamodb.Attribute(
+                name="object_key",
+                type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
+        )
+
+        # Highest S3 sequencer processed per "<consumer>:<bucket>:<key>",
+        # used to drop duplicate and out-of-order event deliveries
+        self.sequencer_table = dynamodb.Table(
+            self, "S3EventSequencers",
+            partition_key=dynamodb.Attribute(
+                name="object_id",
+                type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
+        )
+
+        # Progress of jobs that span several invocations (continuation
+        # tokens, last key processed), one item per job_id
+        self.checkpoint_table = dynamodb.Table(
+            self, "S3JobCheckpoints",
+            partition_key=dynamodb.Attribute(
+                name="job_id",
+                type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
+        )
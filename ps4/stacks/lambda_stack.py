@@ -6,7 +6,9 @@ from aws_cdk import (
     aws_s3 as s3,
     aws_s3_notifications as s3n,
     aws_sns as sns, 
-    aws_lambda_event_sources as sources
+    aws_lambda_event_sources as sources,
+    aws_events as events,
+    aws_events_targets as targets
 )
 
 from aws_cdk.aws_s3_notifications import SnsDestination
@@ -14,7 +16,7 @@ from aws_cdk.aws_s3_notifications import SnsDestination
 from constructs import Construct
 
 class LambdaStack(Stack):
-    def __init__(self, scope: Construct, id: str, table, bucket_arn, size_queue, log_queue, topic_arn, **kwargs):
+    def __init__(self, scope: Construct, id: str, table, object_index_table, totals_table, rollup_table, logging_index_table, sequencer_table, checkpoint_table, bucket_arn, size_queue, log_queue, topic_arn, **kwargs):
         super().__init__(scope, id, **kwargs)
 
         # self.topic = sns.Topic(self, "MyTopic")
@@ -47,10 +49,10 @@ class LambdaStack(Stack):
         #     s3.EventType.OBJECT_REMOVED,
         #     s3n.SnsDestination(self.topic)
         # )
+        # Incremental size tracking needs a removal event for every key
         bucket.add_event_notification(
             s3.EventType.OBJECT_REMOVED,
-            s3n.SnsDestination(sns_topic),
-            s3.NotificationKeyFilter(prefix="removed/")
+            s3n.SnsDestination(sns_topic)
         )
 
         # Size-Tracking Lambda
@@ -60,14 +62,29 @@ class LambdaStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_9,
             handler="size_tracking_lambda.lambda_handler",
             code=_lambda.Code.from_asset("lambda"),
+            timeout=Duration.seconds(30),
             environment={
                 "DYNAMODB_TABLE_NAME": table.table_name,
+                "OBJECT_INDEX_TABLE_NAME": object_index_table.table_name,
+                "TOTALS_TABLE_NAME": totals_table.table_name,
+                "ROLLUP_TABLE_NAME": rollup_table.table_name,
+                "SEQUENCER_TABLE_NAME": sequencer_table.table_name,
+                "SIZE_TRACKING_MODE": "incremental",
                 "BUCKET_ARN": bucket.bucket_arn
             }
         )
 
         size_queue.grant_consume_messages(self.size_tracking_lambda)
-        self.size_tracking_lambda.add_event_source(sources.SqsEventSource(size_queue))
+        # Large batches + a batching window cut invocations under bursty uploads;
+        # failed messages are reported individually so only they are retried
+        self.size_tracking_lambda.add_event_source(
+            sources.SqsEventSource(
+                size_queue,
+                batch_size=100,
+                max_batching_window=Duration.seconds(5),
+                report_batch_item_failures=True
+            )
+        )
 
         # Cleaner Lambda
         self.cleaner_lambda = _lambda.Function(
@@ -77,10 +94,17 @@ class LambdaStack(Stack):
             code=_lambda.Code.from_asset("lambda"),
             timeout=Duration.seconds(30),
             environment={
-                "BUCKET_NAME": "test-bucket-ps4-zz"
+                "BUCKET_NAME": "test-bucket-ps4-zz",
+                "OBJECT_INDEX_TABLE_NAME": object_index_table.table_name,
+                "TOTALS_TABLE_NAME": totals_table.table_name,
+                "CHECKPOINT_TABLE_NAME": checkpoint_table.table_name
             }
         )
-        
+        # Deleted victims are taken out of the index and the totals
+        object_index_table.grant_read_write_data(self.cleaner_lambda)
+        totals_table.grant_read_write_data(self.cleaner_lambda)
+        checkpoint_table.grant_read_write_data(self.cleaner_lambda)
+
         # s3:ListBucket applies to bucket ARN only
         self.cleaner_lambda.add_to_role_policy(
             iam.PolicyStatement(
@@ -101,19 +125,31 @@ class LambdaStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_9,
             handler="logging_lambda.lambda_handler",
             code=_lambda.Code.from_asset("lambda"),
+            timeout=Duration.seconds(30),
+            environment={
+                "SIZE_INDEX_TABLE_NAME": logging_index_table.table_name,
+                "SEQUENCER_TABLE_NAME": sequencer_table.table_name
+            }
         )
 
         log_queue.grant_consume_messages(self.logging_lambda)
-        self.logging_lambda.add_event_source(sources.SqsEventSource(log_queue))
-
-        self.logging_lambda.add_to_role_policy(
-            iam.PolicyStatement(
-                actions=["logs:FilterLogEvents"],
-                resources=["*"]  # Optionally restrict to your own log group
+        self.logging_lambda.add_event_source(
+            sources.SqsEventSource(
+                log_queue,
+                batch_size=100,
+                max_batching_window=Duration.seconds(5),
+                report_batch_item_failures=True
             )
         )
 
+        logging_index_table.grant_read_write_data(self.logging_lambda)
+        sequencer_table.grant_read_write_data(self.logging_lambda)
+
         table.grant_write_data(self.size_tracking_lambda)
+        object_index_table.grant_read_write_data(self.size_tracking_lambda)
+        totals_table.grant_read_write_data(self.size_tracking_lambda)
+        rollup_table.grant_read_write_data(self.size_tracking_lambda)
+        sequencer_table.grant_read_write_data(self.size_tracking_lambda)
 
         self.size_tracking_lambda.add_to_role_policy(
             iam.PolicyStatement(
@@ -122,6 +158,51 @@ class LambdaStack(Stack):
             )
         )
 
+        # Periodic full re-listing to correct drift in the incremental totals
+        self.size_reconcile_lambda = _lambda.Function(
+            self,
+            "SizeReconcileLambda",
+            runtime=_lambda.Runtime.PYTHON_3_9,
+            handler="size_tracking_lambda.reconcile_handler",
+            code=_lambda.Code.from_asset("lambda"),
+            timeout=Duration.minutes(5),
+            environment={
+                "DYNAMODB_TABLE_NAME": table.table_name,
+                "OBJECT_INDEX_TABLE_NAME": object_index_table.table_name,
+                "TOTALS_TABLE_NAME": totals_table.table_name,
+                "ROLLUP_TABLE_NAME": rollup_table.table_name,
+                "BUCKET_NAME": "test-bucket-ps4-zz",
+                "CHECKPOINT_TABLE_NAME": checkpoint_table.table_name
+            }
+        )
+        table.grant_write_data(self.size_reconcile_lambda)
+        object_index_table.grant_read_write_data(self.size_reconcile_lambda)
+        totals_table.grant_read_write_data(self.size_reconcile_lambda)
+        rollup_table.grant_read_write_data(self.size_reconcile_lambda)
+        checkpoint_table.grant_read_write_data(self.size_reconcile_lambda)
+        self.size_reconcile_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["s3:ListBucket"],
+                resources=[bucket.bucket_arn]
+            )
+        )
+
+        # The cleaner and reconcile Lambdas re-invoke themselves to continue
+        # from a checkpoint. grant_invoke on a function's own ARN would make
+        # its role depend on itself, so match this stack's function names.
+        self_invoke = iam.PolicyStatement(
+            actions=["lambda:InvokeFunction"],
+            resources=[f"arn:aws:lambda:{self.region}:{self.account}:function:{self.stack_name}-*"]
+        )
+        self.cleaner_lambda.add_to_role_policy(self_invoke)
+        self.size_reconcile_lambda.add_to_role_policy(self_invoke)
+
+        events.Rule(
+            self, "SizeReconcileSchedule",
+            schedule=events.Schedule.rate(Duration.hours(1)),
+            targets=[targets.LambdaFunction(self.size_reconcile_lambda)]
+        )
+
         # Plotting Lambda
         matplotlib_layer = _lambda.LayerVersion.from_layer_version_arn(
             self,
@@ -143,11 +224,15 @@ class LambdaStack(Stack):
             timeout=Duration.seconds(30),
             environment={
                 "DYNAMODB_TABLE_NAME": table.table_name,
+                "ROLLUP_TABLE_NAME": rollup_table.table_name,
+                "TOTALS_TABLE_NAME": totals_table.table_name,
                 "BUCKET_NAME": "test-bucket-ps4-zz"
             },
             layers=[matplotlib_layer, numpy_layer]
         )
         table.grant_read_data(self.plotting_lambda)
+        rollup_table.grant_read_data(self.plotting_lambda)
+        totals_table.grant_read_data(self.plotting_lambda)
         self.plotting_lambda.add_to_role_policy(
             iam.PolicyStatement(
                 actions=["dynamodb:Query"],
@@ -157,7 +242,7 @@ class LambdaStack(Stack):
 
         self.plotting_lambda.add_to_role_policy(
             iam.PolicyStatement(
-                actions=["s3:PutObject"],
+                actions=["s3:PutObject", "s3:GetObject"],
                 resources=[f"{bucket.bucket_arn}/*"]  # Allows PutObject on any file inside the bucket
             )
         )
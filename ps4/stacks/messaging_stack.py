@@ -1,5 +1,6 @@
 from aws_cdk import (
     Stack,
+    Duration,
     aws_sns as sns,
     aws_sqs as sqs,
     aws_sns_subscriptions as subscriptions
@@ -14,8 +15,15 @@ class MessagingStack(Stack):
         self.s3_event_topic = sns.Topic(self, "S3EventTopic")
 
         # 2. Create Two SQS Queues
-        self.size_tracking_queue = sqs.Queue(self, "SizeTrackingQueue")
-        self.logging_queue = sqs.Queue(self, "LoggingQueue")
+        # Visibility timeout must cover the consumer's timeout plus its batching window
+        self.size_tracking_queue = sqs.Queue(
+            self, "SizeTrackingQueue",
+            visibility_timeout=Duration.seconds(180)
+        )
+        self.logging_queue = sqs.Queue(
+            self, "LoggingQueue",
+            visibility_timeout=Duration.seconds(180)
+        )
 
         # 3. Subscribe Queues to SNS
         self.s3_event_topic.add_subscription(subscriptions.SqsSubscription(self.size_tracking_queue))
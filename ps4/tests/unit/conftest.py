@@ -0,0 +1,67 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# The Lambda code is a flat asset directory; import its modules the way the
+# runtime does
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "lambda")))
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    """
+    moto's in-memory AWS for tests that talk to DynamoDB or S3.
+    """
+    moto = pytest.importorskip("moto")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        import aws_clients
+        # Clients cached by an earlier test belong to its mock
+        aws_clients._clients.clear()
+        aws_clients._resources.clear()
+        aws_clients._tables.clear()
+        yield
+
+
+@pytest.fixture
+def load_handler(monkeypatch):
+    """
+    (Re-)import a handler module with the given environment, so its
+    module-level clients and settings pick it up.
+    """
+    def load(name, env):
+        for key, value in env.items():
+            monkeypatch.setenv(key, value)
+        if name in sys.modules:
+            return importlib.reload(sys.modules[name])
+        return importlib.import_module(name)
+    return load
+
+
+@pytest.fixture
+def dynamodb(aws):
+    import boto3
+    return boto3.resource("dynamodb")
+
+
+@pytest.fixture
+def make_table(dynamodb):
+    return lambda *args, **kwargs: create_table(dynamodb, *args, **kwargs)
+
+
+def create_table(dynamodb, name, hash_key, range_key=None, hash_type="S", range_type="S"):
+    """
+    On-demand table with a string (by default) hash key and optional range key.
+    """
+    keys = [{"AttributeName": hash_key, "KeyType": "HASH"}]
+    attributes = [{"AttributeName": hash_key, "AttributeType": hash_type}]
+    if range_key:
+        keys.append({"AttributeName": range_key, "KeyType": "RANGE"})
+        attributes.append({"AttributeName": range_key, "AttributeType": range_type})
+    return dynamodb.create_table(
+        TableName=name, KeySchema=keys, AttributeDefinitions=attributes, BillingMode="PAY_PER_REQUEST"
+    )
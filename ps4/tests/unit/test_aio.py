@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import aio
+
+
+class FakeClient:
+    """
+    Sync client whose calls block for a while and count how many overlap.
+    """
+
+    exceptions = object()
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = self.max_running = 0
+
+    def get(self, value):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        return value
+
+
+def test_async_client_runs_sync_calls_within_its_concurrency():
+    sync_client = FakeClient()
+
+    async def main():
+        client = aio.AsyncClient(sync_client, concurrency=3)
+        return await asyncio.gather(*(client.get(i) for i in range(10)))
+
+    assert aio.run(main(), 10) == list(range(10))
+    assert sync_client.max_running == 3
+
+
+def test_async_client_without_aiobotocore_wraps_the_sync_client(monkeypatch):
+    monkeypatch.setattr(aio, "get_aio_session", None)
+    sync_client = FakeClient(delay=0)
+
+    async def main():
+        async with aio.async_client(sync_client, 4) as client:
+            assert client.aio_client is None
+            assert client.exceptions is sync_client.exceptions
+            return await client.get("x")
+
+    assert aio.run(main(), 4) == "x"
+
+
+def test_wait_all_keeps_results_in_input_order():
+    async def value_after(value, delay):
+        await asyncio.sleep(delay)
+        return value
+
+    async def main():
+        # Finish in the reverse of the order they were started
+        tasks = [asyncio.ensure_future(value_after(i, 0.03 - i * 0.01)) for i in range(3)]
+        assert await aio.wait_all(tasks, None) == 0
+        return [task.result() for task in tasks]
+
+    assert asyncio.run(main()) == [0, 1, 2]
+
+
+def test_wait_all_cancels_and_reports_tasks_past_the_deadline():
+    cleaned_up = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        finally:
+            cleaned_up.append(True)
+
+    async def quick():
+        return "done"
+
+    async def main():
+        tasks = [asyncio.ensure_future(quick()), asyncio.ensure_future(slow())]
+        cancelled = await aio.wait_all(tasks, time.monotonic() + 0.05)
+        return cancelled, tasks
+
+    cancelled, (finished, timed_out) = asyncio.run(main())
+    assert cancelled == 1
+    assert finished.result() == "done"
+    assert timed_out.cancelled()
+    # The cancelled task ran its cleanup before wait_all returned
+    assert cleaned_up == [True]
+
+
+def test_wait_all_with_no_tasks_returns_at_once():
+    assert asyncio.run(aio.wait_all([], time.monotonic())) == 0
+
+
+class Context:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def test_deadline_leaves_the_safety_margin():
+    assert aio.deadline(None, 5000) is None
+    assert not aio.expired(None)
+    at = aio.deadline(Context(6000), 5000)
+    assert at - time.monotonic() == pytest.approx(1.0, abs=0.1)
+    assert not aio.expired(at)
+    assert aio.expired(aio.deadline(Context(4000), 5000))
@@ -0,0 +1,54 @@
+import threading
+
+import aws_clients
+from aws_clients import PerThread
+
+
+def run_in_thread(fn):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(fn()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_each_live_thread_gets_its_own_object():
+    shared = PerThread(object)
+    barrier = threading.Barrier(2)
+    seen = []
+
+    def use():
+        seen.append(shared.get())
+        barrier.wait()
+
+    threads = [threading.Thread(target=use) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen[0] is not seen[1]
+    assert shared.get() is shared.get()
+
+
+def test_objects_of_finished_threads_are_reused():
+    built = []
+    shared = PerThread(lambda: built.append(object()) or built[-1])
+    first = run_in_thread(shared.get)
+    assert run_in_thread(shared.get) is first
+    assert len(built) == 1
+
+
+def test_tables_are_per_thread_and_keep_their_name(aws):
+    table = aws_clients.table("things")
+    assert table.name == "things"
+    assert aws_clients.table("things") is table
+    assert run_in_thread(table.get) is not table.get()
+
+
+def test_handler_logs_its_requests(aws, capsys):
+    @aws_clients.log_request_stats
+    def handler(event, context):
+        aws_clients.client("s3").list_buckets()
+
+    handler({}, None)
+    assert '"s3.ListBuckets"' in capsys.readouterr().out
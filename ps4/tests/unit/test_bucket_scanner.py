@@ -0,0 +1,179 @@
+import boto3
+import pytest
+
+import bucket_scanner
+from budget import Checkpoints
+from bucket_scanner import scan_bucket, scan_resumable
+
+
+class Spent:
+    """
+    A budget that is already exhausted: every shard stops after one page.
+    """
+
+    def exhausted(self):
+        return True
+
+
+@pytest.fixture
+def s3(aws, monkeypatch):
+    # Small pages so each shard takes several; the root level still fits in one
+    monkeypatch.setattr(bucket_scanner, "PAGE_SIZE", 3)
+    client = boto3.client("s3")
+    client.create_bucket(Bucket="bkt")
+    client.put_object(Bucket="bkt", Key="root.txt", Body=b"x" * 3)
+    for prefix in ("a/", "b/"):
+        for i in range(5):
+            client.put_object(Bucket="bkt", Key=f"{prefix}{i}", Body=b"x" * (i + 1))
+    return client
+
+
+class Countdown:
+    """
+    A budget that runs out after a number of checks.
+    """
+
+    def __init__(self, checks):
+        self.checks = checks
+
+    def exhausted(self):
+        self.checks -= 1
+        return self.checks < 0
+
+
+def test_scan_resumable_without_a_budget_finishes_in_one_call(s3):
+    state, done = scan_resumable(s3, "bkt")
+    assert done
+    assert (state["total_size"], state["object_count"], state["shards"]) == (33, 11, [])
+
+
+def test_scan_resumable_picks_up_where_each_shard_stopped(s3):
+    # Time left after discovery for one page per shard
+    state, done = scan_resumable(s3, "bkt", budget=Countdown(1))
+    assert not done
+    assert [shard["prefix"] for shard in state["shards"]] == ["a/", "b/"]
+    assert all(shard["token"] for shard in state["shards"])
+
+    calls = 1
+    while not done:
+        state, done = scan_resumable(s3, "bkt", state, budget=Spent())
+        calls += 1
+    assert calls == 2
+    expected = scan_bucket(s3, "bkt")
+    assert (state["total_size"], state["object_count"]) == (expected["total_size"], expected["object_count"])
+
+
+def test_scan_resumable_state_survives_a_checkpoint(s3, make_table):
+    checkpoints = Checkpoints(make_table("checkpoints", "job_id"))
+    state, done = scan_resumable(s3, "bkt", budget=Spent())
+    while not done:
+        # Round-trip through DynamoDB, which hands the numbers back as Decimal
+        checkpoints.acquire("scan", "run", 60)
+        checkpoints.save("scan", "run", state)
+        state, done = scan_resumable(s3, "bkt", checkpoints.acquire("scan", "run", 60), budget=Spent())
+    assert (int(state["total_size"]), int(state["object_count"])) == (33, 11)
+
+
+def record_pages(pages):
+    return lambda prefix, delimiter, objects, after, upto, common_prefixes: pages.append(
+        (prefix, delimiter, [o["Key"] for o in objects], after, upto)
+    )
+
+
+def test_on_page_ranges_cover_each_shard_end_to_end(s3):
+    pages = []
+    scan_bucket(s3, "bkt", max_workers=1, on_page=record_pages(pages))
+    a_pages = [page for page in pages if page[0] == "a/"]
+    assert [(keys, after, upto) for _, _, keys, after, upto in a_pages] == [
+        (["a/0", "a/1", "a/2"], None, "a/2"), (["a/3", "a/4"], "a/2", None)
+    ]
+    # The root listing rolls "a/" and "b/" up under the delimiter
+    assert [page[1:3] for page in pages if page[0] == ""] == [("/", ["root.txt"])]
+
+
+def test_scan_resumable_carries_the_last_key_across_calls(s3):
+    pages = []
+    state, done = scan_resumable(s3, "bkt", budget=Countdown(1), on_page=record_pages(pages))
+    assert {shard["prefix"]: shard["after"] for shard in state["shards"]} == {"a/": "a/2", "b/": "b/2"}
+    scan_resumable(s3, "bkt", state, budget=Spent(), on_page=record_pages(pages))
+    assert ("a/", None, ["a/3", "a/4"], "a/2", None) in pages
+
+
+@pytest.fixture
+def flat(aws, monkeypatch):
+    monkeypatch.setattr(bucket_scanner, "PAGE_SIZE", 3)
+    client = boto3.client("s3")
+    client.create_bucket(Bucket="flat")
+    for key in ("0", "00", "1", "A", "Ab", "a", "b1", "b2", "z", "zz", "~"):
+        client.put_object(Bucket="flat", Key=key, Body=b"x" * len(key))
+    return client
+
+
+def test_flat_keys_are_split_into_key_ranges(flat):
+    root_objects, shards = bucket_scanner.discover_shards(flat, "flat")
+    assert root_objects == []
+    assert len(shards) == len(bucket_scanner.SPLIT_CHARS) + 1
+    assert (shards[0]["after"], shards[0]["upto"], shards[-1]["after"], shards[-1]["upto"]) == (None, "0", "z", None)
+
+    listed = [obj["Key"] for shard in shards
+              for objects, _, _ in bucket_scanner.list_shard(flat, "flat", shard) for obj in objects]
+    assert listed == ["0", "00", "1", "A", "Ab", "a", "b1", "b2", "z", "zz", "~"]
+    stats = scan_bucket(flat, "flat")
+    assert (stats["total_size"], stats["object_count"]) == (16, 11)
+
+
+def count_listings(client):
+    calls = []
+    list_objects_v2 = client.list_objects_v2
+
+    def counting(**kwargs):
+        calls.append(kwargs)
+        return list_objects_v2(**kwargs)
+
+    client.list_objects_v2 = counting
+    return calls
+
+
+def only_prefix_a(s3, count):
+    s3.delete_object(Bucket="bkt", Key="root.txt")
+    for i in range(5):
+        s3.delete_object(Bucket="bkt", Key=f"b/{i}")
+    for i in range(count, 5):
+        s3.delete_object(Bucket="bkt", Key=f"a/{i}")
+
+
+def test_a_single_prefix_is_split_into_key_ranges_after_its_first_page(s3):
+    only_prefix_a(s3, 5)
+    root_objects, shards = bucket_scanner.discover_shards(s3, "bkt")
+    assert [obj["Key"] for obj in root_objects] == ["a/0", "a/1", "a/2"]
+    assert {shard["prefix"] for shard in shards} == {"a/"}
+    assert shards[0]["after"] == "a/2" and shards[0]["upto"] == "a/3"
+    assert scan_bucket(s3, "bkt")["total_size"] == 15
+
+
+def test_a_single_prefix_that_fits_a_page_is_not_split(s3):
+    only_prefix_a(s3, 3)
+    calls = count_listings(s3)
+    stats = scan_bucket(s3, "bkt")
+    assert (stats["total_size"], stats["object_count"]) == (6, 3)
+    # The root level and the prefix's only page
+    assert len(calls) == 2
+
+
+def test_split_shards_resume_from_a_checkpoint(flat):
+    state, done = scan_resumable(flat, "flat", budget=Spent())
+    while not done:
+        state, done = scan_resumable(flat, "flat", state, budget=Spent())
+    assert (state["total_size"], state["object_count"]) == (16, 11)
+
+
+def test_budget_spent_in_discovery_checkpoints_unstarted_shards(flat):
+    calls = count_listings(flat)
+    state, done = scan_resumable(flat, "flat", budget=Countdown(0))
+    # Only the first root page was listed before handing over
+    assert not done and len(calls) == 1
+    assert all(shard["token"] is None for shard in state["shards"])
+
+    state, done = scan_resumable(flat, "flat", state)
+    assert done
+    assert (state["total_size"], state["object_count"]) == (16, 11)
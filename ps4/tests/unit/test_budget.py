@@ -0,0 +1,39 @@
+import pytest
+
+from budget import CheckpointBusy, Checkpoints
+
+
+@pytest.fixture
+def checkpoints(make_table):
+    return Checkpoints(make_table("checkpoints", "job_id"))
+
+
+def test_acquire_returns_the_saved_state(checkpoints):
+    assert checkpoints.acquire("job", "run1", 60) is None
+    checkpoints.save("job", "run1", {"cursor": "k"})
+    assert checkpoints.acquire("job", "run2", 60) == {"cursor": "k"}
+
+
+def test_a_live_lease_keeps_other_runs_out(checkpoints):
+    checkpoints.acquire("job", "run1", 60)
+    with pytest.raises(CheckpointBusy):
+        checkpoints.acquire("job", "run2", 60)
+    # The holder can renew its own lease
+    checkpoints.acquire("job", "run1", 60)
+
+
+def test_an_expired_lease_can_be_taken_over(checkpoints):
+    checkpoints.acquire("job", "run1", -1)
+    checkpoints.acquire("job", "run2", 60)
+    # The run that lost the lease can neither save nor clear
+    with pytest.raises(CheckpointBusy):
+        checkpoints.save("job", "run1", {"cursor": "stale"})
+    assert not checkpoints.clear("job", "run1")
+    assert checkpoints.clear("job", "run2")
+    assert checkpoints.load("job") is None
+
+
+def test_save_gives_up_the_lease(checkpoints):
+    checkpoints.acquire("job", "run1", 60)
+    checkpoints.save("job", "run1", {"cursor": "k"})
+    assert checkpoints.acquire("job", "run2", 60) == {"cursor": "k"}
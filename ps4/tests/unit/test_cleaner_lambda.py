@@ -0,0 +1,95 @@
+import boto3
+import pytest
+
+from budget import Checkpoints
+from size_index import SIZE_INDEX_NAME, BucketTotals, ObjectSizeIndex
+
+
+@pytest.fixture
+def cleaner(aws, dynamodb, make_table, load_handler):
+    s3 = boto3.client("s3")
+    s3.create_bucket(Bucket="bkt")
+    dynamodb.create_table(
+        TableName="index",
+        KeySchema=[
+            {"AttributeName": "bucket_name", "KeyType": "HASH"},
+            {"AttributeName": "object_key", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "bucket_name", "AttributeType": "S"},
+            {"AttributeName": "object_key", "AttributeType": "S"},
+            {"AttributeName": "size", "AttributeType": "N"},
+        ],
+        GlobalSecondaryIndexes=[{
+            "IndexName": SIZE_INDEX_NAME,
+            "KeySchema": [
+                {"AttributeName": "bucket_name", "KeyType": "HASH"},
+                {"AttributeName": "size", "KeyType": "RANGE"},
+            ],
+            "Projection": {"ProjectionType": "KEYS_ONLY"},
+        }],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    make_table("totals", "bucket_name")
+
+    index = ObjectSizeIndex(dynamodb.Table("index"))
+    for key, size in [("big", 100), ("a", 10), ("b", 10)]:
+        s3.put_object(Bucket="bkt", Key=key, Body=b"x" * size)
+        index.record_put("bkt", key, size)
+    BucketTotals(dynamodb.Table("totals")).reset("bkt", 120, 3)
+
+    return load_handler("cleaner_lambda", {
+        "BUCKET_NAME": "bkt",
+        "OBJECT_INDEX_TABLE_NAME": "index",
+        "TOTALS_TABLE_NAME": "totals",
+    })
+
+
+def test_deleted_victims_leave_the_index_and_the_totals(cleaner, dynamodb):
+    report = cleaner.lambda_handler({"target_size": 50}, None)
+
+    assert (report["objects_deleted"], report["bytes_reclaimed"], report["bytes_unindexed"]) == (1, 100, 100)
+    assert sorted(key for key, _ in ObjectSizeIndex(dynamodb.Table("index")).largest("bkt")) == ["a", "b"]
+    item = BucketTotals(dynamodb.Table("totals")).get("bkt")
+    assert (item["total_size"], item["object_count"]) == (20, 2)
+
+
+def test_a_later_alarm_does_not_delete_the_same_object_again(cleaner):
+    cleaner.lambda_handler({"target_size": 50}, None)
+    assert cleaner.lambda_handler({"target_size": 50}, None) is None
+
+    report = cleaner.lambda_handler({"target_size": 15}, None)
+    assert (report["objects_deleted"], report["bytes_reclaimed"]) == (1, 10)
+    assert boto3.client("s3").list_objects_v2(Bucket="bkt")["KeyCount"] == 1
+
+
+@pytest.fixture
+def checkpoints(cleaner, make_table, load_handler):
+    table = make_table("checkpoints", "job_id")
+    load_handler("cleaner_lambda", {"CHECKPOINT_TABLE_NAME": "checkpoints"})
+    return Checkpoints(table)
+
+
+def failing_delete(**kwargs):
+    raise RuntimeError("S3 is down")
+
+
+def test_a_failed_run_gives_up_its_lease(cleaner, checkpoints):
+    cleaner.s3.delete_objects = failing_delete
+    assert cleaner.lambda_handler({"target_size": 50}, None) is None
+    del cleaner.s3.delete_objects
+
+    # The next alarm isn't turned away as "already running"
+    report = cleaner.lambda_handler({"target_size": 50}, None)
+    assert (report["objects_deleted"], report["bytes_reclaimed"]) == (1, 100)
+
+
+def test_a_failed_resumed_run_keeps_its_checkpoint(cleaner, checkpoints, monkeypatch):
+    state = {"policy": "largest", "bytes_to_free": 10, "after": None}
+    checkpoints.acquire("cleaner:bkt", "earlier-run", 60)
+    checkpoints.save("cleaner:bkt", "earlier-run", state)
+
+    monkeypatch.setattr(cleaner.s3, "delete_objects", failing_delete)
+    cleaner.lambda_handler({}, None)
+    assert checkpoints.load("cleaner:bkt") == state
+    assert checkpoints.acquire("cleaner:bkt", "next-run", 60) == state
@@ -0,0 +1,86 @@
+import pytest
+
+from ddb_writer import BufferedBatchWriter
+
+
+class FakeDynamoDB:
+    """
+    batch_write_item that leaves the first `unprocessed` requests of each
+    of the next `throttled` calls unprocessed.
+    """
+
+    def __init__(self, throttled=0, unprocessed=1):
+        self.throttled = throttled
+        self.unprocessed = unprocessed
+        self.calls = []
+        self.written = []
+
+    def batch_write_item(self, RequestItems):
+        (table_name, requests), = RequestItems.items()
+        self.calls.append(len(requests))
+        if self.throttled:
+            self.throttled -= 1
+            left, done = requests[:self.unprocessed], requests[self.unprocessed:]
+        else:
+            left, done = [], requests
+        self.written.extend(r["PutRequest"]["Item"] for r in done)
+        return {"UnprocessedItems": {table_name: left} if left else {}}
+
+
+def writer(dynamodb, **kwargs):
+    delays = []
+    w = BufferedBatchWriter(dynamodb, "t", key_names=("k",), sleep=delays.append, **kwargs)
+    return w, delays
+
+
+def test_writes_in_batches_of_25():
+    dynamodb = FakeDynamoDB()
+    w, _ = writer(dynamodb)
+    with w:
+        for i in range(60):
+            w.put({"k": i})
+    assert dynamodb.calls == [25, 25, 10]
+    assert w.items_written == 60
+    assert len(dynamodb.written) == 60
+
+
+def test_batch_size_is_capped_at_the_api_limit():
+    w, _ = writer(FakeDynamoDB(), batch_size=100)
+    assert w.batch_size == 25
+
+
+def test_duplicate_keys_keep_the_last_item():
+    dynamodb = FakeDynamoDB()
+    w, _ = writer(dynamodb)
+    w.put({"k": 1, "v": "old"})
+    w.put({"k": 1, "v": "new"})
+    w.flush()
+    assert dynamodb.written == [{"k": 1, "v": "new"}]
+
+
+def test_unprocessed_items_are_retried_with_exponential_backoff():
+    dynamodb = FakeDynamoDB(throttled=3)
+    w, delays = writer(dynamodb, base_delay=0.1)
+    w.put({"k": 1})
+    w.put({"k": 2})
+    w.flush()
+    assert dynamodb.calls == [2, 1, 1, 1]
+    assert delays == [0.1, 0.2, 0.4]
+    assert w.retry_count == 3
+    assert sorted(item["k"] for item in dynamodb.written) == [1, 2]
+
+
+def test_gives_up_after_max_retries():
+    dynamodb = FakeDynamoDB(throttled=10)
+    w, delays = writer(dynamodb, max_retries=2)
+    w.put({"k": 1})
+    with pytest.raises(RuntimeError, match="after 2 retries"):
+        w.flush()
+    assert len(delays) == 2
+
+
+def test_empty_flush_makes_no_calls():
+    dynamodb = FakeDynamoDB()
+    w, _ = writer(dynamodb)
+    w.flush()
+    assert dynamodb.calls == []
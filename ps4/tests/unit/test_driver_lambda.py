@@ -0,0 +1,23 @@
+
+import pytest
+
+
+@pytest.fixture
+def driver(aws, load_handler):
+    pytest.importorskip("requests")
+    return load_handler("driver_lambda", {"BUCKET_NAME": "bkt", "PLOTTING_LAMBDA_API": "http://plot.invalid"})
+
+
+def test_load_mode_rejects_a_bad_workload(driver):
+    response = driver.lambda_handler({"mode": "load", "workload": {"object_count": 0}}, None)
+    assert response["statusCode"] == 400
+
+
+def test_load_mode_reports_failures(driver, monkeypatch):
+    def unreachable(url):
+        raise ConnectionError("no route to host")
+
+    monkeypatch.setattr(driver.requests, "get", unreachable)
+    response = driver.lambda_handler({"mode": "load", "workload": {"object_count": 1}}, None)
+    assert response["statusCode"] == 500
+    assert "no route to host" in response["body"]
@@ -0,0 +1,60 @@
+import json
+
+from emf import METRIC_NAME, NAMESPACE, SizeDeltaBatch
+
+
+def flushed(batch):
+    lines = []
+    batch.write = lines.append
+    document = batch.flush()
+    assert len(lines) == 1
+    assert json.loads(lines[0]) == document
+    return document
+
+
+def test_document_declares_the_metric_for_cloudwatch():
+    batch = SizeDeltaBatch()
+    batch.add("a", 10)
+    document = flushed(batch)
+
+    (directive,) = document["_aws"]["CloudWatchMetrics"]
+    assert directive["Namespace"] == NAMESPACE
+    # One aggregate series with no dimensions, which the size alarm watches
+    assert directive["Dimensions"] == [[]]
+    assert directive["Metrics"] == [{"Name": METRIC_NAME, "Unit": "Bytes", "StorageResolution": 1}]
+    assert isinstance(document["_aws"]["Timestamp"], int)
+
+
+def test_metric_value_is_the_sum_of_the_logged_deltas():
+    batch = SizeDeltaBatch()
+    batch.add("a", 10)
+    batch.add("b", -4)
+    batch.add("a", 3)
+    document = flushed(batch)
+
+    assert document["size_deltas"] == [
+        {"object_name": "a", "size_delta": 10},
+        {"object_name": "b", "size_delta": -4},
+        {"object_name": "a", "size_delta": 3},
+    ]
+    assert document[METRIC_NAME] == sum(d["size_delta"] for d in document["size_deltas"]) == 9
+    assert document["object_count"] == 3
+
+
+def test_flush_writes_nothing_for_an_empty_batch_and_starts_over():
+    lines = []
+    batch = SizeDeltaBatch(write=lines.append)
+    assert batch.flush() is None
+    batch.add("a", 1)
+    batch.flush()
+    assert batch.flush() is None
+    assert len(lines) == 1
+
+
+def test_namespace_and_metric_name_can_be_overridden():
+    batch = SizeDeltaBatch(namespace="Other", metric_name="Delta")
+    batch.add("a", 2)
+    document = flushed(batch)
+    assert document["_aws"]["CloudWatchMetrics"][0]["Namespace"] == "Other"
+    assert document["_aws"]["CloudWatchMetrics"][0]["Metrics"][0]["Name"] == "Delta"
+    assert document["Delta"] == 2
@@ -0,0 +1,58 @@
+import pytest
+
+from event_ordering import EventOrderer, normalize_sequencer, sequencer_of
+
+
+def test_sequencers_compare_in_s3_order():
+    short, longer = normalize_sequencer("9f"), normalize_sequencer("0100")
+    assert short < longer
+    assert sequencer_of({"s3": {"object": {"key": "k"}}}) is None
+    assert sequencer_of({"s3": {"object": {"key": "k", "sequencer": "ab"}}}) == normalize_sequencer("AB")
+
+
+def test_in_memory_marks():
+    orderer = EventOrderer("test")
+    assert not orderer.is_stale("b", "k", "02")
+    assert orderer.advance("b", "k", "02")
+    assert orderer.is_stale("b", "k", "02")
+    assert orderer.is_stale("b", "k", "01")
+    assert not orderer.is_stale("b", "k", "03")
+    assert not orderer.is_stale("b", "other", "01")
+    assert not orderer.is_stale("b", "k", None)
+    assert orderer.dropped == 2
+
+
+def test_checking_does_not_raise_the_mark():
+    orderer = EventOrderer("test")
+    assert not orderer.is_stale("b", "k", "02")
+    # The event failed before advance(): its retry must not be dropped
+    assert not orderer.is_stale("b", "k", "02")
+
+
+@pytest.fixture
+def marks(make_table):
+    return make_table("sequencers", "object_id")
+
+
+def test_table_marks_are_shared_between_containers(marks):
+    first, second = EventOrderer("test", marks), EventOrderer("test", marks)
+    assert first.advance("b", "k", "05")
+    assert second.is_stale("b", "k", "04")
+    assert not second.advance("b", "k", "05")
+    assert not second.is_stale("b", "k", "06")
+    # Consumers don't see each other's marks
+    assert not EventOrderer("other", marks).is_stale("b", "k", "04")
+
+
+def test_mark_write_fails_its_condition_when_stale(marks):
+    import boto3
+    from botocore.exceptions import ClientError
+    orderer = EventOrderer("test", marks)
+    client = boto3.client("dynamodb")
+    client.transact_write_items(TransactItems=[orderer.mark_write("b", "k", "05")])
+    assert orderer.is_stale("b", "k", "05")
+    with pytest.raises(ClientError) as error:
+        client.transact_write_items(TransactItems=[orderer.mark_write("b", "k", "04")])
+    assert error.value.response["Error"]["Code"] == "TransactionCanceledException"
+    assert EventOrderer("test").mark_write("b", "k", "05") is None
+    assert orderer.mark_write("b", "k", None) is None
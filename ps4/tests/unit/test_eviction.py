@@ -0,0 +1,106 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from eviction import MAX_DELETE_BATCH, delete_objects, order_ties, policy_key, select_victims
+
+
+def obj(key, size, day=1, accessed=None):
+    item = {"Key": key, "Size": size, "LastModified": datetime(2024, 1, day, tzinfo=timezone.utc)}
+    if accessed:
+        item["LastAccessed"] = datetime(2024, 1, accessed, tzinfo=timezone.utc)
+    return item
+
+
+def test_policy_key_breaks_ties_by_key():
+    assert policy_key(obj("b", 5), "largest") > policy_key(obj("a", 5), "largest")
+    assert policy_key(obj("a", 5), "largest") > policy_key(obj("z", 6), "largest")
+
+
+def test_lru_prefers_last_accessed():
+    assert policy_key(obj("a", 1, day=1, accessed=9), "lru") > policy_key(obj("b", 1, day=5), "lru")
+    assert policy_key(obj("a", 1, day=3), "lru") == policy_key(obj("a", 1, day=3), "oldest")
+
+
+def test_policy_key_rejects_unknown_policies():
+    with pytest.raises(ValueError):
+        policy_key(obj("a", 1), "random")
+
+
+@pytest.mark.parametrize("policy, expected", [
+    ("largest", ["c"]),
+    ("oldest", ["a", "b"]),
+])
+def test_select_victims_in_policy_order(policy, expected):
+    candidates = [obj("a", 6, day=1), obj("b", 2, day=2), obj("c", 8, day=3)]
+    assert [v["Key"] for v in select_victims(candidates, 7, policy)] == expected
+
+
+def test_select_victims_skips_empty_objects_and_stops_when_covered():
+    candidates = [obj("a", 0), obj("b", 3), obj("c", 3), obj("d", 3)]
+    assert [v["Key"] for v in select_victims(candidates, 5, "oldest")] == ["b", "c"]
+    assert select_victims(candidates, 0) == []
+
+
+def test_select_victims_reads_presorted_iterators_lazily():
+    consumed = []
+
+    def candidates():
+        for i in range(100):
+            consumed.append(i)
+            yield obj(f"k{i}", 10)
+
+    victims = select_victims(candidates(), 25, presorted=True)
+    assert len(victims) == 3
+    assert consumed == [0, 1, 2]
+
+
+class FakeS3:
+    def __init__(self, failing=()):
+        self.calls = []
+        self.failing = set(failing)
+
+    def delete_objects(self, Bucket, Delete):
+        keys = [o["Key"] for o in Delete["Objects"]]
+        self.calls.append(keys)
+        return {"Errors": [{"Key": k, "Code": "AccessDenied"} for k in keys if k in self.failing]}
+
+
+class SpentBudget:
+    def __init__(self, calls_allowed):
+        self.calls_allowed = calls_allowed
+
+    def exhausted(self):
+        self.calls_allowed -= 1
+        return self.calls_allowed < 0
+
+
+def test_order_ties_sorts_equal_sizes_by_key():
+    # Equal sizes in the order the size index happened to return them
+    index_order = [obj("c", 9), obj("b", 5), obj("d", 5), obj("a", 5), obj("e", 1)]
+    ordered = list(order_ties(iter(index_order), "largest"))
+    assert [o["Key"] for o in ordered] == ["c", "a", "b", "d", "e"]
+
+
+def test_resuming_after_a_tie_skips_only_what_was_deleted():
+    index_order = [obj("b", 5), obj("d", 5), obj("a", 5), obj("c", 5)]
+    first = select_victims(order_ties(iter(index_order), "largest"), 10, presorted=True)
+    after = policy_key(first[-1], "largest")
+    rest = (o for o in order_ties(iter(index_order), "largest") if policy_key(o, "largest") > after)
+    second = select_victims(rest, 10, presorted=True)
+    assert [o["Key"] for o in first + second] == ["a", "b", "c", "d"]
+
+
+def test_delete_objects_batches_and_reports_failures():
+    victims = [obj(f"k{i}", 2) for i in range(MAX_DELETE_BATCH + 1)]
+    s3 = FakeS3(failing={"k0"})
+    report = delete_objects(s3, "b", victims)
+    assert [len(call) for call in s3.calls] == [MAX_DELETE_BATCH, 1]
+    assert (report["objects_deleted"], report["bytes_reclaimed"]) == (MAX_DELETE_BATCH, 2 * MAX_DELETE_BATCH)
+    assert [e["Key"] for e in report["errors"]] == ["k0"]
+
+
+def test_delete_objects_stops_when_the_budget_runs_out():
+    victims = [obj(f"k{i}", 1) for i in range(2 * MAX_DELETE_BATCH)]
+    report = delete_objects(FakeS3(), "b", victims, budget=SpentBudget(1))
+    assert (report["delete_calls"], report["processed"]) == (1, MAX_DELETE_BATCH)
@@ -0,0 +1,99 @@
+import pytest
+
+from load_generator import IndexWatcher, live_keys, parse_workload, percentiles, plan_operations, run_workload
+
+
+def test_parse_workload_fills_in_defaults():
+    workload = parse_workload({"object_count": "5"})
+    assert workload["object_count"] == 5
+    assert workload["concurrency"] == 16
+    assert parse_workload(None)["object_count"] == 100
+
+
+@pytest.mark.parametrize("spec", [
+    {"object_count": 0},
+    {"object_count": "many"},
+    {"delete_ratio": 1},
+    {"concurrency": 0},
+    {"rate": None},
+    {"size_distribution": {"type": "pareto"}},
+    {"size_distribution": 5},
+    {"size_distribution": {"type": "lognormal"}},
+    {"size_distribution": {"type": "fixed", "size": "big"}},
+    {"size_distribution": {"type": "lognormal", "median": 0}},
+])
+def test_parse_workload_rejects_bad_specs(spec):
+    with pytest.raises(ValueError):
+        parse_workload(spec)
+
+
+def test_parse_workload_rejects_deletes_without_removal_events():
+    with pytest.raises(ValueError):
+        parse_workload({"delete_ratio": 0.2, "key_prefix": "load/"}, removal_prefix="removed/")
+    assert parse_workload({"delete_ratio": 0.2, "key_prefix": "removed/load/"}, removal_prefix="removed/")
+    assert parse_workload({"key_prefix": "load/"}, removal_prefix="removed/")
+
+
+def test_plan_deletes_only_keys_already_put():
+    workload = parse_workload({"object_count": 50, "delete_ratio": 0.5, "seed": 7})
+    operations = plan_operations(workload)
+    assert sum(op["op"] == "PUT" for op in operations) == 50
+    deleted = set()
+    for i, op in enumerate(operations):
+        if op["op"] == "DELETE":
+            assert op["after"] < i and operations[op["after"]]["key"] == op["key"]
+            assert op["key"] not in deleted
+            deleted.add(op["key"])
+    assert len(live_keys(operations)) == 50 - len(deleted)
+
+
+def test_plan_is_reproducible_with_a_seed():
+    workload = parse_workload({"object_count": 20, "delete_ratio": 0.3, "seed": 1})
+    assert plan_operations(workload) == plan_operations(workload)
+
+
+def test_percentiles_use_nearest_rank_in_milliseconds():
+    stats = percentiles([i / 1000 for i in range(1, 101)])
+    assert (stats["count"], stats["p50"], stats["p90"], stats["p99"], stats["max"]) == (100, 50, 90, 99, 100)
+    assert stats["mean"] == 50.5
+    assert percentiles([]) == {"count": 0}
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = len(Body)
+
+    def delete_object(self, Bucket, Key):
+        del self.objects[Key]
+
+
+def test_run_workload_leaves_the_live_keys():
+    s3 = FakeS3()
+    workload = parse_workload({"object_count": 30, "delete_ratio": 0.3, "rate": 0, "concurrency": 4, "seed": 3})
+    report, keys = run_workload(s3, "b", workload)
+    assert report["errors"] == []
+    assert report["puts"] == 30
+    assert sorted(keys) == sorted(s3.objects)
+
+
+def test_index_watcher_times_operations_once_visible_in_the_index(dynamodb, make_table):
+    index = make_table("index", "bucket_name", "object_key")
+    index.put_item(Item={"bucket_name": "b", "object_key": "put", "size": 1})
+    index.put_item(Item={"bucket_name": "b", "object_key": "deleted-late", "size": 1})
+    watcher = IndexWatcher(dynamodb, "index", "b")
+    watcher.expect("put", True, 0)
+    watcher.expect("not-yet", True, 0)
+    watcher.expect("deleted", False, 0)
+    watcher.expect("deleted-late", False, 0)
+
+    watcher.poll_once()
+
+    assert sorted(watcher.pending) == ["deleted-late", "not-yet"]
+    assert (len(watcher.latencies["PUT"]), len(watcher.latencies["DELETE"])) == (1, 1)
+
+    index.delete_item(Key={"bucket_name": "b", "object_key": "deleted-late"})
+    watcher.poll_once()
+    assert sorted(watcher.pending) == ["not-yet"]
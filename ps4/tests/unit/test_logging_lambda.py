@@ -0,0 +1,28 @@
+from logging_lambda import log_s3_record
+from size_index import InMemorySizeIndex
+
+
+def s3_record(key, event_name="ObjectCreated:Put", size=None):
+    obj = {"key": key}
+    if size is not None:
+        obj["size"] = size
+    return {"eventName": event_name, "s3": {"bucket": {"name": "b"}, "object": obj}}
+
+
+def test_overwrite_logs_the_size_difference():
+    index = InMemorySizeIndex()
+    assert log_s3_record(s3_record("a", size=10), index) == ("a", 10)
+    assert log_s3_record(s3_record("a", size=4), index) == ("a", -6)
+    assert log_s3_record(s3_record("a", size=4), index) == ("a", 0)
+
+
+def test_delete_logs_the_last_known_size():
+    index = InMemorySizeIndex()
+    log_s3_record(s3_record("a", size=10), index)
+    assert log_s3_record(s3_record("a", "ObjectRemoved:Delete"), index) == ("a", -10)
+    # Unknown objects contribute nothing
+    assert log_s3_record(s3_record("a", "ObjectRemoved:Delete"), index) == ("a", 0)
+
+
+def test_other_events_are_ignored():
+    assert log_s3_record(s3_record("a", "ObjectRestore:Completed"), InMemorySizeIndex()) is None
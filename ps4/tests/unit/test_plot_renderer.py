@@ -0,0 +1,42 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("matplotlib")
+
+import plot_renderer  # noqa: E402
+
+
+def render(engine, sizes):
+    times = np.array([1_700_000_000 + i for i in range(len(sizes))], dtype="datetime64[s]")
+    return engine.render(times, np.array(sizes), max(sizes), times[0], times[-1], len(sizes))
+
+
+def test_one_figure_is_reused_across_renders():
+    engine = plot_renderer.RenderEngine()
+    figure, axes = engine.figure, engine.axes
+    render(engine, [1, 2, 3])
+    png = render(engine, [4, 5]).getvalue()
+
+    assert png.startswith(b"\x89PNG")
+    assert (engine.figure, engine.axes, engine.render_count) == (figure, axes, 2)
+    # The axes were cleared, so only the latest size line and max line are drawn
+    (line,) = [line for line in axes.get_lines() if line.get_label() == "Bucket Size"]
+    assert list(line.get_ydata()) == [4, 5]
+    assert len(axes.get_lines()) == 2
+
+
+def test_cold_and_warm_timings_are_reported_separately():
+    engine = plot_renderer.RenderEngine()
+    render(engine, [1, 2])
+    cold = engine.last_timings
+    render(engine, [1, 2])
+    warm = engine.last_timings
+
+    assert cold["cold_start"] and cold["init_ms"] == round(engine.init_ms, 1)
+    assert not warm["cold_start"] and warm["init_ms"] == 0
+    assert cold["render_ms"] >= 0 and warm["render_ms"] >= 0
+
+
+def test_engine_is_built_once_per_container(monkeypatch):
+    monkeypatch.setattr(plot_renderer, "_engine", None)
+    assert plot_renderer.get_engine() is plot_renderer.get_engine()
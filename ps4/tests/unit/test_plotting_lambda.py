@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def plotting(load_handler):
+    pytest.importorskip("numpy")
+    return load_handler("plotting_lambda", {"DYNAMODB_TABLE_NAME": "history", "BUCKET_NAME": "b"})
+
+
+def test_default_window(plotting):
+    assert plotting.parse_plot_params({}) == (10, 300, "auto")
+    assert plotting.parse_plot_params({"window": "60", "resolution": "minute"}) == (60, 60, "minute")
+
+
+def plot_name(plotting, params):
+    return plotting.plot_object_name(*plotting.parse_plot_params(params)[::2])
+
+
+def test_equivalent_query_strings_share_a_plot_object(plotting):
+    assert plot_name(plotting, {}) == plot_name(plotting, {"foo": "1"}) == "plot.png"
+    assert plot_name(plotting, {"window": "010"}) == plot_name(plotting, {"window": "10"}) == "plot.png"
+    assert plot_name(plotting, {"window": "60", "resolution": "minute"}) == "plot-60-minute.png"
+
+
+@pytest.mark.parametrize("params", [
+    {"window": "abc"},
+    {"window": "1.5"},
+    {"window": "0"},
+    {"window": "-10"},
+    {"resolution": "week"},
+])
+def test_bad_parameters_are_a_client_error(plotting, params):
+    response = plotting.lambda_handler({"queryStringParameters": params}, None)
+    assert response["statusCode"] == 400
+    assert json.loads(response["body"])
+
+
+@pytest.fixture
+def cached_plotting(aws, make_table, load_handler):
+    pytest.importorskip("numpy")
+    pytest.importorskip("matplotlib")
+    import time
+
+    import boto3
+    boto3.client("s3").create_bucket(Bucket="bkt")
+    history = make_table("history", "bucket_name", "timestamp", range_type="N")
+    now = int(time.time())
+    for i, size in enumerate([10, 20, 15]):
+        history.put_item(Item={"bucket_name": "bkt", "timestamp": now - 3 + i, "total_size": size,
+                               "object_count": 1})
+    make_table("totals", "bucket_name").put_item(
+        Item={"bucket_name": "bkt", "history_version": 3, "max_size": 20}
+    )
+    handler = load_handler("plotting_lambda", {
+        "DYNAMODB_TABLE_NAME": "history", "TOTALS_TABLE_NAME": "totals", "BUCKET_NAME": "bkt",
+    })
+    handler._render_cache.clear()
+    return handler
+
+
+def test_unchanged_data_is_not_rendered_again(cached_plotting, monkeypatch):
+    first = cached_plotting.lambda_handler({}, None)
+    assert first["statusCode"] == 200
+    etag = first["headers"]["ETag"]
+
+    def no_render():
+        raise AssertionError("rendered again")
+
+    monkeypatch.setattr(cached_plotting, "get_engine", no_render)
+    revalidated = cached_plotting.lambda_handler({"headers": {"if-none-match": etag}}, None)
+    assert (revalidated["statusCode"], revalidated["body"]) == (304, "")
+    assert revalidated["headers"]["ETag"] == etag
+
+    again = cached_plotting.lambda_handler({}, None)
+    assert (again["statusCode"], again["body"]) == (200, first["body"])
+
+
+def test_new_data_changes_the_etag(cached_plotting):
+    etag = cached_plotting.lambda_handler({}, None)["headers"]["ETag"]
+    cached_plotting.aws_clients.table("totals").update_item(
+        Key={"bucket_name": "bkt"}, UpdateExpression="ADD history_version :one",
+        ExpressionAttributeValues={":one": 1}
+    )
+    response = cached_plotting.lambda_handler({"headers": {"If-None-Match": etag}}, None)
+    assert response["statusCode"] == 200
+    assert response["headers"]["ETag"] != etag
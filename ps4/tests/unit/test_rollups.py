@@ -0,0 +1,43 @@
+import pytest
+
+from rollups import SizeRollups, bucket_start, choose_resolution, series_key
+
+
+def test_bucket_start_rounds_down_to_the_resolution():
+    assert bucket_start(125, "minute") == 120
+    assert bucket_start(120, "minute") == 120
+    assert bucket_start(7199, "hour") == 3600
+    assert bucket_start(86400 * 3 + 5, "day") == 86400 * 3
+
+
+def test_bucket_start_rejects_unknown_resolutions():
+    with pytest.raises(KeyError):
+        bucket_start(0, "week")
+
+
+@pytest.mark.parametrize("window, expected", [
+    (0, None),
+    (59 * 60, None),
+    (60 * 60, "minute"),
+    (60 * 3600 - 1, "minute"),
+    (60 * 3600, "hour"),
+    (60 * 86400, "day"),
+])
+def test_choose_resolution_keeps_enough_points(window, expected):
+    assert choose_resolution(window) == expected
+
+
+def test_choose_resolution_with_fewer_points():
+    assert choose_resolution(3600, min_points=1) == "hour"
+
+
+def test_record_keeps_min_max_and_last(make_table):
+    rollups = SizeRollups(make_table("rollups", "series", "bucket_start", range_type="N"))
+    for timestamp, size in [(60, 10), (70, 30), (80, 5), (90, 20)]:
+        rollups.record("b", timestamp, size, 1)
+
+    (minute,) = rollups.query("b", "minute", 60, 119)
+    assert (minute["min_size"], minute["max_size"], minute["last_size"]) == (5, 30, 20)
+    assert minute["series"] == series_key("b", "minute")
+    assert len(rollups.query("b", "day", 0, 86400)) == 1
+    assert rollups.query("b", "minute", 120, 600) == []
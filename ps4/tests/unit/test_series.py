@@ -0,0 +1,50 @@
+from decimal import Decimal
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from series import SizeSeries
+
+
+def points(series):
+    return list(zip(series.timestamps.tolist(), series.sizes.tolist()))
+
+
+def test_from_pages_reads_decimal_items():
+    pages = [
+        [{"timestamp": Decimal(10), "total_size": Decimal(1)}],
+        [],
+        [{"timestamp": Decimal(20), "total_size": Decimal(2)}],
+    ]
+    assert points(SizeSeries.from_pages(pages)) == [(10, 1), (20, 2)]
+    assert len(SizeSeries.from_pages([])) == 0
+
+
+def test_sorted_keeps_the_last_point_per_timestamp():
+    series = SizeSeries([30, 10, 20, 10], [3, 1, 2, 9])
+    assert points(series.sorted()) == [(10, 9), (20, 2), (30, 3)]
+
+
+def test_clip_is_inclusive_at_both_ends():
+    series = SizeSeries([10, 20, 30, 40], [1, 2, 3, 4])
+    assert points(series.clip(20, 30)) == [(20, 2), (30, 3)]
+    assert points(series.clip(41, 50)) == []
+
+
+def test_clip_can_keep_the_point_before_the_window():
+    series = SizeSeries([10, 20, 30, 40], [1, 2, 3, 4])
+    assert points(series.clip(25, 40, include_previous=True)) == [(20, 2), (30, 3), (40, 4)]
+    # Nothing before the first point to include
+    assert points(series.clip(0, 10, include_previous=True)) == [(10, 1)]
+
+
+def test_resample_keeps_the_last_size_per_step():
+    series = SizeSeries([0, 30, 59, 60, 125], [1, 2, 3, 4, 5])
+    assert points(series.resample(60)) == [(0, 3), (60, 4), (120, 5)]
+
+
+def test_resample_with_a_step_of_one_is_a_no_op():
+    series = SizeSeries([0, 1, 2], [1, 2, 3])
+    assert series.resample(1) is series
+    assert len(SizeSeries([], []).resample(60)) == 0
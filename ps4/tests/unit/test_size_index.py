@@ -0,0 +1,173 @@
+from size_index import BucketTotals, ObjectSizeIndex, InMemorySizeIndex
+
+
+def test_reset_returns_previous_totals(make_table):
+    totals = BucketTotals(make_table("totals", "bucket_name"))
+    assert totals.reset("b", 100, 3) == (0, 0)
+    assert totals.reset("b", 50, 1) == (100, 3)
+
+
+def test_record_max_only_raises_the_mark(make_table):
+    totals = BucketTotals(make_table("totals", "bucket_name"))
+    assert totals.record_max("b", 10)
+    assert not totals.record_max("b", 5)
+    assert not totals.record_max("b", 10)
+    assert totals.record_max("b", 11)
+    assert totals.get_max_size("b") == 11
+    assert totals.get_max_size("other") == 0
+
+
+def test_object_index_returns_previous_size(make_table):
+    index = ObjectSizeIndex(make_table("index", "bucket_name", "object_key"))
+    assert index.record_put("b", "k", 5) is None
+    assert index.record_put("b", "k", 7) == 5
+    assert index.record_delete("b", "k") == 7
+    assert index.record_delete("b", "k") is None
+
+
+def test_in_memory_index_orders_largest_first():
+    index = InMemorySizeIndex()
+    index.record_put("b", "small", 1)
+    index.record_put("b", "large", 9)
+    index.record_put("other", "huge", 99)
+    assert list(index.largest("b")) == [("large", 9), ("small", 1)]
+
+
+def make_ledger(make_table, sleep=lambda seconds: None):
+    import boto3
+    from size_index import SizeLedger
+    index = make_table("index", "bucket_name", "object_key")
+    totals = make_table("totals", "bucket_name")
+    ledger = SizeLedger(boto3.client("dynamodb"), "index", "totals", sleep=sleep)
+    return ledger, ObjectSizeIndex(index), BucketTotals(totals)
+
+
+def test_ledger_applies_puts_overwrites_and_deletes(make_table):
+    ledger, index, totals = make_ledger(make_table)
+    assert ledger.apply("b", {"a": 10, "b": 5}) == (15, 2)
+    assert ledger.apply("b", {"a": 4, "b": None, "missing": None}) == (-11, -1)
+    item = totals.get("b", consistent=True)
+    assert (int(item["total_size"]), int(item["object_count"])) == (4, 1)
+    assert index.record_delete("b", "a") == 4
+
+
+def test_ledger_retry_of_applied_changes_adds_nothing(make_table):
+    ledger, _, totals = make_ledger(make_table)
+    ledger.apply("b", {"a": 10, "gone": 3})
+    ledger.apply("b", {"gone": None})
+    # The SQS retry of a batch whose changes already landed
+    assert ledger.apply("b", {"a": 10, "gone": None}) == (0, 0)
+    item = totals.get("b", consistent=True)
+    assert (int(item["total_size"]), int(item["object_count"])) == (10, 1)
+
+
+def test_ledger_failure_leaves_index_and_totals_untouched(make_table):
+    import boto3
+    import pytest
+    from size_index import SizeLedger
+    index = ObjectSizeIndex(make_table("index", "bucket_name", "object_key"))
+    # The totals table doesn't exist yet, so the transaction fails
+    ledger = SizeLedger(boto3.client("dynamodb"), "index", "totals")
+    with pytest.raises(Exception):
+        ledger.apply("b", {"a": 10})
+    assert index.record_delete("b", "a") is None
+
+    # The retry applies the whole change
+    totals = BucketTotals(make_table("totals", "bucket_name"))
+    assert ledger.apply("b", {"a": 10}) == (10, 1)
+    assert int(totals.get("b", consistent=True)["total_size"]) == 10
+
+
+def test_ledger_rereads_after_a_concurrent_change(make_table):
+    ledger, index, totals = make_ledger(make_table)
+    ledger.apply("b", {"a": 10})
+
+    # Another writer changes the row between this ledger's read and write
+    read_sizes = ledger._read_sizes
+    calls = []
+
+    def racing_read(bucket_name, object_keys):
+        sizes = read_sizes(bucket_name, object_keys)
+        if not calls:
+            ledger.client.transact_write_items(TransactItems=ledger._plan(bucket_name, {"a": 20}, sizes, {})[0]
+                                               + [ledger._totals_update(bucket_name, 10, 0)])
+        calls.append(sizes)
+        return sizes
+
+    ledger._read_sizes = racing_read
+    assert ledger.apply("b", {"a": 25}) == (5, 0)
+    assert len(calls) == 2
+    assert int(totals.get("b", consistent=True)["total_size"]) == 25
+
+
+def test_ledger_splits_large_batches(make_table):
+    ledger, _, totals = make_ledger(make_table)
+    changes = {f"k{i:03d}": 1 for i in range(250)}
+    assert ledger.apply("b", changes) == (250, 250)
+    assert int(totals.get("b", consistent=True)["object_count"]) == 250
+
+
+def test_ledger_raises_marks_with_the_changes(make_table):
+    import boto3
+    from event_ordering import EventOrderer
+    from size_index import SizeLedger
+    make_table("index", "bucket_name", "object_key")
+    totals = BucketTotals(make_table("totals", "bucket_name"))
+    marks = make_table("sequencers", "object_id")
+    ledger = SizeLedger(boto3.client("dynamodb"), "index", "totals", EventOrderer("size", marks))
+
+    assert ledger.apply("b", {"a": 10, "c": 1}, {"a": "05", "c": "01"}) == (11, 2)
+    # Another container already applied a newer event for "a"
+    assert ledger.apply("b", {"a": 99, "c": 2}, {"a": "04", "c": "02"}) == (1, 0)
+    assert ledger.orderer.dropped == 1
+    assert int(totals.get("b", consistent=True)["total_size"]) == 12
+
+    other = EventOrderer("size", marks)
+    assert other.is_stale("b", "c", "02")
+    assert not other.is_stale("b", "c", "03")
+
+
+def test_prune_drops_rows_missing_from_the_page(make_table):
+    index = ObjectSizeIndex(make_table("index", "bucket_name", "object_key"))
+    for key in ("a/1", "a/2", "a/3", "a/9", "b/1", "root"):
+        index.record_put("b", key, 1)
+    listed = [{"Key": "a/1"}, {"Key": "a/3"}]
+
+    # The page covers ("a/0", "a/5"]; "a/9" is for a later page
+    assert index.prune("b", "a/", None, listed, "a/0", "a/5", listed_since=2 ** 40) == 1
+    assert index.record_delete("b", "a/2") is None
+    assert index.record_delete("b", "a/9") == 1
+
+
+def test_prune_on_a_root_page_leaves_rows_below_the_delimiter(make_table):
+    index = ObjectSizeIndex(make_table("index", "bucket_name", "object_key"))
+    for key in ("a/1", "gone", "kept"):
+        index.record_put("b", key, 1)
+    assert index.prune("b", "", "/", [{"Key": "kept"}], None, None, listed_since=2 ** 40) == 1
+    assert index.record_delete("b", "a/1") == 1
+
+
+def test_prune_on_a_root_page_does_not_read_the_listed_prefixes(make_table):
+    table = make_table("index", "bucket_name", "object_key")
+    index = ObjectSizeIndex(table)
+    for key in ("0", "a/1", "a/2", "b", "c/1", "c/2", "gone", "kept"):
+        index.record_put("b", key, 1)
+    read = []
+    query = table.query
+
+    def counting(**kwargs):
+        response = query(**kwargs)
+        read.extend(item["object_key"] for item in response["Items"])
+        return response
+
+    table.query = counting
+    listed = [{"Key": "0"}, {"Key": "b"}, {"Key": "kept"}]
+    assert index.prune("b", "", "/", listed, None, None, 2 ** 40, ["a/", "c/"]) == 1
+    assert sorted(read) == ["0", "b", "gone", "kept"]
+
+
+def test_prune_keeps_rows_written_after_the_listing(make_table):
+    index = ObjectSizeIndex(make_table("index", "bucket_name", "object_key"))
+    index.record_put("b", "new", 1)
+    assert index.prune("b", "", None, [], None, None, listed_since=0) == 0
+    assert index.record_delete("b", "new") == 1
@@ -0,0 +1,127 @@
+import json
+
+import boto3
+import pytest
+
+from budget import Checkpoints
+from size_index import BucketTotals
+
+
+def s3_message(message_id, bucket, key, size):
+    record = {
+        "eventName": "ObjectCreated:Put",
+        "s3": {"bucket": {"name": bucket}, "object": {"key": key, "size": size}},
+    }
+    body = json.dumps({"Message": json.dumps({"Records": [record]})})
+    return {"messageId": message_id, "body": body}
+
+
+@pytest.fixture
+def tables(make_table):
+    make_table("history", "bucket_name", "timestamp", range_type="N")
+    return make_table("totals", "bucket_name")
+
+
+def test_full_mode_writes_totals(aws, tables, load_handler):
+    s3 = boto3.client("s3")
+    s3.create_bucket(Bucket="bkt")
+    s3.put_object(Bucket="bkt", Key="a.txt", Body=b"x" * 10)
+    s3.put_object(Bucket="bkt", Key="dir/b.txt", Body=b"x" * 5)
+    handler = load_handler("size_tracking_lambda", {
+        "DYNAMODB_TABLE_NAME": "history",
+        "TOTALS_TABLE_NAME": "totals",
+        "SIZE_TRACKING_MODE": "full",
+    })
+
+    response = handler.lambda_handler({"Records": [s3_message("m1", "bkt", "a.txt", 10)]}, None)
+
+    assert response == {"batchItemFailures": []}
+    item = BucketTotals(tables).get("bkt")
+    assert (item["total_size"], item["object_count"], item["max_size"]) == (15, 2, 15)
+
+
+def test_totals_table_is_required(aws, load_handler, monkeypatch):
+    monkeypatch.delenv("TOTALS_TABLE_NAME", raising=False)
+    with pytest.raises(KeyError, match="TOTALS_TABLE_NAME"):
+        load_handler("size_tracking_lambda", {"DYNAMODB_TABLE_NAME": "history", "OBJECT_INDEX_TABLE_NAME": "index"})
+
+
+@pytest.fixture
+def incremental(aws, tables, make_table, load_handler):
+    make_table("index", "bucket_name", "object_key")
+    return load_handler("size_tracking_lambda", {
+        "DYNAMODB_TABLE_NAME": "history",
+        "TOTALS_TABLE_NAME": "totals",
+        "OBJECT_INDEX_TABLE_NAME": "index",
+        "SIZE_TRACKING_MODE": "incremental",
+    })
+
+
+def test_history_version_moves_after_the_history_write(incremental, tables):
+    incremental.lambda_handler({"Records": [s3_message("m1", "bkt", "a.txt", 10)]}, None)
+    incremental.lambda_handler({"Records": [s3_message("m2", "bkt", "b.txt", 5)]}, None)
+    item = BucketTotals(tables).get("bkt")
+    assert (item["total_size"], item["history_version"]) == (15, 2)
+
+
+def test_history_version_stays_when_the_history_write_fails(incremental, tables, monkeypatch):
+    def fail(self):
+        raise RuntimeError("throttled")
+    monkeypatch.setattr(incremental.BufferedBatchWriter, "flush", fail)
+
+    response = incremental.lambda_handler({"Records": [s3_message("m1", "bkt", "a.txt", 10)]}, None)
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": "m1"}]}
+    assert "history_version" not in BucketTotals(tables).get("bkt")
+
+
+def test_incremental_mode_requires_the_index_table(aws, load_handler, monkeypatch):
+    monkeypatch.delenv("OBJECT_INDEX_TABLE_NAME", raising=False)
+    monkeypatch.delenv("SIZE_TRACKING_MODE", raising=False)
+    with pytest.raises(KeyError, match="OBJECT_INDEX_TABLE_NAME"):
+        load_handler("size_tracking_lambda", {"DYNAMODB_TABLE_NAME": "history", "TOTALS_TABLE_NAME": "totals"})
+
+
+def test_reconcile_skips_while_another_run_holds_the_checkpoint(aws, tables, make_table, load_handler):
+    boto3.client("s3").create_bucket(Bucket="bkt")
+    checkpoints = Checkpoints(make_table("checkpoints", "job_id"))
+    checkpoints.acquire("reconcile:bkt", "scheduled-run", 60)
+    handler = load_handler("size_tracking_lambda", {
+        "DYNAMODB_TABLE_NAME": "history",
+        "TOTALS_TABLE_NAME": "totals",
+        "CHECKPOINT_TABLE_NAME": "checkpoints",
+        "SIZE_TRACKING_MODE": "full",
+        "BUCKET_NAME": "bkt",
+    })
+
+    assert handler.reconcile_handler({}, None)["statusCode"] == 409
+    assert BucketTotals(tables).get("bkt") == {}
+
+    checkpoints.clear("reconcile:bkt", "scheduled-run")
+    assert handler.reconcile_handler({}, None)["statusCode"] == 200
+    assert checkpoints.load("reconcile:bkt") is None
+
+
+def test_reconcile_drops_index_rows_of_missing_objects(aws, tables, make_table, load_handler):
+    from size_index import ObjectSizeIndex
+    s3 = boto3.client("s3")
+    s3.create_bucket(Bucket="bkt")
+    s3.put_object(Bucket="bkt", Key="dir/kept", Body=b"x" * 4)
+    index = ObjectSizeIndex(make_table("index", "bucket_name", "object_key"))
+    index.record_put("bkt", "dir/kept", 4)
+    # Deleted without a removal event reaching the size tracker
+    index.record_put("bkt", "dir/gone", 7)
+    index.table.update_item(
+        Key={"bucket_name": "bkt", "object_key": "dir/gone"},
+        UpdateExpression="SET updated_at = :t", ExpressionAttributeValues={":t": 0}
+    )
+    handler = load_handler("size_tracking_lambda", {
+        "DYNAMODB_TABLE_NAME": "history",
+        "TOTALS_TABLE_NAME": "totals",
+        "OBJECT_INDEX_TABLE_NAME": "index",
+        "BUCKET_NAME": "bkt",
+    })
+
+    assert handler.reconcile_handler({}, None)["statusCode"] == 200
+    assert index.record_delete("bkt", "dir/gone") is None
+    assert index.record_delete("bkt", "dir/kept") == 4
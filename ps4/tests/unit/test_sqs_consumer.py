@@ -0,0 +1,115 @@
+import json
+
+from event_ordering import EventOrderer, normalize_sequencer
+from sqs_consumer import consume, collect
+
+
+def s3_record(key, sequencer=None, event_name="ObjectCreated:Put", size=1, bucket="b"):
+    obj = {"key": key, "size": size}
+    if sequencer:
+        obj["sequencer"] = sequencer
+    return {"eventName": event_name, "s3": {"bucket": {"name": bucket}, "object": obj}}
+
+
+def message(message_id, *records):
+    body = json.dumps({"Message": json.dumps({"Records": list(records)})})
+    return {"messageId": message_id, "body": body}
+
+
+def sqs_event(*messages):
+    return {"Records": list(messages)}
+
+
+def failures(batch):
+    return [item["itemIdentifier"] for item in batch.response()["batchItemFailures"]]
+
+
+def test_marks_only_advance_for_messages_that_succeed():
+    orderer = EventOrderer("test")
+    event = sqs_event(message("m1", s3_record("a", "01")), message("m2", s3_record("b", "01")))
+    batch = consume(event, lambda record: record["s3"]["object"]["key"], orderer=orderer)
+    # The caller's own write for "b" failed after consume() returned
+    batch.fail(["m2"])
+    assert failures(batch) == ["m2"]
+
+    retry = consume(event, lambda record: record["s3"]["object"]["key"], orderer=orderer)
+    assert [result for _, _, result in retry.results] == ["b"]
+
+
+def test_marks_are_not_advanced_before_response():
+    orderer = EventOrderer("test")
+    event = sqs_event(message("m1", s3_record("a", "01")))
+    consume(event, lambda record: None, orderer=orderer)
+    # Timed out before response(): the redelivery is processed again
+    batch = consume(event, lambda record: None, orderer=orderer)
+    assert len(batch.results) == 1
+
+
+def test_handler_failure_is_retried_not_dropped():
+    orderer = EventOrderer("test")
+    event = sqs_event(message("m1", s3_record("a", "01")))
+
+    def broken(record):
+        raise RuntimeError("boom")
+
+    assert failures(consume(event, broken, orderer=orderer)) == ["m1"]
+    batch = consume(event, lambda record: "ok", orderer=orderer)
+    assert [result for _, _, result in batch.results] == ["ok"]
+    assert failures(batch) == []
+
+
+def test_collect_groups_by_object_in_sequencer_order():
+    event = sqs_event(
+        message("m1", s3_record("a", "03"), s3_record("b", "01")),
+        message("m2", s3_record("a", "02")),
+    )
+    batch, by_object = collect(event)
+    assert [m for m, _ in by_object[("b", "a")]] == ["m2", "m1"]
+    assert list(by_object) == [("b", "a"), ("b", "b")]
+
+
+def test_duplicate_events_are_handled_once():
+    record = s3_record("a", "01")
+    event = sqs_event(message("m1", record), message("m2", record))
+    batch = consume(event, lambda record: "ok")
+    assert len(batch.results) == 1
+    assert batch.duplicates == 1
+
+
+def test_events_without_a_sequencer_are_never_deduplicated():
+    record = s3_record("a")
+    batch = consume(sqs_event(message("m1", record), message("m2", record)), lambda record: "ok")
+    assert len(batch.results) == 2
+    assert batch.duplicates == 0
+
+
+def test_stale_events_are_skipped_with_an_orderer():
+    orderer = EventOrderer("test")
+    orderer.remember("b", "a", normalize_sequencer("05"))
+    event = sqs_event(message("m1", s3_record("a", "04")), message("m2", s3_record("a", "06")))
+    batch = consume(event, lambda record: record["s3"]["object"]["sequencer"], orderer=orderer)
+    assert [result for _, _, result in batch.results] == ["06"]
+
+
+def test_failure_fails_the_later_events_of_the_same_object_only():
+    event = sqs_event(
+        message("m1", s3_record("a", "01")),
+        message("m2", s3_record("a", "02")),
+        message("m3", s3_record("b", "01")),
+    )
+
+    def handle(record):
+        if record["s3"]["object"]["key"] == "a":
+            raise RuntimeError("boom")
+        return "ok"
+
+    batch = consume(event, handle)
+    assert failures(batch) == ["m1", "m2"]
+    assert [m for m, _, _ in batch.results] == ["m3"]
+
+
+def test_malformed_messages_are_dropped_not_retried():
+    event = sqs_event({"messageId": "m1", "body": "not json"}, message("m2", s3_record("a", "01")))
+    batch = consume(event, lambda record: "ok")
+    assert failures(batch) == []
+    assert [m for m, _, _ in batch.results] == ["m2"]